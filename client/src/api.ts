@@ -511,6 +511,7 @@ export type ChangelogEntry = {
 export type ChangelogResponse = {
     fields: string[];
     events: {[key: string]: {[key: string]: (number | null | string)[][]}};
+    cursor: number | null;
 };
 
 export type FeidInfoResponse = {
@@ -523,6 +524,10 @@ export type TableDataResponse = {
     columns: Column[];
     data: (number | string | null)[][];
     changelog: ChangelogResponse | null;
+    version: string | null;
+    delta: boolean;
+    deleted: number[] | null;
+    cursor: string | null;
 };
 
 export type TextTransform = {
@@ -130,7 +130,7 @@ function Panel() {
 			});
 		},
 		onSuccess: (_, group) => {
-			logSuccess(`Bulk obtain finished: ${group}`);
+			logSuccess(`Bulk obtain scheduled: ${group}`);
 			invalidateQueries();
 		},
 		onError: (err: Error) => logError(err.toString()),
@@ -1,5 +1,5 @@
 import numpy as np
-from database import pool
+from database import pool, select_columnar, sql_epoch, sql_float, SQL, IS_WORKER
 
 series = ['a10', 'a10m', 'ax', 'ay', 'az', 'axy', 'phi_axy']
 
@@ -9,18 +9,18 @@ def _init():
 		time TIMESTAMPTZ NOT NULL UNIQUE,
 		{', '.join([s+' REAL' for s in series])},
 		is_gle BOOL NOT NULL DEFAULT 'f')''')
-_init()
+if not IS_WORKER:
+	_init()
 
 def select(interval: tuple[int, int], what=['A0m'], mask_gle=True, with_fields=False):
 	what = [s for s in what if s.lower().replace('a0', 'a10') in series]
 	if len(what) < 1:
 		return ([], []) if with_fields else []
-	with pool.connection() as conn:
-		cols = [f'CASE WHEN is_gle THEN NULL ELSE {w} END' for w in what] if mask_gle else what
-		query = f'''SELECT EXTRACT(EPOCH FROM time)::integer as time, {",".join(cols)}
-			FROM gsm_result WHERE to_timestamp(%s) <= time AND time <= to_timestamp(%s) ORDER BY time'''
-		curs = conn.execute(query, interval)
-		return (curs.fetchall(), [desc.name for desc in curs.description]) if with_fields else curs.fetchall()
+	cols = [SQL(f'CASE WHEN is_gle THEN NULL ELSE {w} END' if mask_gle else w) for w in what] # type: ignore
+	query = SQL('SELECT {} FROM gsm_result WHERE to_timestamp(%s) <= time AND time <= to_timestamp(%s) ORDER BY time')\
+		.format(SQL(',').join([sql_epoch(), *[sql_float(c) for c in cols]]))
+	res = np.column_stack(select_columnar(query, interval, ['i8'] + ['f8'] * len(what))).astype('f8')
+	return (res, ['time', *what]) if with_fields else res
 
 def normalize_variation(data, with_trend=False, to_avg=False):
 	if with_trend:
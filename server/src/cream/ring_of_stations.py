@@ -109,7 +109,7 @@ def get(t_from, t_to, exclude, details, window, user_base, auto_filter):
 	stations = [s for s in database.get_stations(group_partial=True) if s.id.upper() not in exclude] # FIXME
 	directions = np.array([s.drift_longitude for s in stations])
 
-	neutron_data = database.fetch((t_from, t_to), stations)
+	neutron_data, _ = database.fetch((t_from, t_to), stations)
 	neutron_data = np.array(neutron_data, dtype=np.float64)
 	time, data = neutron_data[:,0].astype(np.int64), neutron_data[:,1:]
 	
@@ -145,7 +145,7 @@ def get(t_from, t_to, exclude, details, window, user_base, auto_filter):
 			prec_idx[i] = precursor_idx(*get_xy(i))[0]
 	
 	a0r = compute_a0r(variation)
-	gsm_res = gsm.select([int(time[0]), int(time[-1])], 'A10m')
+	gsm_res = gsm.select([int(time[0]), int(time[-1])], ['A10m'])
 	a0m = None if len(gsm_res) != len(a0r) else gsm_res[:,1]
 	if a0m is not None:
 		base = np.nanmean(a0m[base_idx[0]:base_idx[1]])
@@ -28,7 +28,7 @@ def filter_counts(data):
 
 def fetch_counts(t_from: int, t_to: int):
 	stations = database.get_stations(group_partial=True)
-	data = database.fetch((t_from, t_to), stations)
+	data, _ = database.fetch((t_from, t_to), stations)
 
 	if len(data):
 		data = np.array(data, dtype=np.float64)
@@ -1,7 +1,7 @@
 
 from ftplib import FTP
 import os
-from threading import Thread
+from threading import Thread, Lock
 from datetime import datetime, timedelta, timezone
 from scipy import interpolate, ndimage
 from netCDF4 import Dataset, num2date, date2index
@@ -10,6 +10,7 @@ from database import log
 
 last_downloaded = [datetime(2024, 1, 1)]
 download_progress = {}
+download_lock = Lock()
 
 PATH = os.path.join(os.path.dirname(__file__), '../../../tmp/ncep')
 HOUR = 3600
@@ -30,13 +31,15 @@ def _download(year):
 		log.debug('FTP login: %s', ftp.login())
 		log.info(f'Downloading file: {fname}')
 		ftp.cwd('Datasets/ncep.reanalysis/pressure')
-		download_progress[year] = [0, ftp.size(fname)]
-		if year == datetime.now().year:
-			last_downloaded[0] = datetime.now()
+		with download_lock:
+			download_progress[year] = [0, ftp.size(fname)]
+			if year == datetime.now().year:
+				last_downloaded[0] = datetime.now()
 		with open(os.path.join(PATH, fname), 'wb') as file:
 			def write(data):
 				file.write(data)
-				download_progress[year][0] += len(data)
+				with download_lock:
+					download_progress[year][0] += len(data)
 			ftp.retrbinary(f'RETR {fname}', write)
 		log.info(f'Downloaded file: {fname}')
 	except Exception as err:
@@ -66,15 +69,16 @@ def ensure_downloaded(dt_from, dt_to):
 	progress = {}
 	now = datetime.now()
 	for year in range(dt_from.year, dt_to.year + 1):
-		progr = download_progress.get(year)
-		value = progr and progr[0] / progr[1]
-		if progr and value < 1:
-			progress[year] = value
-		elif (year == now.year and now - last_downloaded[0] > timedelta(hours=2)) \
-				or not os.path.exists(os.path.join(PATH, file_name(year))):
-			Thread(target=_download, args=(year,)).start()
-			download_progress[year] = [0, 1]
-			progress[year] = 0
+		with download_lock:
+			progr = download_progress.get(year)
+			value = progr and progr[0] / progr[1]
+			if progr and value < 1:
+				progress[year] = value
+			elif (year == now.year and now - last_downloaded[0] > timedelta(hours=2)) \
+					or not os.path.exists(os.path.join(PATH, file_name(year))):
+				download_progress[year] = [0, 1]
+				progress[year] = 0
+				Thread(target=_download, args=(year,)).start()
 	return progress if len(progress) > 0 else None
 
 # transform geographical coords to index coords
@@ -1,24 +1,25 @@
 
 import os, time, logging
 from threading import Thread, Lock
-from datetime import datetime
 import numpy as np
 
-from database import pool, upsert_many
+from database import pool, upsert_many, IS_WORKER
 from data.meteo import ncep
 from data.muon.obtain_raw import obtain as obtain_raw
+from utility import SharedStatus
 
 log = logging.getLogger('crdt')
 
 obtain_mutex = Lock()
-obtain_status = { 'status': 'idle' }
+obtain_status = SharedStatus(status='idle')
 
 def _init():
 	with open(os.path.join(os.path.dirname(__file__), './_init_db.sql'), encoding='utf-8') as file:
 		init_text = file.read()
 	with pool.connection() as conn:
 		conn.execute(init_text)
-_init()
+if not IS_WORKER:
+	_init()
 
 def select_experiments():
 	with pool.connection() as conn:
@@ -37,10 +38,9 @@ def select_experiments():
 	return result
 
 def _do_obtain_all(t_from, t_to, experiment, partial):
-	global obtain_status
 	try:
 		with pool.connection() as conn:
-			obtain_status = { 'status': 'busy' }
+			obtain_status.set(status='busy')
 			row = conn.execute('SELECT id, lat, lon, operational_since, operational_until ' + \
 				'FROM muon.experiments e WHERE name = %s', [experiment]).fetchone()
 			if row is None:
@@ -52,54 +52,50 @@ def _do_obtain_all(t_from, t_to, experiment, partial):
 				raise ValueError('Interval too short (out of bounds?)')
 
 			if not partial:
-				obtain_status['message'] = 'obtaining temperature..'
+				obtain_status.update(message='obtaining temperature..')
 				while True:
 					progress, result = ncep.obtain([t_from, t_to], lat, lon)
-					obtain_status['downloading'] = progress
+					obtain_status.update(downloading=progress)
 					if progress is None:
 						break
 					time.sleep(.1)
 				if result is None:
 					raise ValueError('NCEP returned None')
-				t_m = result[:,1]
-				times = np.array([datetime.utcfromtimestamp(t) for t in result[:,0]])
-				data = np.column_stack((times, np.where(np.isnan(t_m), None, t_m))).tolist()
 				upsert_many('conditions_data', ['time', 't_mass_average'],
-					data, constants={ 'experiment': exp_id}, conflict_constraint='time,experiment', schema='muon')
+					{ 'time': result[:,0], 't_mass_average': result[:,1] }, constants={ 'experiment': exp_id}, conflict_constraint='time,experiment', schema='muon')
 			
-			obtain_status['message'] = 'obtaining pressure..'
+			obtain_status.update(message='obtaining pressure..')
 			data = obtain_raw(t_from, t_to, experiment, 'pressure')
 			upsert_many('conditions_data', ['time', 'pressure'],
 				data, constants={ 'experiment': exp_id}, conflict_constraint='time, experiment', schema='muon')
 			
-			obtain_status['message'] = 'obtaining counts..'
+			obtain_status.update(message='obtaining counts..')
 			channels = conn.execute('SELECT id, name FROM muon.channels WHERE experiment = %s', [experiment]).fetchall()
 			for ch_id, ch_name in channels:
-				obtain_status['message'] = 'obtaining counts: ' + ch_name
+				obtain_status.update(message='obtaining counts: ' + ch_name)
 				data = obtain_raw(t_from, t_to, experiment, ch_name)
 				upsert_many('counts_data', ['time', 'original'],
 					data, constants={ 'channel': ch_id }, conflict_constraint='time, channel', schema='muon')
 
-			obtain_status = { 'status': 'ok' }
+			obtain_status.set(status='ok')
 
 	except BaseException as err:
 		log.error('Failed muones obtain_all: %s', str(err))
-		obtain_status = { 'status': 'error', 'message': str(err) }
+		obtain_status.set(status='error', message=str(err))
 		raise err
 
 def obtain_all(t_from, t_to, experiment, partial):
-	global obtain_status
 	with obtain_mutex:
-		if obtain_status['status'] != 'idle':
-			saved = obtain_status
-			if obtain_status['status'] in ['ok', 'error']:
-				obtain_status = { 'status': 'idle' }
+		saved = obtain_status.snapshot()
+		if saved['status'] != 'idle':
+			if saved['status'] in ['ok', 'error']:
+				obtain_status.set(status='idle')
 			return saved
 
-		obtain_status = { 'status': 'busy' }
+		obtain_status.set(status='busy')
 		Thread(target=_do_obtain_all, args=(t_from, t_to, experiment, partial)).start()
 		time.sleep(.1) # meh
-		return obtain_status
+		return obtain_status.snapshot()
 
 def do_revision(t_from, t_to, experiment, channel, action):
 	if action not in ['remove', 'revert']:
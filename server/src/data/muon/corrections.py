@@ -1,6 +1,6 @@
 import logging, json
 from datetime import datetime
-from database import pool
+from database import pool, select_columnar, sql_float, SQL
 import statsmodels.api as sm
 import numpy as np
 
@@ -15,17 +15,16 @@ def _select(t_from, t_to, experiment, channel_name):
 			'''SELECT e.id, c.id, correction_info FROM muon.experiments e
 			JOIN muon.channels c ON e.name = c.experiment
 			WHERE e.name = %s AND c.name = %s''', [experiment, channel_name]).fetchone()
-		res = conn.execute('''SELECT EXTRACT(EPOCH FROM c.time)::integer, original,
-			NULLIF(COALESCE(revised, original), \'NaN\'), pressure, t_mass_average, a10, ax, ay, az
-			FROM muon.counts_data c JOIN muon.conditions_data m
-			ON m.experiment = %s AND c.channel = %s AND c.time = m.time
-			LEFT OUTER JOIN gsm_result g ON g.time = c.time
-			WHERE to_timestamp(%s) <= c.time AND c.time <= to_timestamp(%s)
-			ORDER BY c.time''', [exp_id, ch_id, t_from, t_to]).fetchall()
-	if len(res) < 1:
+	exprs = ['EXTRACT(EPOCH FROM c.time)', 'original', 'COALESCE(revised, original)', 'pressure', 't_mass_average', 'a10', 'ax', 'ay', 'az']
+	query = SQL('''SELECT {} FROM muon.counts_data c JOIN muon.conditions_data m
+		ON m.experiment = %s AND c.channel = %s AND c.time = m.time
+		LEFT OUTER JOIN gsm_result g ON g.time = c.time
+		WHERE to_timestamp(%s) <= c.time AND c.time <= to_timestamp(%s)
+		ORDER BY c.time''').format(SQL(',').join([sql_float(SQL(e)) for e in exprs])) # type: ignore
+	res = select_columnar(query, [exp_id, ch_id, t_from, t_to], ['f8'] * len(fields))
+	if len(res[0]) < 1:
 		return None, None
-	all_data = np.array(res, 'f8')
-	data = { f: all_data[:,i] for i, f in enumerate(fields) }
+	data = dict(zip(fields, res))
 
 	time_of_day = (data['time'] + HOUR / 2) % DAY
 	phi = 2 * np.pi * (time_of_day / DAY)
@@ -5,7 +5,7 @@ from dataclasses import dataclass
 import os
 import numpy as np
 
-from database import log, pool, upsert_many, SQL, Identifier
+from database import IS_WORKER, log, pool, upsert_many, missing_coverage, add_coverage, get_coverage_set, select_columnar, columns_to_rows, sql_epoch, sql_float, SQL, Identifier
 from data.neutron.archive import obtain as obtain_from_archive
 from data.neutron.nmdb import obtain as obtain_from_nmdb
 
@@ -13,9 +13,8 @@ NMDB_SINCE = datetime(2022, 1, 1).replace(tzinfo=timezone.utc).timestamp()
 HOUR = 3600
 MAX_OBTAIN_LENGTH = 31 * 24 * HOUR
 MIN_MINUTES = 20
+COVERAGE_ENT = 'neutron.result'
 obtain_mutex = Lock()
-integrity_full = [None, None]
-integrity_partial = [None, None]
 all_stations = []
 
 @dataclass
@@ -26,26 +25,26 @@ class Station:
 	prefer_nmdb: bool
 
 def _init():
-	global integrity_full, integrity_partial, all_stations
+	global all_stations
 	with open(os.path.join(os.path.dirname(__file__), './_init_db.sql'), encoding='utf-8') as file:
 		init_text = file.read()
 	with pool.connection() as conn:
-		conn.execute(init_text)
+		if not IS_WORKER:
+			conn.execute(init_text)
 		rows = conn.execute('SELECT id, drift_longitude, provides_1min, prefer_nmdb FROM neutron.stations').fetchall()
 		all_stations = [Station(*r) for r in rows]
+		if IS_WORKER: # stations are all compute processes need
+			return
 		for s in all_stations:
 			conn.execute(f'ALTER TABLE neutron.result ADD COLUMN IF NOT EXISTS {s.id} REAL')
 			conn.execute(f'CREATE TABLE IF NOT EXISTS nm.{s.id}_1h (time TIMESTAMPTZ PRIMARY KEY, corrected REAL, revised REAL)')
 			if not s.provides_1min: continue
 			conn.execute(f'CREATE TABLE IF NOT EXISTS nm.{s.id}_1min (time TIMESTAMPTZ PRIMARY KEY, corrected REAL)')
-		ff, ft, pf, pt = conn.execute('SELECT full_from, full_to, partial_from, partial_to FROM neutron.integrity_state').fetchone()
-		integrity_full, integrity_partial = [ff, ft], [pf, pt]
+		pf, pt = conn.execute('SELECT partial_from, partial_to FROM neutron.integrity_state').fetchone()
+	if pf and pt and not len(get_coverage_set(COVERAGE_ENT, group='partial')): # migrate legacy integrity state
+		add_coverage(COVERAGE_ENT, (pf // HOUR * HOUR, pt // HOUR * HOUR), group='partial')
 _init()
 
-def _save_integrity_state():
-	with pool.connection() as conn:
-		conn.execute('UPDATE neutron.integrity_state SET full_from=%s, full_to=%s, partial_from=%s, partial_to=%s', [*integrity_full, *integrity_partial])
-
 def filter_for_integration(data):
 	data[data <= 0] = np.nan
 	std = np.nanstd(data)
@@ -82,30 +81,32 @@ def _obtain_similar(interval, stations, source):
 	res_dt_interval = [src_data[0][0], src_data[-1][0]]
 	log.debug(f'Neutron: got [{len(src_data)} * {len(stations)}] /{src_res}')
 
+	src_times = np.array([d.replace(tzinfo=timezone.utc).timestamp() for d in src_data[:,0]])
+	src_values = src_data[:,1:].astype(float)
+
 	if src_res < HOUR:
-		r_start, r_end = [d.replace(tzinfo=timezone.utc).timestamp() for d in res_dt_interval]
+		r_start, r_end = src_times[0], src_times[-1]
 		first_full_h, last_full_h = ceil(r_start / HOUR) * HOUR, floor((r_end + src_res) / HOUR) * HOUR - HOUR
 		length = (last_full_h - first_full_h) // HOUR + 1
-		data = np.full((length, len(stations)+1), 'o', src_data.dtype)
-		data[:,0] = [datetime.utcfromtimestamp(t) for t in range(first_full_h, last_full_h+1, HOUR)]
+		times = np.arange(first_full_h, last_full_h+1, HOUR)
+		values = np.empty((length, len(stations)))
 		step = floor(HOUR / src_res)
 		offset = floor((first_full_h - r_start) / src_res)
 		for si in range(len(stations)):
-			integrated = (integrate(src_data[offset+i*step:offset+(i+1)*step,si+1].astype(float)) for i in range(length))
-			result = np.fromiter(integrated, 'f8')
-			data[:,si+1] = np.where(~np.isfinite(result), None, result)
+			integrated = (integrate(src_values[offset+i*step:offset+(i+1)*step,si].copy()) for i in range(length))
+			values[:,si] = np.fromiter(integrated, 'f8')
 	else:
-		data = src_data
-		data[:,1:] = np.where(data[:,1:] <= 0, None, data[:,1:])
+		times = src_times
+		values = np.where(src_values <= 0, np.nan, src_values)
 
-	log.debug(f'Neutron: obtained {source} [{len(data)} * {len(stations)}] {res_dt_interval[0]} to {res_dt_interval[1]}')
+	log.debug(f'Neutron: obtained {source} [{len(times)} * {len(stations)}] {res_dt_interval[0]} to {res_dt_interval[1]}')
 	with pool.connection() as conn:
 		for i, station in enumerate(stations):
 			upsert_many(f'{station.lower()}_1h', ['time', 'corrected'],
-				np.column_stack((data[:,0], data[:,1+i])).tolist(), schema='nm', write_nulls=True) # FIXME: should we really write_nulls?
+				{ 'time': times, 'corrected': values[:,i] }, schema='nm', write_nulls=True) # FIXME: should we really write_nulls?
 			if src_res == 60:
 				upsert_many(f'{station.lower()}_1min', ['time', 'corrected'],
-					np.column_stack((src_data[:,0], src_data[:,1+i])).tolist(), schema='nm')
+					{ 'time': src_times, 'corrected': src_values[:,i] }, schema='nm')
 			else:
 				assert src_res == HOUR
 			update_result_table(conn, station, res_dt_interval)
@@ -151,10 +152,10 @@ def obtain_many(interval, stations: list[Station]):
 		
 
 def select(interval, station_ids, description=False):
-	with pool.connection() as conn:
-		curs = conn.execute(f'SELECT EXTRACT(EPOCH FROM time)::integer as time, {",".join(station_ids)} ' + \
-			'FROM neutron.result WHERE to_timestamp(%s) <= time AND time <= to_timestamp(%s) ORDER BY time', [*interval])
-		return curs.fetchall()
+	cols = SQL(',').join([sql_epoch(), *[sql_float(Identifier(s)) for s in station_ids]])
+	query = SQL('SELECT {} FROM neutron.result WHERE to_timestamp(%s) <= time AND time <= to_timestamp(%s) ORDER BY time').format(cols)
+	rows = columns_to_rows(select_columnar(query, [*interval], ['i8'] + ['f8'] * len(station_ids))).tolist()
+	return (rows, ['time', *station_ids]) if description else rows
 
 def fetch(interval: tuple[int, int], stations: list[Station]):
 	interval = (
@@ -162,24 +163,13 @@ def fetch(interval: tuple[int, int], stations: list[Station]):
 		 ceil(min(interval[1], datetime.now().timestamp() - 2*HOUR) / HOUR) * HOUR
 	)
 	group_partial = True # TODO: actually distinguish full and partial integrity
-	global integrity_partial, integrity_full
-
-	with obtain_mutex:
-		ips, ipe = integrity_partial if group_partial else integrity_full
-		satisfied = ips and ipe and ips <= interval[0] and interval[1] <= ipe 
-
-		if not satisfied:
-			req = (
-				ipe if ipe and interval[0] >= ips else interval[0],
-				ips if ips and interval[1] <= ipe else interval[1]
-			)
-			obtain_stations = get_stations(group_partial) # FIXME: ?
-			obtain_many(req, obtain_stations)
-			res_coverage = [min(interval[0], ips or interval[0]), max(ipe or interval[1], interval[1])]
-			if group_partial:
-				integrity_partial = res_coverage
-			else:
-				integrity_full = res_coverage
-			_save_integrity_state()
+	group = 'partial' if group_partial else 'full'
+
+	if interval[0] <= interval[1] and missing_coverage(COVERAGE_ENT, interval, group=group):
+		with obtain_mutex:
+			for gap in missing_coverage(COVERAGE_ENT, interval, group=group):
+				obtain_stations = get_stations(group_partial) # FIXME: ?
+				obtain_many(gap, obtain_stations)
+				add_coverage(COVERAGE_ENT, gap, group=group)
 	
 	return select(interval, [s.id for s in stations], True)
\ No newline at end of file
@@ -79,7 +79,8 @@ def revision(author, comment, stationRevisions):
 			log.info(f'Neutron: inserting revision of length {len(revs)} for {sid.upper()} around {revs[0,0]}')
 			conn.execute('INSERT INTO neutron.revision_log (author, comment, station, rev_time, rev_value)' +\
 				'VALUES (%s, %s, %s, %s, %s)', [author, comment, sid, revs[:,0].tolist(), revs[:,1].tolist()])
-			upsert_many(f'{sid}_1h', ['time', 'revised'], revs.tolist(), schema='nm', write_nulls=True)
+			data = { 'time': np.array(stationRevisions[sid], dtype='f8')[:,0], 'revised': revs[:,1].astype('f8') }
+			upsert_many(f'{sid}_1h', ['time', 'revised'], data, schema='nm', write_nulls=True)
 			update_result_table(conn, sid, [revs[0,0], revs[-1,0]])
 
 def revert_revision(rid):
@@ -0,0 +1,162 @@
+from dataclasses import dataclass, field
+from threading import Lock, Event, Timer
+from concurrent.futures import ThreadPoolExecutor
+from typing import Literal
+from time import time
+import traceback
+
+from database import log, add_coverage, IntervalSet
+from data.omni.variables import OMNI_TABLE, GROUP, GROUP_SOURCES, SOURCE
+from data.omni.obtain import obtain, PERIOD
+
+CHUNK_LEN = 1000 * 24 * PERIOD
+MAX_ATTEMPTS = 4
+RETRY_BACKOFF = 15 # seconds, doubled on every next attempt
+WAIT_TIMEOUT = 30 # readers get what is there by then, retries go on in the background
+KEEP_FINISHED_JOBS = 16
+
+# NOTE: only coverage sources are fetched in bulk, CRS and NOAA come through realtime fetches
+UPSTREAMS = {
+	SOURCE.omniweb: 'omniweb',
+	SOURCE.SWTY: 'iki',
+}
+UPSTREAM_LIMITS = {
+	'omniweb': 2,
+	'iki': 1,
+}
+
+def coverage_source(group: GROUP):
+	return SOURCE.SWTY if group == GROUP.SWTY else SOURCE.omniweb
+
+@dataclass(eq=False)
+class Chunk:
+	interval: tuple[int, int]
+	groups: list[GROUP]
+	source: SOURCE
+	status: Literal['pending', 'running', 'retrying', 'done', 'failed'] = 'pending'
+	attempts: int = 0
+	count: int = 0
+	error: str | None = None
+	done: Event = field(default_factory=Event, repr=False)
+
+	def as_dict(self):
+		return {
+			'from': self.interval[0],
+			'to': self.interval[1],
+			'source': str(self.source.value),
+			'groups': [str(g.value) for g in self.groups],
+			'status': self.status,
+			'attempts': self.attempts,
+			'count': self.count,
+			'error': self.error
+		}
+
+@dataclass(eq=False)
+class IngestJob:
+	id: int
+	description: str
+	chunks: list[Chunk]
+	started: float = field(default_factory=time)
+
+	def finished(self):
+		return all(c.done.is_set() for c in self.chunks)
+
+	def as_dict(self):
+		statuses = [c.status for c in self.chunks]
+		return {
+			'id': self.id,
+			'description': self.description,
+			'started': self.started,
+			'status': 'working' if not self.finished() else 'error' if 'failed' in statuses else 'done',
+			'progress': statuses.count('done') / (len(statuses) or 1),
+			'failed': statuses.count('failed'),
+			'chunks': [c.as_dict() for c in self.chunks]
+		}
+
+class IngestScheduler:
+	def __init__(self):
+		self.lock = Lock()
+		self.executors = { up: ThreadPoolExecutor(max_workers=lim, thread_name_prefix=f'omni-{up}') for up, lim in UPSTREAM_LIMITS.items() }
+		self.active: list[Chunk] = []
+		self.jobs: list[IngestJob] = []
+		self.last_job_id = 0
+
+	def _run(self, chunk: Chunk):
+		with self.lock:
+			chunk.status = 'running'
+			chunk.attempts += 1
+		try:
+			count = obtain(chunk.interval, chunk.groups, chunk.source)
+			for group in chunk.groups:
+				add_coverage(OMNI_TABLE, chunk.interval, coverage_source(group), group)
+			with self.lock:
+				chunk.count, chunk.status = count, 'done'
+		except Exception as e:
+			log.error('Omni: chunk %s:%s from %s failed (attempt %s): %s', *chunk.interval, chunk.source, chunk.attempts, str(e))
+			retry = chunk.attempts < MAX_ATTEMPTS
+			with self.lock:
+				chunk.error = str(e)
+				chunk.status = 'retrying' if retry else 'failed'
+			if retry:
+				delay = RETRY_BACKOFF * 2 ** (chunk.attempts - 1)
+				Timer(delay, self._submit, [chunk]).start()
+				return
+			traceback.print_exc()
+
+		with self.lock:
+			self.active.remove(chunk)
+		chunk.done.set()
+
+	def _submit(self, chunk: Chunk):
+		self.executors[UPSTREAMS[chunk.source]].submit(self._run, chunk)
+
+	def _plan(self, parts: list[tuple[tuple[int, int], list[GROUP]]]):
+		''' split requested intervals into new chunks, reusing chunks which are already in flight '''
+		waiting: list[Chunk] = []
+		to_fetch: dict[tuple[SOURCE, tuple[int, int]], list[GROUP]] = {}
+		for interval, groups in parts:
+			for group in groups:
+				source = SOURCE.omniweb if SOURCE.omniweb in GROUP_SOURCES[group] else coverage_source(group)
+				in_flight = [c for c in self.active if c.source == source and group in c.groups]
+				waiting += [c for c in in_flight if c.interval[0] <= interval[1] and interval[0] <= c.interval[1] and c not in waiting]
+				busy = IntervalSet(PERIOD, [c.interval for c in in_flight])
+				for gap in busy.missing(*interval):
+					to_fetch.setdefault((source, gap), []).append(group)
+
+		planned: list[Chunk] = []
+		for (source, (gap_start, gap_end)), groups in to_fetch.items():
+			for start in range(gap_start, gap_end + 1, CHUNK_LEN):
+				end = min(start + CHUNK_LEN - PERIOD, gap_end)
+				planned.append(Chunk((start, end), groups, source))
+		return planned, waiting
+
+	def submit(self, parts: list[tuple[tuple[int, int], list[GROUP]]], description: str = ''):
+		with self.lock:
+			planned, waiting = self._plan(parts)
+			self.active.extend(planned)
+			self.last_job_id += 1
+			job = IngestJob(self.last_job_id, description, planned + waiting)
+			finished = [j for j in self.jobs if j.finished()]
+			for old in finished[:max(0, len(finished) - KEEP_FINISHED_JOBS)]:
+				self.jobs.remove(old)
+			self.jobs.append(job)
+
+		if planned:
+			log.info(f'Omni: scheduled [{len(planned)}] chunks ({description})')
+		for chunk in planned:
+			self._submit(chunk)
+		return job
+
+	def wait(self, job: IngestJob, timeout: float | None = None):
+		''' returns whether the job finished in time '''
+		deadline = None if timeout is None else time() + timeout
+		for chunk in job.chunks:
+			if not chunk.done.wait(None if deadline is None else max(0, deadline - time())):
+				return False
+		return True
+
+	def status(self):
+		with self.lock:
+			return [j.as_dict() for j in self.jobs]
+
+scheduler = IngestScheduler()
@@ -1,8 +1,9 @@
-from datetime import datetime, timedelta, timezone, time
+from datetime import datetime, timezone, time
 import os, re, traceback
 from math import floor, ceil
 from threading import Lock
 import requests, pymysql
+import numpy as np
 
 from database import log, upsert_many
 from data.omni.derived import compute_derived
@@ -32,23 +33,17 @@ def _obtain_omniweb(vars: list[OmniVariable], interval: tuple[datetime, datetime
 	}, timeout=5, proxies=omniweb_proxies)
 	if r.status_code != 200:
 		log.warning('Omniweb: query failed - HTTP %s', r.status_code)
+		raise Exception(f'Omniweb: HTTP {r.status_code}')
 
-	data = None
+	lines = None
 	line: str
 	for line in r.iter_lines(decode_unicode=True): # type: ignore
-		if data is not None:
+		if lines is not None:
 			if not line or '</pre>' in line:
 				break
-			try:
-				split = line.split()
-				time = datetime(int(split[0]), 1, 1, tzinfo=timezone.utc) + timedelta(days=int(split[1])-1, hours=int(split[2]))
-				row = [time] + [(int(v) if c.is_int else float(v)) if v != c.omniweb_stub else None for v, c in zip(split[3:], vars)]
-				data.append(row)
-			except:
-				traceback.print_exc()
-				log.error('Omniweb: failed to parse line:\n %s', line)
+			lines.append(line)
 		elif 'YEAR DOY HR' in line:
-			data = [] # start reading data
+			lines = [] # start reading data
 		elif 'INVALID' in line:
 			correct_range = re.findall(r' (\d+)', line)
 			new_range = [datetime.strptime(s, '%Y%m%d').replace(tzinfo=timezone.utc) for s in correct_range]
@@ -57,7 +52,22 @@ def _obtain_omniweb(vars: list[OmniVariable], interval: tuple[datetime, datetime
 				return None
 			log.info(f'Omniweb: correcting range to fit {correct_range[0]}:{correct_range[1]}')
 			return _obtain_omniweb(vars, (max(new_range[0], interval[0]), min(new_range[1], interval[1])))
-	return data
+
+	n_cols = 3 + len(vars)
+	valid = [l for l in lines or [] if len(l.split()) == n_cols]
+	if len(valid) < len(lines or []):
+		log.error('Omniweb: skipped [%s] malformed lines', len(lines or []) - len(valid))
+	if not valid:
+		return None
+
+	table = np.array(' '.join(valid).split(), dtype='f8').reshape(-1, n_cols)
+	days = (table[:,0].astype('i8') - 1970).astype('datetime64[Y]').astype('datetime64[D]').astype('i8')
+	time = (days + table[:,1].astype('i8') - 1) * 86400 + table[:,2].astype('i8') * 3600
+
+	values = table[:,3:]
+	stubs = np.array([float(v.omniweb_stub) if v.omniweb_stub else np.nan for v in vars])
+	values[values == stubs] = np.nan
+	return time, values
 
 def _obtain_crs(source: SOURCE, vars: list[OmniVariable], interval: tuple[datetime, datetime]):
 	conn = None
@@ -117,29 +127,45 @@ def _obtain_noaa_hapi(vars: list[OmniVariable], interval: tuple[datetime, dateti
 
 	if r.status_code != 200:
 		log.error('NOAA/hapi: query failed - HTTP %s', r.status_code)
-		return vars, None
+		raise Exception(f'NOAA/hapi: HTTP {r.status_code}')
 
-	data = []
 	ordered_vars: list[OmniVariable] = []
-	sc_id_idx = None
-
+	lines = []
 	line: str
 	for line in r.iter_lines(decode_unicode=True): # type: ignore
 		if not line: continue
-		split = line.split(',')
-		if not ordered_vars or sc_id_idx is None:
-			ordered_vars = [next((v for v in vars if v.noaa_name == name)) for name in split[1:]]
-			sc_id_idx = next((i for i, v in enumerate(ordered_vars) if v.name.startswith('sc_id')))
+		if not ordered_vars:
+			ordered_vars = [next((v for v in vars if v.noaa_name == name)) for name in line.split(',')[1:]]
 			continue
+		lines.append(line)
+	if not lines:
+		return ordered_vars, None
+
+	table = np.array(','.join(lines).split(','), dtype=object).reshape(-1, 1 + len(ordered_vars))
+	time = np.char.rstrip(table[:,0].astype('U'), 'Z').astype('datetime64[s]').astype('i8')
+	values = np.where(table[:,1:] == 'null', 'nan', table[:,1:]).astype('f8')
+
+	sc_id_idx = next((i for i, v in enumerate(ordered_vars) if v.name.startswith('sc_id')))
+	uniq, inverse = np.unique(values[:,sc_id_idx], return_inverse=True)
+	names = [noaa_hapi_spacecraft_id.get(int(u)) if np.isfinite(u) else None for u in uniq]
+	values[:,sc_id_idx] = np.array([spacecraft_id[n] if n else 99 for n in names], dtype='f8')[inverse]
+
+	return ordered_vars, (time, values)
+
+def _rows_to_columns(rows: list | None):
+	if not rows:
+		return None
+	def epoch(t: datetime | str):
+		if isinstance(t, str):
+			t = datetime.fromisoformat(t)
+		return int(t.replace(tzinfo=t.tzinfo or timezone.utc).timestamp())
+	time = np.array([epoch(r[0]) for r in rows], dtype='i8')
+	try:
+		values = np.array([r[1:] for r in rows], dtype='f8')
+	except (ValueError, TypeError): # text columns (SWTY)
+		values = np.array([r[1:] for r in rows], dtype=object)
+	return time, values
 
-		date = datetime.strptime(split[0], '%Y-%m-%dT%H:%M:%SZ')
-		row = [date] + [None if s == 'null' else float(s) for s in split[1:]]
-		sc_name = noaa_hapi_spacecraft_id.get(int(split[sc_id_idx+1]))
-		row[sc_id_idx+1] = spacecraft_id[sc_name] if sc_name else 99
-		data.append(row)
-
-	return ordered_vars, data
-	
 def _obtain_yermolaev(interv):
 	batches = [obtain_yermolaev_types(y) for y in range(interv[0].year, interv[1].year + 1)]
 	return [d for dt in batches for d in dt or []]
@@ -160,22 +186,23 @@ def obtain(interval: tuple[int, int], groups: list[GROUP], source: SOURCE, overw
 	if source == SOURCE.omniweb:
 		res = _obtain_omniweb(vars, dt_interval)
 	elif source == SOURCE.SWTY:
-		res = _obtain_yermolaev(dt_interval)
+		res = _rows_to_columns(_obtain_yermolaev(dt_interval))
 	elif source == SOURCE.NOAA:
 		vars = [v for v in vars if v.noaa_name]
 		vars, res = _obtain_noaa_hapi(vars, dt_interval)
 	elif source in [SOURCE.ACE, SOURCE.geomag, SOURCE.F107]:
 		vars = [v for v in vars if v.crs_name and not v.name.startswith('sc_id')]
-		res = _obtain_crs(source, vars, dt_interval)
+		res = _rows_to_columns(_obtain_crs(source, vars, dt_interval))
 	else:
 		assert not 'reached'
 
-	if not res:
+	if res is None or not len(res[0]):
 		log.warning('Omni: got no data')
 		return 0
 
+	time, values = res
 	col_names = [var.name for var in vars]
-	data, col_names = compute_derived(res, col_names)
+	values, col_names = compute_derived(values, col_names)
 	constants = {}
 
 	if source in [SOURCE.ACE]:
@@ -184,10 +211,12 @@ def obtain(interval: tuple[int, int], groups: list[GROUP], source: SOURCE, overw
 			if not group in groups: continue
 			sc_id_col = 'sc_id_' + str(group.value).lower()
 			constants[sc_id_col] = sc_id
-			
+
 	grps = ','.join([str(g.value).upper() for g in groups if next((v for v in vars if v.group == g), None)])
-	log.info(f'Omni: {"hard " if overwrite else ""}upserting {grps} from {str(source).upper()}: [{len(data)}] from {data[0][0]} to {data[-1][0]}')
+	log.info(f'Omni: {"hard " if overwrite else ""}upserting {grps} from {str(source).upper()}: [{len(time)}] from {dt(time[0])} to {dt(time[-1])}')
 
-	upsert_many('omni', ['time', *col_names], data, constants=constants, write_nulls=overwrite, write_values=overwrite, schema='public')
+	data = { 'time': time, **{ name: values[:,i] for i, name in enumerate(col_names) } }
+	res = upsert_many('omni', ['time', *col_names], data, constants=constants, write_nulls=overwrite, write_values=overwrite, schema='public')
+	log.debug(f'Omni: {grps} inserted [{res.inserted}], updated [{res.updated}], unchanged [{res.unchanged}]')
 
-	return len(data)
+	return len(time)
@@ -1,14 +1,26 @@
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor
-from threading import Lock
 from datetime import datetime, timezone
+from math import floor, ceil
 
-from database import pool, log, get_coverage, upsert_coverage, SQL, Identifier, CoverageResponse
-from data.omni.variables import OMNI_TABLE, GROUP, SOURCE, omni_variables, get_vars
+from database import pool, log, get_coverage, get_coverage_set, missing_coverage, add_coverage, coverage_span, notify_changed, select_columnar, columns_to_rows, sql_epoch, sql_float, SQL, Identifier, CoverageResponse, IS_WORKER
+from data.omni.variables import OMNI_TABLE, GROUP, omni_variables, get_vars
 from data.omni.realtime import fetch_realtime
-from data.omni.obtain import obtain
+from data.omni.obtain import PERIOD
+from data.omni.ingest import scheduler, coverage_source, WAIT_TIMEOUT
 
-obtain_lock = Lock()
+def _migrate_legacy_coverage():
+	''' legacy single interval coverage of the whole table becomes coverage of every group, once '''
+	if any(len(get_coverage_set(OMNI_TABLE, coverage_source(g), g)) for g in GROUP):
+		return
+	for start, end, _ in get_coverage(OMNI_TABLE):
+		if end is None:
+			continue
+		interval = (int(start.timestamp()) // PERIOD * PERIOD, int(end.timestamp()) // PERIOD * PERIOD)
+		for group in GROUP:
+			add_coverage(OMNI_TABLE, interval, coverage_source(group), group)
+		log.info('Omni: migrated legacy coverage %s:%s', *interval)
+if not IS_WORKER:
+	_migrate_legacy_coverage()
 
 def remove(interval: tuple[int, int], groups: list[GROUP]):
 	col_names = [var.name for var in get_vars(groups)]
@@ -16,7 +28,8 @@ def remove(interval: tuple[int, int], groups: list[GROUP]):
 		setters = SQL(',').join([SQL('{} = NULL').format(col) for col in col_names])
 		query = SQL(f'UPDATE {OMNI_TABLE} SET {{}} WHERE to_timestamp(%s) <= time AND time <= to_timestamp(%s)').format(setters)
 		curs = conn.execute(query, interval)
-		return curs.rowcount
+	notify_changed('public', OMNI_TABLE, interval)
+	return curs.rowcount
 		
 def insert(var, data):
 	raise NotImplementedError()
@@ -34,6 +47,9 @@ def select(interval: tuple[int, int], query: list[str], realtime=False):
 	if realtime and interval[1] > datetime.now(timezone.utc).timestamp():
 		fetch_realtime()
 
+	if 'SWTY' not in columns:
+		return columns_to_rows(select_numeric(interval, columns)), ['time', *columns]
+
 	with pool.connection() as conn:
 		cols = SQL(',').join([Identifier(c) for c in columns])
 		curs = conn.execute(SQL(f'SELECT EXTRACT(EPOCH FROM time)::integer as time, {{}} FROM {OMNI_TABLE} ' +
@@ -41,44 +57,43 @@ def select(interval: tuple[int, int], query: list[str], realtime=False):
 		data, fields = np.array(curs.fetchall(), dtype='object'), curs.description and [desc[0] for desc in curs.description]
 	return (data, fields)
 
-def _bulk_obtain_impl(interval: tuple[int, int], groups: list[GROUP]):
-	fetch_start, fetch_end = interval
-	log.info(f'Omni: beginning bulk fetch {datetime.fromtimestamp(fetch_start, timezone.utc)}:{datetime.fromtimestamp(fetch_end, timezone.utc)}')
-	batch_size = 3600 * 24 * 1000
-	with ThreadPoolExecutor(max_workers=4) as executor:
-		for start in range(fetch_start, fetch_end+1, batch_size):
-			end = start + batch_size
-			interv = (start, end if end < fetch_end else fetch_end)
-			executor.submit(obtain, interv, groups, SOURCE.omniweb)
-			if GROUP.SWTY in groups:
-				executor.submit(obtain, interv, [GROUP.SWTY], SOURCE.SWTY)
-	log.info('Omni: bulk fetch finished')
+def select_numeric(interval: tuple[int, int], columns: list[str]):
+	cols = SQL(',').join([sql_epoch(), *[sql_float(Identifier(c)) for c in columns]])
+	query = SQL(f'SELECT {{}} FROM {OMNI_TABLE} WHERE to_timestamp(%s) <= time AND time <= to_timestamp(%s) ORDER BY time').format(cols)
+	return select_columnar(query, interval, ['i8'] + ['f8'] * len(columns))
 
 def bulk_obtain(group: GROUP):
 	t_from = datetime(1957, 1, 1, tzinfo=timezone.utc).timestamp()
 	t_to = datetime.now(timezone.utc).timestamp()
-	with obtain_lock:
-		_bulk_obtain_impl((int(t_from), int(t_to)), [group])
+	interval = (int(t_from) // PERIOD * PERIOD, int(t_to) // PERIOD * PERIOD)
+	job = scheduler.submit([(interval, [group])], f'bulk {str(group.value).upper()}')
+	return job.as_dict()
+
+def ingest_status():
+	return { 'jobs': scheduler.status() }
+
+def _coverage_response(groups: list[GROUP]):
+	spans = [coverage_span(OMNI_TABLE, coverage_source(g), g) for g in groups]
+	if not all(span for span, _ in spans):
+		return CoverageResponse(0, None, 0).to_dict()
+	start = max(span[0] for span, _ in spans) # type: ignore
+	end = min(span[1] for span, _ in spans) # type: ignore
+	return CoverageResponse(start, end, max(at or 0 for _, at in spans)).to_dict()
+
+def ensure_prepared(interval: tuple[int, int], trust=False, groups: list[GROUP] | None = None):
+	groups = groups or [g for g in GROUP]
+	interval = (floor(interval[0] / PERIOD) * PERIOD, ceil(interval[1] / PERIOD) * PERIOD)
+
+	if trust:
+		log.info(f'Omni: force setting coverarge to {interval[0]}:{interval[1]}')
+		for group in groups:
+			add_coverage(OMNI_TABLE, interval, coverage_source(group), group, replace=True)
+		return _coverage_response(groups)
 
-def ensure_prepared(interval: tuple[int, int], trust=False):
-	t_start, t_end = interval
-	with obtain_lock:
-		if not trust:
-			coverage = get_coverage(OMNI_TABLE)
-			cov_start, cov_end, cov_at = [dt and int(dt.timestamp()) for dt in coverage[0]] if coverage else [None, None, None]
-			if cov_start and cov_end and cov_at:
-				if cov_start <= t_start and cov_end >= t_end:
-					return CoverageResponse(cov_start, cov_end, cov_at).to_dict()
-				res_start = min(cov_start, t_start)
-				fetch_start, fetch_end = cov_end if cov_start <= t_start else t_start, t_end
-			else:
-				res_start = fetch_start = t_start
-				fetch_end = t_end
-				
-			_bulk_obtain_impl(interval, [g for g in GROUP])
-		else:
-			res_start, fetch_end = interval
-			log.info(f'Omni: force setting coverarge to {res_start}:{fetch_end}')
+	to_fetch = [(gap, [group]) for group in groups for gap in missing_coverage(OMNI_TABLE, interval, coverage_source(group), group)]
+	if to_fetch:
+		job = scheduler.submit(to_fetch, f'ensure {interval[0]}:{interval[1]}')
+		if not scheduler.wait(job, WAIT_TIMEOUT):
+			log.warning('Omni: %s not ready in %ss, serving partial data', job.description, WAIT_TIMEOUT)
 
-		upsert_coverage(OMNI_TABLE, res_start, fetch_end, single=True)
-	return CoverageResponse(res_start, fetch_end, int(datetime.now().timestamp())).to_dict()
\ No newline at end of file
+	return _coverage_response(groups)
@@ -1,4 +1,5 @@
-import requests
+import traceback
+import http_client
 from datetime import datetime, timezone
 from threading import Lock
 from concurrent.futures import ThreadPoolExecutor
@@ -19,7 +20,7 @@ def obtain_kyoto():
 	date = datetime.now(timezone.utc)
 	dt = date.strftime('%Y%m')
 	url = f'{kyoto_url}/{dt}/dst{dt[2:]}.for.request'
-	res = requests.get(url)
+	res = http_client.get(url)
 
 	if res.status_code != 200:
 		return log.error('realtime/kyoto: %s HTTP %s', url, str(res.status_code))
@@ -35,11 +36,11 @@ def obtain_kyoto():
 			if value == 9999: break
 			data.append((time, value))
 
-	log.info('realtime/kyoto: fetched [%s] Dst values up to %s', len(data), str(data[-1][0]) if data else '')
-	upsert_many('omni', ['time', 'Dst'], data, write_values=True, schema='public')
+	res = upsert_many('omni', ['time', 'Dst'], data, write_values=True, schema='public')
+	log.info('realtime/kyoto: fetched [%s] Dst values up to %s, changed [%s]', len(data), str(data[-1][0]) if data else '', res.changed)
 
 def obtain_gfz():
-	res = requests.get(gfz_url)
+	res = http_client.get(gfz_url)
 	if res.status_code != 200:
 		return log.error('realtime/gfz: HTTP %s', str(res.status_code))
 
@@ -55,8 +56,8 @@ def obtain_gfz():
 			tst = date.replace(hour=date.hour + hour_i)
 			data.append((tst, kp, ap))
 
-	log.info('realtime/gfz: fetched [%s] kp,ap values up to %s', len(data), str(data[-1][0]) if data else '')
-	upsert_many('omni', ['time', 'Kp', 'Ap'], data, write_values=True, schema='public')
+	res = upsert_many('omni', ['time', 'Kp', 'Ap'], data, write_values=True, schema='public')
+	log.info('realtime/gfz: fetched [%s] kp,ap values up to %s, changed [%s]', len(data), str(data[-1][0]) if data else '', res.changed)
 
 def obtain_noaa_sw():
 	now = int(datetime.now(timezone.utc).timestamp())
@@ -68,6 +69,13 @@ def obtain_f107():
 	interval = (now - NOAA_REFETCH_WINDOW, now)
 	obtain(interval, [GROUP.IDX], SOURCE.F107, True)
 
+def _safe_call(func):
+	try:
+		func()
+	except Exception as e:
+		traceback.print_exc()
+		log.error('realtime: %s failed: %s', func.__name__, str(e))
+
 def fetch_realtime():
 	global last_fetch_time
 	with lock:
@@ -76,4 +84,4 @@ def fetch_realtime():
 			return
 		last_fetch_time = now
 		with ThreadPoolExecutor() as executor:
-			list(executor.map(lambda f: f(), [obtain_kyoto, obtain_gfz, obtain_noaa_sw, obtain_f107]))
+			list(executor.map(_safe_call, [obtain_kyoto, obtain_gfz, obtain_noaa_sw, obtain_f107]))
@@ -1,4 +1,4 @@
-import requests
+import http_client
 import numpy as np
 from database import log
 from datetime import datetime, timedelta, timezone
@@ -38,10 +38,13 @@ def obtain_yermolaev_types(year: int):
 		return None
 	log.debug('Obtaining yermolaev sw types from iki.rssi.ru [%s]', year)
 	uri = f'http://iki.rssi.ru/omni/catalog/{year}/{year}swgr.txt'
-	res = requests.get(uri, stream=True, timeout=5000)
+	res = http_client.get(uri, ttl=http_client.settled_ttl(datetime(year + 1, 1, 1), http_client.DAY), timeout=5000)
+	if res.status_code == 404:
+		log.debug('No sw types on iki.rssi.ru for %s', year)
+		return None
 	if res.status_code != 200:
 		log.error('Failed to get iki.rssi.ru - HTTP %s', res.status_code)
-		return None
+		raise Exception(f'iki.rssi.ru: HTTP {res.status_code}')
 
 	data = []
 	for line in res.iter_lines(decode_unicode=True):
@@ -2,7 +2,7 @@ import os, re
 from dataclasses import dataclass
 from enum import StrEnum
 
-from database import pool, SQL, Identifier
+from database import pool, SQL, Identifier, IS_WORKER
 
 OMNI_TABLE = 'omni'
 GROUP = StrEnum('GROUP', ['SW', 'IMF', 'IDX', 'SWTY'])
@@ -103,7 +103,8 @@ def _init_db():
 		conn.execute(SQL(f'CREATE TABLE IF NOT EXISTS {OMNI_TABLE} (\ntime TIMESTAMPTZ PRIMARY KEY, {{}})').format(SQL(',\n').join(col_defs)))
 		for col in col_defs:
 			conn.execute(SQL(f'ALTER TABLE {OMNI_TABLE} ADD COLUMN IF NOT EXISTS {{}}').format(col))
-_init_db()
+if not IS_WORKER:
+	_init_db()
 
 def get_vars(groups: list[GROUP], source: SOURCE | None = None, include_derived=True):
 	if source == SOURCE.F107:
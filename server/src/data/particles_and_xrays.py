@@ -1,9 +1,10 @@
 import os
-from datetime import datetime
+from datetime import datetime, timezone
+from threading import Lock
 import numpy as np
 import pymysql
 
-from database import pool, log, upsert_many, SQL, Identifier
+from database import pool, log, upsert_many, missing_coverage, add_coverage, get_coverage_set, select_columnar, sql_float, SQL, Identifier, IS_WORKER
 
 T_PART = 'sat_particles'
 T_XRAY = 'sat_xrays'
@@ -34,6 +35,11 @@ XRAYS = {
 	'l': '0.1-0.8 nm'
 }
 GOES_X_EPOCH = datetime(2009, 11, 26)
+HOUR = 3600
+COVERAGE_LAG = 2 * HOUR # recent data is still being written upstream
+OBTAIN_CHUNK = 30 * 24 * HOUR # bounds a single crs fetch and upsert
+
+obtain_lock = Lock()
 
 def _init():
 	with pool.connection() as conn:
@@ -41,7 +47,22 @@ def _init():
 		for c in PARTICLES:
 			conn.execute(SQL(f'ALTER TABLE {T_PART} ADD COLUMN IF NOT EXISTS {{}} real').format(Identifier(c)))
 		conn.execute(f'CREATE TABLE IF NOT EXISTS {T_XRAY} (time timestamptz primary key, s real, l real)')
-_init()
+
+def _seed_coverage():
+	''' data obtained before coverage was tracked is considered covered from its first to last hour, once '''
+	for table in [T_PART, T_XRAY]:
+		if len(get_coverage_set(table, 'goes')):
+			continue
+		with pool.connection() as conn:
+			start, end = conn.execute(f'SELECT EXTRACT(EPOCH FROM MIN(time))::int8, EXTRACT(EPOCH FROM MAX(time))::int8 FROM {table}').fetchone() # type: ignore
+		if start is None or end // HOUR - start // HOUR < 1:
+			continue
+		interval = (start // HOUR * HOUR, end // HOUR * HOUR - HOUR) # the last hour may be incomplete
+		add_coverage(table, interval, 'goes')
+		log.info('GOES: seeded %s coverage %s:%s', table, *interval)
+if not IS_WORKER:
+	_init()
+	_seed_coverage()
 
 def _obtain_goes(which, t_from, t_to):
 	xra = which == 'xrays'
@@ -60,24 +81,49 @@ def _obtain_goes(which, t_from, t_to):
 		with conn.cursor() as cursor:
 			q = f'SELECT dt, {",".join(cols)} FROM {table} WHERE dt >= %s AND dt < %s'
 			cursor.execute(q, [dt_from, dt_to])
-			data = np.array(cursor.fetchall())
-			if len(data):
-				data[:,1:][data[:,1:] < 0] = None
-				upsert_many(T_XRAY if xra else T_PART, ['time', *cols], data.tolist(), schema='public')
+			rows = cursor.fetchall()
+			if len(rows):
+				times = np.array([r[0].replace(tzinfo=timezone.utc).timestamp() for r in rows])
+				values = np.array([r[1:] for r in rows], dtype='f8')
+				values[values < 0] = np.nan
+				data = { 'time': times, **{ c: values[:,i] for i, c in enumerate(cols) } }
+				upsert_many(T_XRAY if xra else T_PART, ['time', *cols], data, schema='public')
 			else:
 				log.debug('GOES: empty response')
+		return True
 	except Exception as e:
 		log.error(f'GOES: failed to obtain (crs): {e}')
+		return False
 	finally:
 		log.debug('GOES: obtained %s', which)
 		if conn: conn.close()
 
-def fetch(which, t_from, t_to, query=['p1', 'p5', 'p7'], obtain=True):
+def _ensure_obtained(which, interval: tuple[int, int]):
+	table = T_XRAY if which == 'xrays' else T_PART
+	t_now = int(datetime.now(timezone.utc).timestamp()) // HOUR * HOUR
+	interval = (int(interval[0]) // HOUR * HOUR, int(min(interval[1], t_now - COVERAGE_LAG)) // HOUR * HOUR)
+	if interval[1] < interval[0] or not missing_coverage(table, interval, 'goes'):
+		return
+
+	epoch = int(GOES_X_EPOCH.replace(tzinfo=timezone.utc).timestamp())
+	with obtain_lock:
+		for gap in missing_coverage(table, interval, 'goes'):
+			# NOTE: chunks never cross GOES_X_EPOCH, since older xrays live in another table
+			bounds = sorted({ *range(gap[0], gap[1] + HOUR, OBTAIN_CHUNK), *([epoch] if gap[0] < epoch <= gap[1] else []) })
+			for start, end in zip(bounds, [*bounds[1:], gap[1] + HOUR]):
+				if not _obtain_goes(which, start, end):
+					return
+				add_coverage(table, (start, end - HOUR), 'goes')
+
+def ensure_prepared(interval: tuple[int, int], ser_db_name: str):
+	_ensure_obtained('xrays' if sat_table(ser_db_name) == T_XRAY else 'particles', interval)
+
+def fetch(which, t_from, t_to, query=['p1', 'p5', 'p7']):
 	xra = which == 'xrays'
-	expected_count = (t_to - t_from) // 60
 	query = ['s', 'l'] if xra else [f for f in (query or []) if f in PARTICLES]
 	if len(query) < 1:
 		raise ValueError('Empty query')
+	_ensure_obtained(which, (t_from, t_to))
 	with pool.connection() as conn:
 		cl = SQL(',').join([Identifier(c) for c in query])
 		tbl = Identifier(T_XRAY if xra else T_PART)
@@ -85,22 +131,16 @@ def fetch(which, t_from, t_to, query=['p1', 'p5', 'p7'], obtain=True):
 			'WHERE to_timestamp(%s) <= time AND time <= to_timestamp(%s) ORDER BY time').format(cl, tbl)
 		curs = conn.execute(qq, [t_from, t_to])
 		res, cols = curs.fetchall(), [desc[0] for desc in curs.description] # type: ignore
-		
-	if (len(res) > 0 and len(res) >= expected_count - 3) or not obtain:
-		return res, cols
-	
-	_obtain_goes(which, t_from, t_to)
-	return fetch(which, t_from, t_to, query, obtain=False)
+	return res, cols
 
 def sat_table(ser_db_name: str):
 	return T_XRAY if ser_db_name in ['s', 'l'] else T_PART
 
 def select_hourly_averaged(interval: tuple[int, int], ser_db_name: str):
 	table = sat_table(ser_db_name)
-	query = SQL('SELECT EXTRACT(EPOCH FROM hour)::integer, AVG({}) ' +\
+	query = SQL('SELECT EXTRACT(EPOCH FROM hour)::int8, {} ' +\
 	'FROM generate_series(to_timestamp(%s), to_timestamp(%s), \'1 hour\'::interval) hour ' +\
 	'LEFT JOIN {} t ON hour <= t.time AND t.time <= hour + \'1 hour\'::interval ' +\
-	'GROUP BY hour ORDER BY hour').format(Identifier(ser_db_name), Identifier(table))
+	'GROUP BY hour ORDER BY hour').format(sql_float(SQL('AVG({})').format(Identifier(ser_db_name))), Identifier(table))
 
-	with pool.connection() as conn:
-		return conn.execute(query, interval).fetchall()
+	return select_columnar(query, interval, ['i8', 'f8'])
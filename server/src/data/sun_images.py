@@ -1,9 +1,15 @@
 from datetime import datetime, timezone
-import re, requests
+from concurrent.futures import ThreadPoolExecutor
+import re
 from database import log
+from utility import ComputeCache
+import http_client
 
-cache = {}
 DAY = 86400
+RECENT_TTL = 600
+SCRAPE_WORKERS = 4
+cache = ComputeCache(max_size=8192, store=http_client.CACHE_PATH + '/sun_images.sqlite',
+	ttl=lambda key, _: http_client.day_ttl(datetime.fromtimestamp(key[1], timezone.utc), RECENT_TTL))
 URL = 'https://cdaw.gsfc.nasa.gov/images/'
 jpg_re = re.compile(r'href="(\d{8}_\d{6})_(.+?)\.(png|jpg)"')
 
@@ -15,7 +21,7 @@ def scrape_day_list(tstmp, src):
 	aiadir = 'sdo/aia_synoptic/' if (dt.year, dt.month) in [(2024, 11), (2024, 12), (2025, 1)] else 'sdo/aia_synoptic_nrt/'
 	dp = ('soho/lasco' if lasco else ('sdo/aia_synoptic_rdf/' if 'diff' in src else aiadir) + src.split()[1])
 	url = f'{URL}/{dp}/{dt.year}/{dt.month:02}/{dt.day:02}/'
-	res = requests.get(url, timeout=10)
+	res = http_client.get(url, ttl=http_client.day_ttl(dt, RECENT_TTL), timeout=10)
 	if res.status_code == 404:
 		return []
 	if res.status_code != 200:
@@ -31,15 +37,8 @@ def scrape_day_list(tstmp, src):
 	return result
 
 def fetch_list(t_from, t_to, source='AIA 193'):
-	if source not in cache:
-		cache[source] = {}
 	t_from = t_from // DAY * DAY
-	result = []
-	for d_start in range(t_from, t_to, DAY):
-		if d_start in cache[source]:
-			result.extend(cache[source][d_start])
-			continue
-		lst = scrape_day_list(d_start, source)
-		cache[source][d_start] = lst
-		result.extend(lst)
-	return result
\ No newline at end of file
+	days = range(t_from, t_to, DAY)
+	with ThreadPoolExecutor(max_workers=SCRAPE_WORKERS) as executor:
+		lists = executor.map(lambda d_start: cache.get((source, d_start), lambda: scrape_day_list(d_start, source)), days)
+	return [t for day_list in lists for t in day_list]
\ No newline at end of file
@@ -1,12 +1,13 @@
 import os
-from database import log, pool, upsert_many
+from database import log, pool, upsert_many, IS_WORKER
 
 def _init():
 	with open(os.path.join(os.path.dirname(__file__), './_init_db.sql'), encoding='utf-8') as file:
 		init_text = file.read()
 	with pool.connection() as conn:
 		conn.execute(init_text)
-_init()
+if not IS_WORKER:
+	_init()
 
 def import_summary(data):
 	log.info('Importing swpc daily summary')
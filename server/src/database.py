@@ -1,11 +1,14 @@
-import os, logging
+import os, logging, multiprocessing
+from bisect import bisect_left, bisect_right
+from threading import Lock
 from datetime import datetime, timezone
 from psycopg_pool import ConnectionPool
-from psycopg.sql import SQL, Identifier, Placeholder
+from psycopg.sql import SQL, Identifier, Placeholder, Composable
 from dataclasses import dataclass, asdict
+import numpy as np
 import ts_type
 
-from typing import LiteralString, Iterable, Sequence, Any
+from typing import LiteralString, Iterable, Sequence, Any, Callable
 
 from events.columns.column import Column
 
@@ -31,6 +34,8 @@ class ComputationResponse:
 		return asdict(self)
 	
 log = logging.getLogger('crw')
+# NOTE: spawned compute processes import the same modules, schema is only initialized by the main process
+IS_WORKER = multiprocessing.parent_process() is not None
 pool = ConnectionPool(kwargs = {
 	'dbname': 'crw',
 	'user': 'crw',
@@ -46,7 +51,16 @@ def _init():
 			i_end TIMESTAMPTZ,
 			at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
 			UNIQUE(entity, start))''')
-_init()
+		conn.execute('''CREATE TABLE IF NOT EXISTS coverage_intervals (
+			entity TEXT NOT NULL,
+			source TEXT NOT NULL DEFAULT '',
+			vgroup TEXT NOT NULL DEFAULT '',
+			start TIMESTAMPTZ NOT NULL,
+			i_end TIMESTAMPTZ NOT NULL,
+			at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+			UNIQUE(entity, source, vgroup, start))''')
+if not IS_WORKER:
+	_init()
 
 def get_coverage(ent: str) -> list[tuple[datetime, datetime | None, datetime]]:
 	with pool.connection() as conn:
@@ -60,8 +74,238 @@ def upsert_coverage(entity: str, start: datetime | int, end: datetime | int | No
 		conn.execute('INSERT INTO coverage_info (entity, start, i_end, at) VALUES (%s, %s, %s, now()) ' +\
 			('' if single else 'ON CONFLICT(entity, start) DO UPDATE SET at = now(), i_end = EXCLUDED.i_end'), [entity, dt_start, dt_end])
 
-def upsert_many(table: str, columns: list[str], data: Iterable[Sequence[Any]], schema='events', constants: dict[str, Any]={},  \
-		conflict_constraint:LiteralString='time', do_nothing=False, write_nulls=False, write_values=True, only_update=False):
+class IntervalSet:
+	''' Sorted set of disjoint closed intervals on a grid of given step, adjacent intervals are merged '''
+	def __init__(self, step: int = 1, intervals: Iterable[tuple[int, int]] = []):
+		self.step = step
+		self.starts: list[int] = []
+		self.ends: list[int] = []
+		for start, end in intervals:
+			self.add(start, end)
+
+	def __len__(self):
+		return len(self.starts)
+
+	def add(self, start: int, end: int):
+		i = bisect_left(self.ends, start - self.step)
+		j = bisect_right(self.starts, end + self.step)
+		if i < j:
+			start, end = min(start, self.starts[i]), max(end, self.ends[j-1])
+		self.starts[i:j] = [start]
+		self.ends[i:j] = [end]
+		return start, end
+
+	def missing(self, start: int, end: int) -> list[tuple[int, int]]:
+		gaps = []
+		cur = start
+		k = bisect_left(self.ends, start)
+		while k < len(self.starts) and self.starts[k] <= end and cur <= end:
+			if self.starts[k] > cur:
+				gaps.append((cur, self.starts[k] - self.step))
+			cur = max(cur, self.ends[k] + self.step)
+			k += 1
+		if cur <= end:
+			gaps.append((cur, end))
+		return gaps
+
+	def span(self):
+		return (self.starts[0], self.ends[-1]) if self.starts else None
+
+coverage_lock = Lock()
+coverage_sets: dict[tuple[str, str, str], IntervalSet] = {}
+coverage_at: dict[tuple[str, str, str], int] = {}
+
+def _load_coverage_set(key: tuple[str, str, str], step: int):
+	with pool.connection() as conn:
+		rows = conn.execute('SELECT EXTRACT(EPOCH FROM start)::integer, EXTRACT(EPOCH FROM i_end)::integer, ' +\
+			'EXTRACT(EPOCH FROM at)::integer FROM coverage_intervals WHERE entity = %s AND source = %s AND vgroup = %s', key).fetchall()
+	coverage_at[key] = max([r[2] for r in rows], default=0)
+	return IntervalSet(step, [(s // step * step, e // step * step) for s, e, _ in rows])
+
+def get_coverage_set(entity: str, source: str = '', group: str = '', step: int = 3600) -> IntervalSet:
+	key = (entity, source, group)
+	with coverage_lock:
+		if key not in coverage_sets:
+			coverage_sets[key] = _load_coverage_set(key, step)
+		return coverage_sets[key]
+
+def missing_coverage(entity: str, interval: tuple[int, int], source: str = '', group: str = '', step: int = 3600):
+	cov = get_coverage_set(entity, source, group, step)
+	with coverage_lock:
+		return cov.missing(*interval)
+
+def coverage_span(entity: str, source: str = '', group: str = '', step: int = 3600):
+	cov = get_coverage_set(entity, source, group, step)
+	with coverage_lock:
+		return cov.span(), coverage_at.get((entity, source, group))
+
+def add_coverage(entity: str, interval: tuple[int, int], source: str = '', group: str = '', step: int = 3600, replace=False):
+	key = (entity, source, group)
+	cov = get_coverage_set(*key, step)
+	with coverage_lock, pool.connection() as conn:
+		if replace:
+			cov = coverage_sets[key] = IntervalSet(step)
+			conn.execute('DELETE FROM coverage_intervals WHERE entity = %s AND source = %s AND vgroup = %s', key)
+		start, end = cov.add(*interval)
+		conn.execute('DELETE FROM coverage_intervals WHERE entity = %s AND source = %s AND vgroup = %s ' +\
+			'AND to_timestamp(%s) <= start AND start <= to_timestamp(%s)', [*key, start, end])
+		conn.execute('INSERT INTO coverage_intervals (entity, source, vgroup, start, i_end) ' +\
+			'VALUES (%s, %s, %s, to_timestamp(%s), to_timestamp(%s))', [*key, start, end])
+		coverage_at[key] = int(datetime.now(timezone.utc).timestamp())
+
+PG_EPOCH = 946684800 # 2000-01-01 in unix seconds
+COPY_BATCH = 1 << 16
+COPY_HEADER = b'PGCOPY\n\xff\r\n\0' + bytes(8)
+COPY_TRAILER = b'\xff\xff'
+BINARY_TYPES = { # oid: wire format
+	16: '?',     # bool
+	21: '>i2',   # smallint
+	23: '>i4',   # integer
+	20: '>i8',   # bigint
+	700: '>f4',  # real
+	701: '>f8',  # double precision
+	1082: '>i4', # date, days since PG_EPOCH
+	1114: '>i8', # timestamp, microseconds since PG_EPOCH
+	1184: '>i8', # timestamptz
+}
+
+def _null_mask(arr: np.ndarray):
+	if arr.dtype.kind == 'M':
+		return np.isnat(arr)
+	if arr.dtype.kind == 'f':
+		return ~np.isfinite(arr)
+	return np.zeros(len(arr), bool)
+
+def _encode_column(arr: np.ndarray, oid: int):
+	null = _null_mask(arr)
+	if arr.dtype.kind == 'M':
+		arr = arr.astype('datetime64[us]').astype('i8') / 1e6
+	elif arr.dtype.kind == 'f':
+		arr = np.nan_to_num(arr, nan=0, posinf=0, neginf=0)
+	if oid in (1114, 1184):
+		vals = np.round((arr - PG_EPOCH) * 1e6)
+	elif oid == 1082:
+		vals = np.floor((arr - PG_EPOCH) / 86400)
+	elif oid == 16:
+		vals = arr != 0
+	elif oid in (20, 21, 23):
+		vals = np.round(arr) if arr.dtype.kind == 'f' else arr
+	else:
+		vals = arr
+	return vals.astype(BINARY_TYPES[oid]), null
+
+def _encode_rows(columns: list[tuple[np.ndarray, np.ndarray]]):
+	''' Binary COPY tuples: int16 field count, then int32 length (-1 for NULL) and value for every field '''
+	count = len(columns[0][0])
+	widths = [vals.dtype.itemsize for vals, _ in columns]
+	buf = np.empty((count, 2 + sum(4 + w for w in widths)), 'u1')
+	keep = np.ones(buf.shape, bool)
+	buf[:,:2] = np.frombuffer(np.array(len(columns), '>i2').tobytes(), 'u1')
+	off = 2
+	for (vals, null), width in zip(columns, widths):
+		buf[:,off:off+4] = np.where(null, -1, width).astype('>i4').view('u1').reshape(count, 4)
+		buf[:,off+4:off+4+width] = np.ascontiguousarray(vals).view('u1').reshape(count, width)
+		keep[:,off+4:off+4+width] = ~null[:,None]
+		off += 4 + width
+	return buf.tobytes() if keep.all() else buf[keep].tobytes()
+
+def _column_to_list(arr: np.ndarray, oid: int):
+	if arr.dtype.kind in 'OUS':
+		return arr.tolist()
+	null = _null_mask(arr).tolist()
+	if oid in (1114, 1184) and arr.dtype.kind != 'M':
+		vals = [datetime.fromtimestamp(t, timezone.utc) for t in np.nan_to_num(arr).tolist()]
+	elif oid in (20, 21, 23) and arr.dtype.kind == 'f':
+		vals = np.round(np.nan_to_num(arr)).astype('i8').tolist()
+	else:
+		vals = arr.tolist()
+	return [None if n else v for n, v in zip(null, vals)]
+
+def _copy_columns(cur, tmpname: Identifier, columns: list[str], data: dict[str, np.ndarray]):
+	val_columns = SQL(',').join([Identifier(c) for c in columns])
+	cur.execute(SQL('SELECT {} FROM {} LIMIT 0').format(val_columns, tmpname))
+	oids = [desc.type_code for desc in cur.description]
+	arrays = [np.asarray(data[c]) for c in columns]
+	count = len(arrays[0])
+	if any(len(a) != count for a in arrays):
+		raise ValueError('Columns lengths differ')
+
+	if any(a.dtype.kind in 'OUS' or oid not in BINARY_TYPES for a, oid in zip(arrays, oids)):
+		with cur.copy(SQL('COPY {}({}) FROM STDIN').format(tmpname, val_columns)) as copy:
+			for row in zip(*[_column_to_list(a, oid) for a, oid in zip(arrays, oids)]):
+				copy.write_row(row)
+		return count
+
+	encoded = [_encode_column(a, oid) for a, oid in zip(arrays, oids)]
+	with cur.copy(SQL('COPY {}({}) FROM STDIN (FORMAT BINARY)').format(tmpname, val_columns)) as copy:
+		copy.write(COPY_HEADER)
+		for i in range(0, count, COPY_BATCH):
+			copy.write(_encode_rows([(vals[i:i+COPY_BATCH], null[i:i+COPY_BATCH]) for vals, null in encoded]))
+		copy.write(COPY_TRAILER)
+	return count
+
+def sql_epoch(col: str = 'time'):
+	return SQL('EXTRACT(EPOCH FROM {})::int8').format(Identifier(col))
+
+def sql_float(expr: SQL | Composable):
+	return SQL('COALESCE(({})::float8, \'NaN\')').format(expr)
+
+def select_columnar(query: Composable, params: Sequence[Any], dtypes: Sequence[str]) -> list[np.ndarray]:
+	''' Run query through binary COPY and decode the result straight into numpy columns.
+		Every selected value must be NOT NULL int8 or float8 (see sql_epoch and sql_float) '''
+	buf = bytearray()
+	with pool.connection() as conn, conn.cursor() as cur:
+		with cur.copy(SQL('COPY ({}) TO STDOUT (FORMAT BINARY)').format(query), params) as copy:
+			for chunk in copy:
+				buf += chunk
+	offset = len(COPY_HEADER) + int.from_bytes(buf[15:19], 'big') if buf else 0
+	body = memoryview(buf)[offset:max(offset, len(buf) - len(COPY_TRAILER))]
+	if not len(body):
+		return [np.empty(0, d) for d in dtypes]
+
+	width = int.from_bytes(body[:2], 'big')
+	if len(dtypes) != width:
+		raise ValueError(f'Expected {len(dtypes)} columns, got {width}')
+	row_type = np.dtype([('n', '>i2')] + [f for i, d in enumerate(dtypes) for f in ((f'l{i}', '>i4'), (f'v{i}', '>' + d))])
+	rows = np.frombuffer(body, row_type)
+	if any(np.any(rows[f'l{i}'] != 8) for i in range(width)):
+		raise ValueError('Columnar select got NULL or not 8-byte value')
+	return [rows[f'v{i}'].astype(d) for i, d in enumerate(dtypes)]
+
+def columns_to_rows(columns: list[np.ndarray]):
+	''' JSON-friendly object rows from numeric columns, NaN becomes None '''
+	rows = np.empty((len(columns[0]) if columns else 0, len(columns)), object)
+	for i, col in enumerate(columns):
+		rows[:,i] = np.where(np.isnan(col), None, col) if col.dtype.kind == 'f' else col.astype(object)
+	return rows
+
+upsert_listeners: list[Callable[[str, str, tuple[int, int] | None], None]] = []
+
+def on_upsert(listener: Callable[[str, str, tuple[int, int] | None], None]):
+	''' listener(schema, table, (min time, max time) or None if unknown) is called after changes are committed '''
+	upsert_listeners.append(listener)
+	return listener
+
+def notify_changed(schema: str, table: str, span: tuple[int, int] | None = None):
+	for listener in upsert_listeners:
+		try:
+			listener(schema, table, span)
+		except Exception as e:
+			log.error('Upsert listener failed for %s.%s: %s', schema, table, str(e))
+
+@dataclass
+class UpsertResult:
+	inserted: int = 0
+	updated: int = 0
+	unchanged: int = 0
+
+	@property
+	def changed(self):
+		return self.inserted + self.updated
+
+def upsert_many(table: str, columns: list[str], data: Iterable[Sequence[Any]] | dict[str, np.ndarray], schema='events', constants: dict[str, Any]={},  \
+		conflict_constraint:LiteralString='time', do_nothing=False, write_nulls=False, write_values=True, only_update=False, skip_unchanged=True):
+	''' Rows which already hold the resulting values are not rewritten unless skip_unchanged=False '''
 	with pool.connection() as conn, conn.cursor() as cur, conn.transaction():
 		tmpname = Identifier(table.split('.')[-1] + '_tmp')
 		itable = SQL('.').join([Identifier(schema), Identifier(table)])
@@ -74,36 +318,63 @@ def upsert_many(table: str, columns: list[str], data: Iterable[Sequence[Any]], s
 			cur.execute(SQL('ALTER TABLE {} DROP COLUMN {}').format(tmpname, Identifier(col)))
 
 		val_columns = SQL(',').join(icolumns)
-		with cur.copy(SQL('COPY {}({}) FROM STDIN').format(tmpname, val_columns)) as copy:
-			for row in data:
-				copy.write_row(row)
+		if isinstance(data, dict):
+			total = _copy_columns(cur, tmpname, columns, data)
+		else:
+			total = 0
+			with cur.copy(SQL('COPY {}({}) FROM STDIN').format(tmpname, val_columns)) as copy:
+				for row in data:
+					copy.write_row(row)
+					total += 1
 
 		if only_update: # TODO: support constants
 			setcols = SQL(',').join([SQL('{} = tmp.{}').format(col, col) for col in icolumns])
 			query = SQL('UPDATE {} AS t SET {} FROM {} AS tmp WHERE t.id = tmp.id').format(itable, setcols, tmpname)
-			return cur.execute(query)
-				
-		if do_nothing:
-			on_conflict = SQL('ON CONFLICT DO NOTHING')
+			if skip_unchanged:
+				tcols = SQL(',').join([SQL('t.{}').format(col) for col in icolumns])
+				tmpcols = SQL(',').join([SQL('tmp.{}').format(col) for col in icolumns])
+				query = SQL('{} AND ({}) IS DISTINCT FROM ({})').format(query, tcols, tmpcols)
+			updated = cur.execute(query).rowcount
+			result = UpsertResult(updated=updated, unchanged=total - updated)
 		else:
-			items = []
-			for c in iconstants + icolumns:
-				if c.as_string() in conflict_constraint:
-					continue
-				if write_nulls:
-					items.append(SQL('{0} = EXCLUDED.{0}').format(c)) 
-				elif write_values:
-					items.append(SQL('{0} = COALESCE(EXCLUDED.{0}, {1}.{0})').format(c, itable))
-				else:
-					items.append(SQL('{0} = COALESCE({1}.{0}, EXCLUDED.{0})').format(c, itable))
-	
-			on_conflict = SQL('ON CONFLICT ({}) DO UPDATE SET {}')\
-				.format(SQL(conflict_constraint), SQL(',').join(items))
-			
-		col_names = SQL(',').join(iconstants + icolumns)
-		col_values = SQL(',').join([*(Placeholder() * len(constants)), val_columns])
-		query = SQL('INSERT INTO {}({}) SELECT {} FROM {} {}').format(itable, col_names, col_values, tmpname, on_conflict)
-		cur.execute(query, list(constants.values()))
+			if do_nothing:
+				on_conflict = SQL('ON CONFLICT DO NOTHING')
+			else:
+				setters, old_values, new_values = [], [], []
+				for c in iconstants + icolumns:
+					if c.as_string() in conflict_constraint:
+						continue
+					if write_nulls:
+						value = SQL('EXCLUDED.{0}').format(c)
+					elif write_values:
+						value = SQL('COALESCE(EXCLUDED.{0}, {1}.{0})').format(c, itable)
+					else:
+						value = SQL('COALESCE({1}.{0}, EXCLUDED.{0})').format(c, itable)
+					setters.append(SQL('{} = {}').format(c, value))
+					old_values.append(SQL('{}.{}').format(itable, c))
+					new_values.append(value)
+
+				on_conflict = SQL('ON CONFLICT ({}) DO UPDATE SET {}')\
+					.format(SQL(conflict_constraint), SQL(',').join(setters))
+				if skip_unchanged: # avoid writing new tuples (and WAL) for rows that would not change
+					on_conflict = SQL('{} WHERE ({}) IS DISTINCT FROM ({})')\
+						.format(on_conflict, SQL(',').join(old_values), SQL(',').join(new_values))
+
+			col_names = SQL(',').join(iconstants + icolumns)
+			col_values = SQL(',').join([*(Placeholder() * len(constants)), val_columns])
+			query = SQL('WITH res AS (INSERT INTO {}({}) SELECT {} FROM {} {} RETURNING xmax = 0 AS ins) ' +\
+				'SELECT count(*) FILTER (WHERE ins), count(*) FILTER (WHERE NOT ins) FROM res')\
+				.format(itable, col_names, col_values, tmpname, on_conflict)
+			inserted, updated = cur.execute(query, list(constants.values())).fetchone() # type: ignore
+			result = UpsertResult(inserted, updated, total - inserted - updated)
+
+		span = None
+		if result.changed and 'time' in columns:
+			span = cur.execute(SQL('SELECT EXTRACT(EPOCH FROM min(time))::int8, EXTRACT(EPOCH FROM max(time))::int8 FROM {}')\
+				.format(tmpname)).fetchone()
+	if result.changed:
+		notify_changed(schema, table, span) # type: ignore
+	return result
 
 def create_table(name: str, columns: list[Column], constraint: LiteralString='', schema='events'):
 	table = SQL('.').join([Identifier(schema), Identifier(name)]) if schema else Identifier(name)
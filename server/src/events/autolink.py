@@ -0,0 +1,212 @@
+from dataclasses import dataclass
+from threading import Lock
+from time import time
+import numpy as np
+from psycopg.sql import SQL, Identifier
+
+from database import pool, log, on_upsert
+from events.feid_store import feid_store
+from events.table_structure import ALL_TABLES, SOURCE_LINKS, get_col_by_name, E_FEID
+from events.source import donki, solarsoft, solardemon, lasco_cme, cactus_cme, r_c_icme, solen_info
+
+# Proposes solar sources for FEID events, nothing is linked without an operator
+
+HOUR = 3600
+DAY = 24 * HOUR
+AU_KM = 149.6e6
+SW_SPEED = 400 # km/s, CMEs tend to solar wind speed on their way
+INDEX_TTL = 3600
+MIN_SCORE = .05
+
+@dataclass
+class Catalog:
+	entity: str
+	kind: str # flare | cme | icme | ch
+	time_col: str
+	speed_col: str | None = None
+	width_col: str | None = None
+	lat_col: str | None = 'lat'
+	flux_col: str | None = None
+	expected_col: str | None = None
+
+	def key_col(self):
+		return SOURCE_LINKS[self.entity][1] if self.entity in SOURCE_LINKS else 'id'
+
+CATALOGS = [
+	Catalog(donki.FLR_TABLE, 'flare', 'start_time', flux_col='class'),
+	Catalog(solarsoft.TABLE, 'flare', 'start_time', flux_col='class'),
+	Catalog(solardemon.FLR_TABLE, 'flare', 'start_time', flux_col='est_class'),
+	Catalog(lasco_cme.TABLE, 'cme', 'time', speed_col='speed', width_col='angular_width'),
+	Catalog(cactus_cme.TABLE, 'cme', 'time', speed_col='speed', width_col='angular_width', lat_col=None),
+	Catalog(donki.CME_TABLE, 'cme', 'time', speed_col='speed', width_col='half_width'),
+	Catalog(r_c_icme.TABLE, 'icme', 'time', lat_col=None),
+	Catalog(solen_info.TABLE, 'ch', 'time', lat_col=None, expected_col='disturbance_time'),
+]
+
+# search window before FEID onset, hours
+WINDOWS = {
+	'flare': (18, 120),
+	'cme': (18, 120),
+	'icme': (-12, 12),
+	'ch': (24, 144),
+}
+
+def flare_flux(cls: str | None):
+	''' GOES class to W/m^2 '''
+	if not cls or cls[0].upper() not in 'ABCMX':
+		return np.nan
+	try:
+		return 10 ** ('ABCMX'.index(cls[0].upper()) - 8) * float(cls[1:] or 1)
+	except ValueError:
+		return np.nan
+
+def transit_hours(speed: np.ndarray):
+	''' crude drag: effective speed is halfway between the initial one and the solar wind '''
+	eff = np.clip(SW_SPEED + (speed - SW_SPEED) / 2, 250, 2500)
+	return AU_KM / eff / HOUR
+
+def position_score(lat: np.ndarray, lon: np.ndarray, width: np.ndarray):
+	''' earth facing sources: 1 within 30 deg of disk center falling to 0 at the limb, halo CMEs count as facing '''
+	dist = np.degrees(np.arccos(np.clip(np.cos(np.radians(lat)) * np.cos(np.radians(lon)), -1, 1)))
+	score = np.clip((90 - dist) / 60, 0, 1)
+	by_width = np.clip(width / 120, .2, 1)
+	return np.where(np.isfinite(dist), score, np.where(np.isfinite(width), by_width, .5))
+
+class SourceIndex:
+	''' Time sorted arrays of every catalog, built lazily and dropped on upsert '''
+	def __init__(self):
+		self.lock = Lock()
+		self.catalogs: dict[str, dict[str, np.ndarray]] = {}
+		self.loaded: dict[str, float] = {}
+
+	def _load(self, cat: Catalog):
+		cols = [cat.time_col, cat.key_col(), cat.speed_col, cat.width_col,
+			cat.lat_col, cat.lat_col and 'lon', cat.flux_col, cat.expected_col]
+		names = ['time', 'key', 'speed', 'width', 'lat', 'lon', 'flux', 'expected']
+		is_time = lambda name: next(c for c in ALL_TABLES[cat.entity] if c.sql_name == name).dtype == 'time'
+		exprs = [SQL('EXTRACT(EPOCH FROM {})::float8').format(Identifier(c)) if c and is_time(c)
+			else Identifier(c) if c else SQL('NULL') for c in cols]
+		query = SQL('SELECT {} FROM events.{} ORDER BY {}').format(
+			SQL(',').join(exprs), Identifier(cat.entity), Identifier(cat.time_col))
+		with pool.connection() as conn:
+			rows = conn.execute(query).fetchall()
+		res = np.array(rows, dtype=object).reshape(len(rows), len(cols))
+		data = { n: res[:,i].astype('f8') for i, n in enumerate(names) if n not in ['key', 'flux'] }
+		data['key'] = res[:,1]
+		data['flux'] = np.array([flare_flux(f) for f in res[:,6]], 'f8')
+		if cat.entity == donki.CME_TABLE:
+			data['width'] = data['width'] * 2
+		self.catalogs[cat.entity] = data
+		self.loaded[cat.entity] = time()
+
+	def get(self, cat: Catalog):
+		with self.lock:
+			if cat.entity not in self.catalogs or time() - self.loaded[cat.entity] > INDEX_TTL:
+				self._load(cat)
+			return self.catalogs[cat.entity]
+
+	def invalidate(self, entity: str):
+		with self.lock:
+			self.catalogs.pop(entity, None)
+
+source_index = SourceIndex()
+
+@on_upsert
+def _on_upsert(schema: str, table: str, span: tuple[int, int] | None):
+	if schema == 'events':
+		source_index.invalidate(table)
+
+def _candidates(times: np.ndarray, cat: Catalog):
+	''' all (event, source) pairs within the catalog window, vectorized over events '''
+	data = source_index.get(cat)
+	after, before = WINDOWS[cat.kind]
+	lo = np.searchsorted(data['time'], times - before * HOUR)
+	hi = np.searchsorted(data['time'], times - after * HOUR, side='right')
+	counts = np.maximum(hi - lo, 0)
+	evt = np.repeat(np.arange(len(times)), counts)
+	src = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+	return evt, src, data
+
+def _score(times: np.ndarray, evt: np.ndarray, src: np.ndarray, data: dict[str, np.ndarray], cat: Catalog):
+	lag = (times[evt] - data['time'][src]) / HOUR
+	if cat.kind == 'icme':
+		return np.exp(-.5 * (lag / 6) ** 2)
+	if cat.kind == 'ch':
+		expected = data['expected'][src]
+		lag_exp = np.where(np.isfinite(expected), (times[evt] - expected) / HOUR, lag - 72)
+		return np.exp(-.5 * (lag_exp / 36) ** 2)
+
+	if cat.kind == 'cme':
+		transit = transit_hours(data['speed'][src])
+		transit = np.where(np.isfinite(transit), transit, 72)
+	else: # flares: no speed, CME is assumed to be average
+		transit = np.full(len(src), 60.)
+	tolerance = np.maximum(12, transit / 4)
+	score = np.exp(-.5 * ((lag - transit) / tolerance) ** 2)
+	score *= position_score(data['lat'][src], data['lon'][src], data['width'][src])
+	if cat.kind == 'flare':
+		flux = data['flux'][src]
+		score *= np.where(np.isfinite(flux), np.clip((np.log10(flux) + 7) / 3, .2, 1), .5)
+	return score
+
+def _linked(feid_ids: list[int]):
+	''' (feid id, entity, key) of sources already linked '''
+	erupt_links = [(ent, link) for ent, (link, _) in SOURCE_LINKS.items() if ent != solen_info.TABLE]
+	cols = SQL(',').join([SQL('EXTRACT(EPOCH FROM er.{})::float8' if 'time' in link or 'start' in link else 'er.{}')
+		.format(Identifier(link)) for _, link in erupt_links])
+	query = SQL('SELECT fsrc.feid_id, ch.tag, {} FROM events.feid_sources fsrc ' +\
+		'LEFT JOIN events.sources_erupt er ON er.id = fsrc.erupt_id ' +\
+		'LEFT JOIN events.sources_ch ch ON ch.id = fsrc.ch_id WHERE fsrc.feid_id = ANY(%s)').format(cols)
+	with pool.connection() as conn:
+		rows = conn.execute(query, [feid_ids]).fetchall()
+	linked = set()
+	for feid_id, tag, *vals in rows:
+		if tag is not None:
+			linked.add((feid_id, solen_info.TABLE, tag))
+		for (ent, _), val in zip(erupt_links, vals):
+			if val is not None:
+				linked.add((feid_id, ent, float(val)))
+	return linked
+
+def autolink(target_ids: list[int] | None = None, limit: int = 3):
+	''' best scored candidates of each kind for every target FEID event '''
+	t_start = time()
+	ids, times = feid_store.select([get_col_by_name(E_FEID, 'id'), get_col_by_name(E_FEID, 'time')], target_ids)
+	ids = ids.astype(np.int64)
+	result: dict[int, list[dict]] = { i: [] for i in ids.tolist() }
+	found = []
+	for cat in CATALOGS:
+		evt, src, data = _candidates(times, cat)
+		score = _score(times, evt, src, data, cat)
+		good = score >= MIN_SCORE
+		found.append((cat, evt[good], src[good], score[good], data))
+
+	for kind in WINDOWS:
+		parts = [f for f in found if f[0].kind == kind]
+		if not parts:
+			continue
+		evt = np.concatenate([p[1] for p in parts])
+		score = np.concatenate([p[3] for p in parts])
+		which = np.concatenate([np.full(len(p[1]), i) for i, p in enumerate(parts)])
+		src = np.concatenate([p[2] for p in parts])
+		by = np.lexsort((-score, evt))
+		rank = np.arange(len(by)) - np.searchsorted(evt[by], evt[by])
+		for j in by[rank < limit]:
+			cat, data = parts[which[j]][0], parts[which[j]][4]
+			key = data['key'][src[j]]
+			result[int(ids[evt[j]])].append({
+				'entity': cat.entity,
+				'kind': kind,
+				'key': key.item() if isinstance(key, np.generic) else key,
+				'time': int(data['time'][src[j]]),
+				'score': round(float(score[j]), 3),
+			})
+
+	linked = _linked(list(result))
+	for feid_id, cands in result.items():
+		for c in cands:
+			key = float(c['key']) if isinstance(c['key'], (int, float)) else c['key']
+			c['linked'] = (feid_id, c['entity'], key) in linked
+		cands.sort(key=lambda c: -c['score'])
+	log.info('Autolink: scored [%s] events in %ss', len(result), round(time() - t_start, 2))
+	return result
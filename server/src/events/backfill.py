@@ -0,0 +1,75 @@
+from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from database import log, get_coverage
+from events.source import donki, lasco_cme, solarsoft, solardemon, cactus_cme, r_c_icme, solen_info
+import http_client
+
+# Month by month catalogs are walked concurrently (http_client limits load per host),
+# coverage_info rows are the persisted progress: a month fetched after it settled is never fetched again
+
+BACKFILL_WORKERS = 4
+
+MONTHLY = {
+	'donki_flares': (datetime(2010, 4, 1, tzinfo=timezone.utc), lambda m: donki.fetch_month('flares', m)),
+	'donki_cmes': (datetime(2010, 4, 1, tzinfo=timezone.utc), lambda m: donki.fetch_month('cmes', m)),
+	'solarsoft_flares': (datetime(2002, 1, 1, tzinfo=timezone.utc), solarsoft.fetch_month),
+	'lasco_cmes': (datetime(1996, 1, 1, tzinfo=timezone.utc), lasco_cme.scrape_month),
+}
+
+# catalogs served as a whole, backfill is a single fetch
+WHOLE = {
+	'solardemon_flares': lambda: solardemon.fetch('flares', datetime(2000, 1, 1, tzinfo=timezone.utc)),
+	'solardemon_dimmings': lambda: solardemon.fetch('dimmings', datetime(2000, 1, 1, tzinfo=timezone.utc)),
+	'cactus_cmes': lambda: cactus_cme.fetch([0, 1]),
+	'r_c_icmes': r_c_icme.fetch,
+	'solen_holes': solen_info.fetch,
+}
+
+# catalogs which can not be fetched back to their start
+LIMITED = {
+	'solardemon_flares': f'SolarDemon only serves the last {solardemon.MAX_DAYS} days',
+	'solardemon_dimmings': f'SolarDemon only serves the last {solardemon.MAX_DAYS} days',
+}
+
+def _next_month(month: datetime):
+	return (month + timedelta(days=32)).replace(day=1)
+
+def months_to_fetch(entity: str, until: datetime | None = None):
+	''' months from the catalog start which were not fetched after they settled '''
+	first, _ = MONTHLY[entity]
+	now = until or datetime.now(timezone.utc)
+	closed = { start for start, _, at in get_coverage(entity) if at - _next_month(start) > http_client.SETTLED_AFTER }
+	months, month = [], first
+	while month <= now:
+		if month not in closed:
+			months.append(month)
+		month = _next_month(month)
+	return months
+
+def backfill(progr, entity: str):
+	if entity in WHOLE:
+		progr[1] = 1
+		WHOLE[entity]()
+		progr[0] = 1
+		if entity in LIMITED:
+			log.warning('Backfill of %s is partial: %s', entity, LIMITED[entity])
+			return { 'fetched': 1, 'partial': LIMITED[entity] }
+		return { 'fetched': 1 }
+	if entity not in MONTHLY:
+		raise ValueError(f'Unknown catalog: {entity}')
+
+	_, fetch_month = MONTHLY[entity]
+	months = months_to_fetch(entity)
+	log.info('Backfilling %s: [%s] months', entity, len(months))
+	progr[1] = max(len(months), 1)
+	failed = []
+	with ThreadPoolExecutor(max_workers=BACKFILL_WORKERS) as executor:
+		futures = { executor.submit(fetch_month, month): month for month in months[::-1] } # recent first
+		for future in as_completed(futures):
+			if exc := future.exception():
+				log.error('Backfill of %s failed for %s: %s', entity, futures[future].strftime('%Y-%m'), exc)
+				failed.append(futures[future].strftime('%Y-%m'))
+			progr[0] += 1
+	log.info('Backfilled %s: [%s] months, [%s] failed', entity, len(months) - len(failed), len(failed))
+	return { 'fetched': len(months) - len(failed), 'failed': sorted(failed) }
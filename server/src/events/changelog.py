@@ -1,12 +1,13 @@
 from dataclasses import dataclass
 from typing import Literal
-from database import pool
+from database import pool, IS_WORKER
 from psycopg import Connection
 import ts_type
 
 from events.columns.column import Column
 
 TABLE = 'events.changes_log'
+OVERRIDE_TABLE = 'events.changes_override' # latest change per (entity, column, event), maintained by record_changes
 
 @ts_type.gen_type
 @dataclass
@@ -22,6 +23,7 @@ class ChangelogEntry:
 class ChangelogResponse:
 	fields: list[str]
 	events: dict[str, dict[str, list[list[float | None | str]]]]
+	cursor: int | None = None # to request older entries, when limit was reached
 
 def _init():
 	with pool.connection() as conn:
@@ -35,24 +37,67 @@ def _init():
 			column_name text,
 			old_value text,
 			new_value text)''')
-		
-_init()
+		conn.execute(f'CREATE INDEX IF NOT EXISTS changes_log_entity_idx ON {TABLE} (entity_name, column_name, id)')
+		conn.execute(f'''CREATE TABLE IF NOT EXISTS {OVERRIDE_TABLE} (
+			entity_name text not null,
+			column_name text not null,
+			event_id integer not null,
+			log_id integer not null,
+			new_value text,
+			PRIMARY KEY (entity_name, column_name, event_id))''')
+		empty = conn.execute(f'SELECT NOT EXISTS (SELECT 1 FROM {OVERRIDE_TABLE})').fetchone()
+		if empty and empty[0]:
+			conn.execute(f'''INSERT INTO {OVERRIDE_TABLE}
+				SELECT DISTINCT ON (entity_name, column_name, event_id) entity_name, column_name, event_id, id, new_value
+				FROM {TABLE} WHERE event_id IS NOT NULL AND column_name IS NOT NULL AND entity_name IS NOT NULL
+				ORDER BY entity_name, column_name, event_id, time DESC, id DESC''')
+if not IS_WORKER:
+	_init()
+
+def record_changes(conn: Connection, author: int, changes: list[tuple[str, int, str, str | None, str | None]]):
+	''' write (entity, event_id, column, old, new) changelog entries in order and make the last ones current overrides '''
+	if not changes:
+		return
+	entities, event_ids, columns, old_values, new_values = [list(c) for c in zip(*changes)]
+	conn.execute(f'''WITH logged AS (
+		INSERT INTO {TABLE} (author, entity_name, event_id, column_name, old_value, new_value)
+		SELECT %s, e, i, c, o, n FROM unnest(%s::text[], %s::integer[], %s::text[], %s::text[], %s::text[])
+			WITH ORDINALITY AS u(e, i, c, o, n, ord) ORDER BY ord RETURNING id, entity_name, column_name, event_id, new_value)
+		INSERT INTO {OVERRIDE_TABLE} SELECT DISTINCT ON (entity_name, column_name, event_id)
+			entity_name, column_name, event_id, id, new_value FROM logged ORDER BY entity_name, column_name, event_id, id DESC
+		ON CONFLICT (entity_name, column_name, event_id) DO UPDATE SET log_id = EXCLUDED.log_id, new_value = EXCLUDED.new_value''',
+		[author, entities, event_ids, columns, old_values, new_values])
 
 def clear_comp_col_changelog(conn: Connection, column: str):
 	conn.execute(f'DELETE FROM {TABLE} WHERE column_name = %s', [column])
+	conn.execute(f'DELETE FROM {OVERRIDE_TABLE} WHERE column_name = %s', [column])
 
-def select_changelog(conn: Connection, entity: str, columns: list[Column]):
-	# TODO: optimization
+def select_changelog(conn: Connection, entity: str, columns: list[Column], event_ids: list[int] | None = None,
+		before: int | None = None, limit: int | None = None):
+	''' newest first, pages of limit entries older than the before cursor '''
 	changelog = ChangelogResponse(['time', 'author', 'old', 'new', 'special'], {})
 	query = f'''SELECT event_id, column_name, special, old_value, new_value,
 		EXTRACT (EPOCH FROM changes_log.time)::integer,
-		(select login from users where uid = author) as author
+		(select login from users where uid = author) as author, id
 		FROM {TABLE} WHERE event_id is not null
 		AND entity_name=%s AND column_name = ANY(%s)'''
-	res = conn.execute(query, [entity, [c.sql_name for c in columns]]).fetchall()
+	params: list = [entity, [c.sql_name for c in columns]]
+	if event_ids is not None:
+		query += ' AND event_id = ANY(%s)'
+		params.append(event_ids)
+	if before is not None:
+		query += ' AND id < %s'
+		params.append(before)
+	query += ' ORDER BY id DESC'
+	if limit is not None:
+		query += ' LIMIT %s'
+		params.append(limit)
+	res = conn.execute(query, params).fetchall()
+	if limit is not None and len(res) == limit:
+		changelog.cursor = res[-1][-1]
 
 	tgt = changelog.events
-	for eid, column, special, old_val, new_val, made_at, author in res:
+	for eid, column, special, old_val, new_val, made_at, author, _ in res:
 		if eid not in tgt:
 			tgt[eid] = {}
 		if column not in tgt[eid]:
@@ -0,0 +1,114 @@
+import os
+from dataclasses import dataclass, field
+from threading import Event, Lock
+from time import time
+
+from database import log
+
+HOUR = 3600
+
+# rough work units per second of a single thread, used to turn the estimate into seconds
+UNITS_PER_SECOND = 4e6
+SERIES_HOUR_COST = 1   # fetching / elementwise op on one hour of series
+SLICE_COST = 200       # python level loop iteration per event in slice functions
+RSM_HOUR_COST = 2000   # rsm() fits a model for every hour of the frame
+CHECKPOINT_EVERY = 256
+
+class ComputationCancelled(Exception):
+	pass
+
+@dataclass
+class Budget:
+	seconds: float
+	memory: int # bytes
+
+def _role_budget(role: str, seconds: float, memory_mb: int):
+	''' override with COMPUTE_BUDGET_<ROLE>="seconds,megabytes" '''
+	env = os.environ.get(f'COMPUTE_BUDGET_{role.upper()}')
+	if env:
+		seconds, memory_mb = [float(v) for v in env.split(',')] # type: ignore
+	return Budget(float(seconds), int(memory_mb) * 1024 * 1024)
+
+BUDGETS = {
+	'admin': _role_budget('admin', 900, 4096),
+	'operator': _role_budget('operator', 300, 2048),
+	'user': _role_budget('user', 60, 1024),
+}
+SYSTEM_BUDGET = BUDGETS['operator'] # compute_all and recomputation after edits
+
+def budget_for(role: str | None):
+	return BUDGETS.get(role or 'user', BUDGETS['user'])
+
+@dataclass
+class Estimate:
+	seconds: float
+	memory: int
+
+def estimate_cost(parsed, n_events: int, frame_hours: int):
+	''' cost of a parsed definition: series count x frame length, plus per-event loops '''
+	calls = [(str(call.children[0]), call) for call in parsed.find_data('fn_call')]
+	n_series = len(list(parsed.find_data('series'))) + len([c for c, _ in calls if c == 'ser'])
+	n_slices = len([c for c, _ in calls if c in ['max', 'min', 'tmax', 'tmin', 'maxt', 'mint', 'tmaxt', 'tmint',
+		'mean', 'median', 'coverage', 'icount', 'itime', 'ilen']])
+	n_rsm = len([c for c, _ in calls if c == 'rsm'])
+
+	window_hours = 0
+	for name, call in calls:
+		if name == 'movavg' and len(call.children) > 2 and getattr(call.children[2], 'data', None) == 'number':
+			window_hours += abs(int(float(call.children[2].children[0])))
+
+	units = (n_series + len(calls)) * frame_hours * SERIES_HOUR_COST \
+		+ n_slices * n_events * SLICE_COST + n_rsm * frame_hours * RSM_HOUR_COST
+	memory = (n_series + len(calls) + window_hours) * frame_hours * 8
+	return Estimate(units / UNITS_PER_SECOND, memory)
+
+@dataclass(eq=False)
+class Computation:
+	user_id: int
+	column: str
+	budget: Budget
+	started: float = field(default_factory=time)
+	reserved: int = 0
+	cancelled: Event = field(default_factory=Event)
+
+	def check_estimate(self, estimate: Estimate):
+		if estimate.seconds > self.budget.seconds:
+			raise ValueError(f'Column is too expensive: ~{round(estimate.seconds)}s, allowed {round(self.budget.seconds)}s')
+		if estimate.memory > self.budget.memory:
+			raise ValueError(f'Column requires too much memory: ~{estimate.memory >> 20} MB, allowed {self.budget.memory >> 20} MB')
+
+	def checkpoint(self):
+		if self.cancelled.is_set():
+			raise ComputationCancelled(f'Computation of {self.column} was cancelled')
+		if time() - self.started > self.budget.seconds:
+			raise ComputationCancelled(f'Computation of {self.column} exceeded {round(self.budget.seconds)}s')
+
+	def reserve(self, nbytes: int):
+		self.reserved += nbytes
+		if self.reserved > self.budget.memory:
+			raise ComputationCancelled(f'Computation of {self.column} exceeded {self.budget.memory >> 20} MB')
+
+running_lock = Lock()
+running: list[Computation] = []
+
+def start(user_id: int, column: str, budget: Budget):
+	comp = Computation(user_id, column, budget)
+	with running_lock:
+		running.append(comp)
+	return comp
+
+def finish(comp: Computation):
+	with running_lock:
+		if comp in running:
+			running.remove(comp)
+
+def cancel(user_id: int, role: str | None, column: str | None = None):
+	''' cancel own computations, admins and operators can cancel any '''
+	any_user = role in ['admin', 'operator']
+	with running_lock:
+		found = [c for c in running if (any_user or c.user_id == user_id) and (column is None or c.column == column)]
+	for comp in found:
+		comp.cancelled.set()
+	if found:
+		log.info('Cancelled [%s] computations by (%s): %s', len(found), user_id, ', '.join(c.column for c in found))
+	return len(found)
@@ -4,7 +4,7 @@ from typing import Literal
 import ts_type
 
 from psycopg import Connection, rows, sql
-from database import pool, log
+from database import pool, log, IS_WORKER
 from events.columns.column import BaseColumn
 
 
@@ -76,7 +76,8 @@ def select_computed_columns(user_id: int | None=None, select_all=False):
 		curs.row_factory = rows.dict_row
 
 		return [ComputedColumn.from_sql_row(row, user_id) for row in curs]
-_sql_init()
+if not IS_WORKER:
+	_sql_init()
 
 def select_computed_column_by_id(col_id: int, user_id: int | None=None):
 	with pool.connection() as conn:
@@ -90,10 +91,9 @@ def select_computed_column_by_id(col_id: int, user_id: int | None=None):
 
 def apply_changes(conn, col: BaseColumn):
 	id_col = 'feid_id' if col.entity == DATA_TABLE else 'id'
-	query = sql.SQL('UPDATE events.{} tgt SET {} = new_value::{} ' +
-		'FROM (SELECT DISTINCT ON (event_id) event_id, new_value FROM events.changes_log ' +
-		'WHERE entity_name = \'feid\' AND column_name = %s ORDER BY event_id, time DESC) chgs ' +
-		f'WHERE tgt.{id_col} = event_id AND (new_value IS NULL OR new_value != \'auto\')') \
+	query = sql.SQL('UPDATE events.{} tgt SET {} = new_value::{} FROM events.changes_override chgs ' +
+		'WHERE entity_name = \'feid\' AND column_name = %s ' +
+		f'AND tgt.{id_col} = event_id AND (new_value IS NULL OR new_value != \'auto\')') \
 		.format(sql.Identifier(col.entity), sql.Identifier(col.sql_name), col.sql_type())
 	curs = conn.execute(query, [col.sql_name])
 	log.debug(f'Applied {curs.rowcount} overriding changes to {col.name}')
@@ -1,8 +1,10 @@
 
 from events.columns.column import Column, DTYPE as COL_DTYPE
-from events.columns.computed_column import DATA_TABLE
 from events.columns.series import Series
-from events.table_structure import E_FEID, E_SOURCE_CH, ENTITY_CH, E_SOURCE_ERUPT, ENTITY_ERUPT, SOURCE_LINKS, get_col_by_name
+from events.columns.series_store import series_store
+from events.columns.budget import Computation, CHECKPOINT_EVERY
+from events.feid_store import feid_store
+from events.table_structure import ALL_TABLES, E_FEID, E_SOURCE_CH, ENTITY_CH, E_SOURCE_ERUPT, ENTITY_ERUPT, SOURCE_LINKS, get_col_by_name
 
 from psycopg.sql import SQL, Identifier
 from datetime import datetime, timezone
@@ -24,57 +26,133 @@ def	np_dtype(dtype: COL_DTYPE):
 		return 'object'
 	return 'f8'
 
+def frame_segments(times: np.ndarray):
+	''' non-overlapping [t - margin, t + margin] windows around every event hour '''
+	times = np.unique(times[np.isfinite(times)] // HOUR * HOUR)
+	starts, ends = times - SERIES_FRAME_MARGIN_S, times + SERIES_FRAME_MARGIN_S
+	breaks = np.where(starts[1:] > ends[:-1] + HOUR)[0] + 1
+	return [(int(starts[a]), int(ends[b-1])) for a, b in zip(np.r_[0, breaks], np.r_[breaks, len(times)])]
+
 class ComputationContext:
-	def __init__(self, target_ids: list[int] | None = None, force_frame: tuple[int, int] | None = None):
+	def __init__(self, target_ids: list[int] | None = None, force_frame: tuple[int, int] | None = None, sparse_frame=False):
 		self.target_ids = target_ids
 		self.cache: dict[str, np.ndarray] = {}
+		self.sources: dict[tuple[str, tuple[str, ...]], tuple] = {}
 		self.series_frame: tuple[int, int] = force_frame # type: ignore
 		self.forced_frame = bool(force_frame)
-	
+		# with sparse frame series only cover windows around target events, concatenated into one buffer
+		self.sparse_frame = sparse_frame and bool(target_ids) and not force_frame
+		self.segments: list[tuple[int, int]] | None = None
+		self.computation: Computation | None = None
+
+	def checkpoint(self):
+		if self.computation:
+			self.computation.checkpoint()
+
+	def checked(self, items):
+		''' iterate with cancellation checkpoints '''
+		for i, item in enumerate(items):
+			if i % CHECKPOINT_EVERY == 0:
+				self.checkpoint()
+			yield item
+
+	def reserve(self, nbytes: int):
+		if self.computation:
+			self.computation.reserve(nbytes)
+
+	def frame_hours(self):
+		''' length of the series frame which would be used, without selecting series '''
+		if self.series_frame and not self.segments:
+			return (self.series_frame[1] - self.series_frame[0]) // HOUR + 1
+		times = self.select_columns_by_name(['time'])[0]
+		segments = self.segments or frame_segments(times)
+		if not self.sparse_frame and segments:
+			segments = [(segments[0][0], segments[-1][1])]
+		return sum((e - s) // HOUR + 1 for s, e in segments)
+
+	def _locate(self, t: np.ndarray):
+		''' series buffer index for given times and the end of the segment it belongs to '''
+		if not self.segments:
+			return (t - self.series_frame[0]) // HOUR, np.full(len(t), np.inf)
+		seg_start = np.array([s for s, _ in self.segments], dtype='f8')
+		seg_len = np.array([(e - s) // HOUR + 1 for s, e in self.segments], dtype='f8')
+		seg_offset = np.r_[0, np.cumsum(seg_len)[:-1]]
+		k = np.clip(np.searchsorted(seg_start, t, side='right') - 1, 0, None)
+		offset = (t - seg_start[k]) // HOUR
+		inside = (t >= seg_start[k]) & (offset < seg_len[k])
+		return np.where(inside, seg_offset[k] + offset, np.nan), np.where(inside, seg_offset[k] + seg_len[k], np.nan)
+
+	def segment_starts(self):
+		''' series buffer indices where sparse frame segments begin, data before them belongs to another segment '''
+		if not self.segments:
+			return np.empty(0, int)
+		return np.r_[0, np.cumsum([(e - s) // HOUR + 1 for s, e in self.segments])[:-1]].astype(int)
+
+	def time_index(self, t: np.ndarray):
+		return self._locate(t)[0]
+
+	def index_time(self, idx: np.ndarray):
+		if not self.segments:
+			return self.series_frame[0] + idx * HOUR
+		seg_start = np.array([s for s, _ in self.segments], dtype='f8')
+		seg_offset = np.r_[0, np.cumsum([(e - s) // HOUR + 1 for s, e in self.segments])[:-1]]
+		k = np.clip(np.searchsorted(seg_offset, idx, side='right') - 1, 0, None)
+		return seg_start[k] + (idx - seg_offset[k]) * HOUR
+
 	def get_slices(self, t_1: np.ndarray, t_2: np.ndarray):
 		if not self.series_frame:
 			return [slice(0, 0) for _ in t_1]
-		t_0 = self.series_frame[0]
 		t_l = np.minimum(t_1, t_2)
 		t_r = np.maximum(t_1, t_2)
-		left = (t_l - t_0) // HOUR
+		left, limit = self._locate(t_l)
 		slice_len = (t_r - t_l) // HOUR
 		left[np.isnan(left)] = -1
 		slice_len[left < 0] = 1
 		slice_len[np.isnan(slice_len)] = 1
-		return [np.s_[int(max(0, l)):int(max(0, l+sl))] for l, sl in zip(left, slice_len)]
+		right = np.fmin(left + slice_len, limit)
+		return [np.s_[int(max(0, l)):int(max(0, r))] for l, r in zip(left, right)]
 
 	def select_columns(self, columns: list[Column]):
 		to_fetch = [c for c in columns if c.sql_name not in self.cache]
 
 		if to_fetch:
-			cols = SQL(',').join([c.sql_val() for c in to_fetch])
-			
-			ids = self.target_ids
-			select_tmpl = SQL(f'SELECT {{}}\nFROM events.{E_FEID} fe '+\
-				f' LEFT JOIN events.{DATA_TABLE} cc ON feid_id = id {{}} ORDER BY time')
-			
-			if self.target_ids:
-				condition = SQL('WHERE id = ANY(%s)')
-				vals = [ids]
-			elif self.forced_frame:
-				condition = SQL('WHERE to_timestamp(%s) <= time AND time <= to_timestamp(%s)')
-				vals = [*self.series_frame]
-			else:
-				condition = SQL('')
-				vals = []
-
-			with pool.connection() as conn:
-				curs = conn.execute(select_tmpl.format(cols, condition), vals)
-				res = np.array(curs.fetchall())
-			
-			for i, c in enumerate(to_fetch):
-				self.cache[c.sql_name] = res[:,i].astype(np_dtype(c.dtype))
+			frame = self.series_frame if self.forced_frame else None
+			res = feid_store.select(to_fetch, self.target_ids or None, frame)
+			for c, col in zip(to_fetch, res):
+				self.cache[c.sql_name] = col.astype(np_dtype(c.dtype))
 
 		return [self.cache[c.sql_name] for c in columns]
 	
+	def _fetch_segment(self, series: Series, segment: tuple[int, int]):
+		if series.dtype == 'real':
+			return series_store.get(series, segment)
+		res = series.fetch(segment)
+		values = np.full((segment[1] - segment[0]) // HOUR + 1, np.nan, dtype=object)
+		if len(res):
+			idx = (res[:,0].astype('f8') - segment[0]) // HOUR
+			mask = (idx >= 0) & (idx < len(values))
+			values[idx[mask].astype(int)] = res[mask,1]
+		return values
+
 	def select_series(self, series: Series):
-		if series.name not in self.cache:
+		if series.name not in self.cache and self.sparse_frame:
+			if self.segments is None:
+				self.series_frame = self.get_series_frame()
+			t_data = time()
+			parts = [self._fetch_segment(series, seg) for seg in self.checked(self.segments or [])]
+			self.cache[series.name] = np.concatenate(parts)
+			self.reserve(self.cache[series.name].nbytes)
+			log.debug(f'Got {series.display_name} [{len(self.cache[series.name])}] in {len(parts)} segments in {round(time()-t_data, 3)}s')
+
+		if series.name not in self.cache and series.dtype == 'real':
+			frame = self.series_frame or self.get_series_frame()
+			t_data = time()
+			self.series_frame = frame
+			self.cache[series.name] = series_store.get(series, frame)
+			self.reserve(self.cache[series.name].nbytes)
+			log.debug(f'Got {series.display_name} [{len(self.cache[series.name])}] from store in {round(time()-t_data, 3)}s')
+
+		if series.name not in self.cache: # text series are not kept in the store
 			frame = self.series_frame or self.get_series_frame()
 			t_data = time()
 			res = series.fetch(frame)
@@ -107,11 +185,16 @@ class ComputationContext:
 
 			log.debug(f'Got {series.display_name} [{len(res)}] in {round(time()-t_data, 3)}s')
 			self.cache[series.name] = res_value
+			self.reserve(res_value.nbytes)
 
 		return self.cache[series.name]
 	
-	def select_source_column(self, entity: str, infl: list[str], column: Column|None=None, order: str|None=None, get_count=False):
-		ids = self.select_columns_by_name(['id'])[0].tolist() # TODO: this can be optimized
+	def _select_sources(self, entity: str, infl: list[str]):
+		''' all sources linked to target events with given influence, one scan shared by scol() and scnt() calls '''
+		key = (entity, tuple(infl))
+		if key in self.sources:
+			return self.sources[key]
+		ids = self.select_columns_by_name(['id'])[0].astype(np.int64)
 
 		is_ch = E_SOURCE_CH == entity or entity in ENTITY_CH
 		src_table = E_SOURCE_CH if is_ch else E_SOURCE_ERUPT
@@ -128,35 +211,57 @@ class ComputationContext:
 		else:
 			targ_id_col = 'id'
 
-		target_val = SQL('COUNT({}.{})').format(target_prefix, Identifier(targ_id_col)) if get_count else column and column.sql_val()
-
-		order_by = SQL('') 
-		if not get_count and order:
-			if is_ch:
-				order_sql = 'src.time'
-			elif order.startswith('time'):
-				order_sql = 'COALESCE(src.cme_time, src.flr_start)'
-			elif order.startswith('position'):
-				order_sql = '|/(src.lat^2 + src.lon^2)'
-			elif order.startswith('cme_speed'):
-				order_sql = 'src.cme_speed'
-			else:
-				assert not 'reached'
-			order_by = SQL(f'ORDER BY {{}} {"DESC" if order.endswith('desc') else "ASC"} LIMIT 1').format(SQL(order_sql)) # type: ignore
-
-		subquery = SQL(f'SELECT {{}} FROM events.feid_sources fsrc '+\
+		order_keys = { 'time': 'EXTRACT(EPOCH FROM src.time)' } if is_ch else {
+			'time': 'EXTRACT(EPOCH FROM COALESCE(src.cme_time, src.flr_start))',
+			'position': '|/(src.lat^2 + src.lon^2)',
+			'cme_speed': 'src.cme_speed' }
+		columns = ALL_TABLES[entity if is_end_src else src_table]
+		values = [SQL('EXTRACT(EPOCH FROM {}.{})::integer' if c.dtype == 'time' else '{}.{}')
+			.format(target_prefix, Identifier(c.sql_name)) for c in columns]
+
+		query = SQL(f'SELECT fsrc.feid_id, {{}}.{{}}, {{}}, {{}} FROM events.feid_sources fsrc '+\
 			f'LEFT JOIN events.{src_table} src ON src.id = {src_id_col} {{}} '+\
-			'WHERE fsrc.feid_id = feid.id AND fsrc.cr_influence = ANY(%s) {}').format(target_val, join_end_src, order_by)
-		query = SQL('SELECT ({}) FROM unnest(%s) AS feid(id)').format(subquery)
+			'WHERE fsrc.cr_influence = ANY(%s) AND fsrc.feid_id = ANY(%s) ORDER BY fsrc.id')\
+			.format(target_prefix, Identifier(targ_id_col), SQL(',').join([SQL(k) for k in order_keys.values()]), # type: ignore
+				SQL(',').join(values), join_end_src)
 
 		with pool.connection() as conn:
-			curs = conn.execute(query, [infl, ids])
-			res = np.array(curs.fetchall())[:,0]
-			return res.astype(np_dtype(column.dtype)) if column else res.astype('f8')
+			rows = conn.execute(query, [infl, ids.tolist()]).fetchall()
+		res = np.array(rows, dtype=object).reshape(len(rows), 2 + len(order_keys) + len(columns))
+		sorter = np.argsort(ids)
+		pos = sorter[np.searchsorted(ids, res[:,0].astype(np.int64), sorter=sorter)]
+		keys = { k: res[:,2+i].astype('f8') for i, k in enumerate(order_keys) }
+		vals = { c.sql_name: res[:,2+len(order_keys)+i] for i, c in enumerate(columns) }
+		self.sources[key] = pos, res[:,1] != None, keys, vals # pylint: disable=singleton-comparison
+		return self.sources[key]
+
+	def select_source_column(self, entity: str, infl: list[str], column: Column|None=None, order: str|None=None, get_count=False):
+		pos, has_target, keys, vals = self._select_sources(entity, infl)
+		length = len(self.select_columns_by_name(['id'])[0])
+		if get_count:
+			return np.bincount(pos[has_target], minlength=length).astype('f8')
+		assert column is not None
+
+		order = order or 'time'
+		desc = order.endswith('_desc')
+		key = keys.get(order.removesuffix('_desc'), keys['time']) # coronal holes are only ordered by time
+		nulls = np.isnan(key)
+		# same as postgres: nulls are last in ascending and first in descending order
+		by = np.lexsort((np.nan_to_num(-key if desc else key), nulls != desc, pos))
+		first = by[np.r_[True, pos[by][1:] != pos[by][:-1]]] if len(by) else by
+
+		res = np.full(length, None, dtype=object)
+		res[pos[first]] = vals[column.sql_name][first]
+		return res.astype(np_dtype(column.dtype))
 
 	def select_columns_by_name(self, names: list[str]):
 		return self.select_columns([get_col_by_name(E_FEID, name) for name in names])
 	
 	def get_series_frame(self):
 		times = self.select_columns_by_name(['time'])[0] // HOUR * HOUR
+		if self.sparse_frame:
+			self.segments = frame_segments(times)
+			if not self.segments:
+				raise ValueError('No target events to compute')
+			return (self.segments[0][0], self.segments[-1][1])
 		return (int(times[0]) - SERIES_FRAME_MARGIN_S, int(times[-1]) + SERIES_FRAME_MARGIN_S)
\ No newline at end of file
@@ -60,6 +60,7 @@ class Function:
 		self.name = name
 		self.desc = desc
 		self.args = args
+		self.dense_frame = False
 
 	def validate(self, args: Tuple[Value, ...]) -> None:
 		if len(args) > len(self.args):
@@ -27,20 +27,20 @@ class IntervalOperation(Function):
 		slices = ctx.get_slices(slice_start, slice_end)
 
 		if self.name == 'ilen':
-			res = np.array([np.count_nonzero(d_value[sl]) for sl in slices])
+			res = np.array([np.count_nonzero(d_value[sl]) for sl in ctx.checked(slices)])
 			
 		else:
 			res: np.ndarray = np.full(len(slices), np.nan)
 
 			if self.name == 'icount':
-				for i, slice in enumerate(slices):
+				for i, slice in enumerate(ctx.checked(slices)):
 					preceding = np.roll(d_value[slice], 1)
 					if len(preceding) > 0:
 						preceding[0] = False
 						res[i] = np.count_nonzero(d_value[slice] & ~preceding)
 			
 			elif self.name == 'itime':
-				for i, slice in enumerate(slices):
+				for i, slice in enumerate(ctx.checked(slices)):
 					if np.count_nonzero(d_value[slice]) == 0:
 						res[i] = np.nan
 					else:
@@ -16,6 +16,7 @@ class RSMFunc(Function):
 			ArgDef('parameter', [TYPE.LITERAL], [DTYPE.TEXT]),
 			ArgDef('window', [TYPE.LITERAL], [DTYPE.INT], default='3'),
 		], 'Ring of Stations method results. Params available: ' + ', '.join(RSM_PARAMS))
+		self.dense_frame = True # fetch_counts needs continuous series
 
 	def __call__(self, args: tuple[Value, ...], ctx: ComputationContext) -> Value:
 		super().validate(args) # type: ignore
@@ -27,6 +28,8 @@ class RSMFunc(Function):
 			raise ValueError(f'Unsupported RSM param: {args[0].value} options: '+ ', '.join(RSM_PARAMS)) # type: ignore
 
 		data, stations = fetch_counts(*ctx.series_frame)
+		ctx.reserve(data.nbytes)
+		ctx.checkpoint()
 		counts = data[:,1:]
 		v = ctx.select_series(find_series('V'))
 		b = ctx.select_series(find_series('B'))
@@ -48,6 +51,7 @@ class RSMFunc(Function):
 				result = np.nanmean(variations, axis=1)
 			else:
 				model = MODELS['harmonic']
+				ctx.checkpoint()
 				fit = fit_model(data[:,0], variations, bases, stations, window=window, model=model)
 				result = fit[:,RSM_PARAMS.index(param)]
 
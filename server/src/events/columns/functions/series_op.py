@@ -39,7 +39,7 @@ class SeriesOperation(Function):
 		slices = ctx.get_slices(slice_start, slice_end)
 
 		if self.name == 'coverage':
-			result = np.array([np.count_nonzero(~np.isnan(value[sl])) / ((sl.stop - sl.start) or 1) * 100 for sl in slices])
+			result = np.array([np.count_nonzero(~np.isnan(value[sl])) / ((sl.stop - sl.start) or 1) * 100 for sl in ctx.checked(slices)])
 			return Value(TYPE.COLUMN, DTYPE.REAL, result)
 
 		with warnings.catch_warnings():
@@ -60,13 +60,13 @@ class SeriesOperation(Function):
 				prepare = None
 
 			if prepare:
-				result = np.array([func(prepare(value[sl])) for sl in slices])
+				result = np.array([func(prepare(value[sl])) for sl in ctx.checked(slices)])
 			else:
-				result = np.array([func(value[sl]) for sl in slices])
+				result = np.array([func(value[sl]) for sl in ctx.checked(slices)])
 
 		if self.name in ['tmax', 'tmin']:
 			t_idx = result + np.array([sl.start for sl in slices])
-			t_result = np.where(result == -1, np.nan, ctx.series_frame[0] + t_idx * HOUR) 
+			t_result = np.where(result == -1, np.nan, ctx.index_time(t_idx)) 
 			return Value(TYPE.COLUMN, DTYPE.TIME, t_result)
 
 		return Value(TYPE.COLUMN, DTYPE.REAL, result)
@@ -78,7 +78,7 @@ class Derivative(Function):
 			ArgDef('order', [TYPE.LITERAL], [DTYPE.INT], default='1'),
 		], 'n-th order "derivative" of the series (difference between cur and prev measurement interval)')
 
-	def __call__(self, args: tuple[Value[ValueArray], ...], _: ComputationContext) -> Value:
+	def __call__(self, args: tuple[Value[ValueArray], ...], ctx: ComputationContext) -> Value:
 		super().validate(args) # type: ignore
 
 		value = args[0].value
@@ -92,6 +92,8 @@ class Derivative(Function):
 			temp = temp[1:] - temp[:-1]
 
 		res[order:] = temp
+		for start in ctx.segment_starts(): # differences across sparse frame segments are meaningless
+			res[start:start+order] = np.nan
 
 		return Value(TYPE.SERIES, DTYPE.REAL, res)
 
@@ -111,7 +113,7 @@ class ValueOp(Function):
 		if not ctx.series_frame:
 			result = np.full_like(t_time, np.nan)
 		else:
-			res_idx = (t_time - ctx.series_frame[0]) // HOUR
+			res_idx = ctx.time_index(t_time)
 			res_idx[res_idx < 0] = -1
 			res_idx[~np.isfinite(res_idx)] = -1
 			result = np.where(res_idx >= 0, value[res_idx.astype(int)], np.nan)
@@ -138,6 +140,7 @@ class BaseMaxOp(Function):
 		super().__init__('basemax', [
 			ArgDef('base_series', [TYPE.SERIES], [DTYPE.REAL]),
 		], 'rebase so that max value is 0: = (s - max(s)) / (1 + max(s) / 100)')
+		self.dense_frame = True # max of the whole frame
 	
 	def __call__(self, args: tuple[Value[ValueArray]], ctx: ComputationContext) -> Value:
 		super().validate(args) # type: ignore
@@ -154,6 +157,7 @@ class ShiftOp(Function):
 			ArgDef('value', [TYPE.SERIES, TYPE.COLUMN], [dt for dt in DTYPE]),
 			ArgDef('shift', [TYPE.LITERAL], [DTYPE.INT], default='1'),
 		], 'shift an array: shift([1, 2, 3, 4], 2) = [nan, nan, 1, 2]')
+		self.dense_frame = True # shift may exceed the frame margin around events
 
 	def __call__(self, args: tuple[Value[ValueArray], ...], ctx: ComputationContext) -> Value:
 		super().validate(args) # type: ignore
@@ -175,6 +179,7 @@ class MovingAverage(Function):
 			ArgDef('series', [TYPE.SERIES], [DTYPE.REAL, DTYPE.INT]),
 			ArgDef('window_size', [TYPE.LITERAL], [DTYPE.INT], default='2'),
 		], 'moving average of the series (windows are always trailing)')
+		self.dense_frame = True # window may exceed the frame margin around events
 
 	def __call__(self, args: tuple[Value[ValueArray], ...], ctx: ComputationContext) -> Value:
 		super().validate(args) # type: ignore
@@ -182,6 +187,7 @@ class MovingAverage(Function):
 		value = args[0].value
 		window = int(args[1].value) if len(args) > 1 else 2
 
+		ctx.reserve(value.size * window * 8) # nanmean copies the windows
 		res = np.empty_like(value)
 		res[window-1:] = np.nanmean(sliding_window_view(value, window_shape=window), axis=1)
 		res[:window] = np.nan
@@ -36,9 +36,9 @@ helpers_desc = {
 
 @v_args(inline=True)
 class ColumnComputer(Transformer):
-	def __init__(self, visit_tokens: bool = True, target_ids: list[int] | None = None, force_frame: tuple[int, int] | None = None):
+	def __init__(self, visit_tokens: bool = True, target_ids: list[int] | None = None, force_frame: tuple[int, int] | None = None, sparse_frame=False):
 		super().__init__(visit_tokens)
-		self.ctx = ComputationContext(target_ids, force_frame)
+		self.ctx = ComputationContext(target_ids, force_frame, sparse_frame)
 
 	def number(self, txt):
 		return num_literal(float(txt))
@@ -59,6 +59,7 @@ class ColumnComputer(Transformer):
 		fn = functions.get(name)
 		if not fn:
 			raise NameError(f'Unknown function: {name}()')
+		self.ctx.checkpoint()
 		return fn(args, self.ctx)
 	
 	def add(self, *args):
@@ -1,19 +1,29 @@
 from time import time
-import traceback, ts_type
+import os, traceback, ts_type
 import numpy as np
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
 from dataclasses import dataclass, asdict
-from datetime import datetime, timezone
 from psycopg import rows, sql
 from threading import Thread, Lock
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
 
 from database import pool, log, upsert_many, ComputationResponse
 from events.columns.computed_column import ComputedColumn, select_computed_column_by_id, select_computed_columns, apply_changes, DATA_TABLE, DEF_TABLE
 from events.columns.parser import columnParser, ColumnComputer, functions, helpers_desc
-from events.columns.series import Series, SERIES
+from events.columns.series import Series, SERIES, find_series
+from events.columns.series_store import series_store
+from events.columns.context import ComputationContext, np_dtype
+from events.feid_store import feid_store
+from events.table_structure import ALL_TABLES, E_FEID
 from events.columns.functions.common import Function, Value, TYPE, DTYPE, value_to_sql_dtype
+from events.columns.functions.series_op import SeriesOperation
+from events.columns.functions.interval_op import IntervalOperation
+from events.columns.budget import Budget, Computation, ComputationCancelled, SYSTEM_BUDGET, budget_for, estimate_cost
+from events.columns import budget as budgets
 from events.columns.special_columns import compute_and_upsert_duration
 from events.changelog import clear_comp_col_changelog
+from utility import OperationCache
 
 @ts_type.gen_type
 @dataclass
@@ -28,12 +38,30 @@ class FeidInfoResponse:
 compute_lock = Lock()
 compute_all_active: None | tuple[float, bool, str | None] = None
 
-def _compute(definition: str, target_ids: list[int] | None = None):
+# NOTE: with COMPUTE_PROCESSES > 0 columns are computed in a pool of spawned processes instead of threads
+COMPUTE_PROCESSES = int(os.environ.get('COMPUTE_PROCESSES', 0))
+process_pool: ProcessPoolExecutor | None = None
+process_pool_lock = Lock()
+CANCEL_POLL = .5 # seconds
+
+def _called_functions(parsed):
+	return [(str(call.children[0]), functions.get(str(call.children[0]))) for call in parsed.find_data('fn_call')]
+
+def _compute(definition: str, target_ids: list[int] | None = None, frame: tuple[int, int] | None = None,
+		series: dict[str, np.ndarray] = {}, computation: Computation | None = None, columns: dict[str, np.ndarray] = {}):
 	try:
 		parsed = columnParser.parse(definition)
 
-		computer = ColumnComputer(target_ids=target_ids)
+		dense = frame or any(getattr(fn, 'dense_frame', False) for _, fn in _called_functions(parsed))
+		computer = ColumnComputer(target_ids=target_ids, sparse_frame=not dense)
+		computer.ctx.cache.update(columns)
+		if frame:
+			computer.ctx.series_frame = frame
+			computer.ctx.cache.update(series)
 		ids = np.array(computer.ctx.select_columns_by_name(['id'])[0]).astype(int)
+		if computation:
+			computation.check_estimate(estimate_cost(parsed, len(ids), computer.ctx.frame_hours()))
+			computer.ctx.computation = computation
 		result = computer.transform(parsed)
 
 		if result.type == TYPE.SERIES:
@@ -41,6 +69,9 @@ def _compute(definition: str, target_ids: list[int] | None = None):
 
 		if result.type == TYPE.LITERAL:
 			result = Value(TYPE.COLUMN, result.dtype, np.full_like(ids, result.value))
+	except ComputationCancelled as e:
+		log.warning('%s', e)
+		return None, None, e
 	except Exception as e:
 		traceback.print_exc()
 		return None, None, e
@@ -49,42 +80,261 @@ def _compute(definition: str, target_ids: list[int] | None = None):
 			
 def _upsert_data(col: ComputedColumn, ids: np.ndarray, result: Value, whole_column: bool = False):
 	res: np.ndarray = result.value # type: ignore
-	if result.dtype == DTYPE.TIME:
-		val = [None if np.isnan(v) else datetime.fromtimestamp(v, timezone.utc) for v in res]
-	elif result.dtype == DTYPE.INT:
-		val = np.where(~np.isfinite(res), None, np.round(res).astype(int)) # type: ignore
-	elif result.dtype == DTYPE.REAL:
-		val = np.where(~np.isfinite(res), None, np.round(res, 2)) # type: ignore
+	if result.dtype == DTYPE.REAL:
+		val = np.round(res, 2)
 	elif result.dtype == DTYPE.BOOL:
-		val = np.where(~np.isfinite(res), 0, res.astype(int))
-	else:
+		val = np.where(~np.isfinite(res), 0, res)
+	else: # TIME and INT are encoded as is, non-finite values become NULL
 		val = res
-		
-	data = zip(ids, val)
+
+	data = { 'feid_id': ids, col.sql_name: val }
 
 	# NOTE: only write nulls when recomputing whole column, this is a hack for cols with event shift
-	upsert_many(DATA_TABLE, ['feid_id', col.sql_name], data, conflict_constraint='feid_id', write_nulls=whole_column)
+	res = upsert_many(DATA_TABLE, ['feid_id', col.sql_name], data, conflict_constraint='feid_id', write_nulls=whole_column)
+	log.debug('Computed %s: changed [%s] of [%s]', col.name, res.changed, len(ids))
 	
 	with pool.connection() as conn:
 		apply_changes(conn, col)
 		if whole_column:
 			conn.execute(f'UPDATE events.{DEF_TABLE} SET computed_at = CURRENT_TIMESTAMP WHERE id = %s', [col.id])
+	feid_store.refresh_columns([col.sql_name])
+	return res
 
-def _compute_and_upsert(col: ComputedColumn, target_ids: list[int] | None = None):
-	ids, result, err = _compute(col.definition, target_ids)
+def _compute_and_upsert(col: ComputedColumn, target_ids: list[int] | None = None, budget: Budget = SYSTEM_BUDGET, user_id: int = -1):
+	computation = budgets.start(user_id, col.name, budget)
+	try:
+		ids, result, err = _compute(col.definition, target_ids, computation=computation)
+	finally:
+		budgets.finish(computation)
 	if err: return err
 	assert ids is not None and result
 	_upsert_data(col, ids, result, whole_column=not target_ids) # type: ignore
 	return None
 
-def upsert_column(user_id: int, json_body, col_id: int | None):
-	name, description, definition, is_public = \
-		[json_body.get(i) for i in ('name', 'description', 'definition', 'is_public')]
+attached_series: dict[str, SharedMemory] = {}
+
+def _attach_series(published: dict[str, tuple[str, int]]):
+	''' runs in worker process, maps series published by the parent without copying '''
+	shm_names = [shm_name for shm_name, _ in published.values()]
+	for shm_name in list(attached_series):
+		if shm_name not in shm_names:
+			try:
+				attached_series.pop(shm_name).close()
+			except BufferError: # still referenced by a computation
+				pass
+	arrays = {}
+	for name, (shm_name, length) in published.items():
+		if shm_name not in attached_series:
+			attached_series[shm_name] = SharedMemory(shm_name, track=False)
+		arr = np.ndarray(length, np.float32, buffer=attached_series[shm_name].buf)
+		arr.flags.writeable = False
+		arrays[name] = arr
+	return arrays
+
+class _CancelFlag:
+	''' Event-like view of a byte in shared memory, set by the parent and polled by worker checkpoints '''
+	def __init__(self, shm: SharedMemory):
+		self.shm = shm
+
+	def is_set(self):
+		return bool(self.shm.buf[0])
+
+	def set(self):
+		self.shm.buf[0] = 1
+
+def _compute_in_process(definition: str, target_ids: list[int] | None, frame: tuple[int, int] | None,
+		published: dict[str, tuple[str, int]], columns: dict[str, np.ndarray], cancel_flag: str):
+	try:
+		flag = SharedMemory(cancel_flag, track=False)
+	except FileNotFoundError: # parent already gave up on this column
+		return None, None, Exception(f'Computation of {definition} was cancelled')
+	try:
+		series = _attach_series(published) if frame else {}
+		computation = Computation(-1, definition, SYSTEM_BUDGET, cancelled=_CancelFlag(flag)) # type: ignore
+		ids, result, err = _compute(definition, target_ids, frame, series, computation, columns)
+	finally:
+		flag.close()
+	return ids, result, err and Exception(str(err)) # exceptions are not always picklable
+
+def _feid_columns(target_ids: list[int] | None):
+	''' FEID columns as the parent sees them: worker stores only catch up through changelog polling '''
+	static = ALL_TABLES[E_FEID]
+	return { c.sql_name: arr.astype(np_dtype(c.dtype)) for c, arr in zip(static, feid_store.select(static, target_ids)) }
+
+def _get_process_pool():
+	global process_pool
+	with process_pool_lock:
+		if process_pool is None:
+			process_pool = ProcessPoolExecutor(COMPUTE_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+		return process_pool
+
+def _process_results(name: str, futures: list, flag: SharedMemory):
+	''' results of worker tasks, cancel endpoint reaches them through a computation registered here '''
+	computation = budgets.start(-1, name, SYSTEM_BUDGET)
+	try:
+		while wait(futures, timeout=CANCEL_POLL).not_done:
+			if computation.cancelled.is_set():
+				_CancelFlag(flag).set() # running tasks stop at their next checkpoint
+				for future in futures:
+					future.cancel()
+				raise ComputationCancelled(f'Computation of {name} was cancelled')
+		return [f.result() for f in futures]
+	finally:
+		budgets.finish(computation)
+
+def _referenced_series(parsed):
+	names = [str(node.children[0]) for node in parsed.find_data('series')]
+	for call in parsed.find_data('fn_call'):
+		arg = call.children[1] if len(call.children) > 1 else None
+		if str(call.children[0]) == 'ser' and getattr(arg, 'data', None) == 'string':
+			names.append(str(arg.children[0])[1:-1]) # type: ignore
+	return names
+
+def _publish_series(definitions: list[str], frame: tuple[int, int]):
+	published: dict[str, tuple[str, int]] = {}
+	blocks: list[SharedMemory] = []
+	for definition in definitions:
+		try:
+			names = _referenced_series(columnParser.parse(definition))
+			found = [find_series(name) for name in names]
+		except Exception:
+			continue # will fail properly in the worker
+		for series in found:
+			if series.dtype != 'real' or series.name in published:
+				continue
+			data = series_store.get(series, frame)
+			shm = SharedMemory(create=True, size=max(data.nbytes, 1))
+			np.ndarray(len(data), np.float32, buffer=shm.buf)[:] = data
+			published[series.name] = (shm.name, len(data))
+			blocks.append(shm)
+	return published, blocks
+
+def _chunkable(definition: str):
+	''' event range chunks see the whole series frame, but not the neighbouring events '''
+	try:
+		called = _called_functions(columnParser.parse(definition))
+	except Exception:
+		return False
+	if any(name == 'shift' or getattr(fn, 'dense_frame', False) for name, fn in called):
+		return False
+	return any(isinstance(fn, (SeriesOperation, IntervalOperation)) for _, fn in called)
+
+def _compute_all_in_processes(columns: list[ComputedColumn]):
+	ctx = ComputationContext()
+	frame = ctx.get_series_frame()
+	ids = ctx.select_columns_by_name(['id'])[0].astype(int)
+	chunk_size = max(256, -(-len(ids) // COMPUTE_PROCESSES))
+	t_publish = time()
+	published, blocks = _publish_series([c.definition for c in columns], frame)
+	log.debug('Published [%s] series to compute processes in %ss', len(published), round(time() - t_publish, 3))
+
+	executor = _get_process_pool()
+	errors: list[Exception | None] = []
+	tasks: list[tuple[SharedMemory, list]] = []
+	try:
+		for col in columns:
+			chunks = [ids[i:i+chunk_size].tolist() for i in range(0, len(ids), chunk_size)] if _chunkable(col.definition) else [None]
+			flag = SharedMemory(create=True, size=1)
+			tasks.append((flag, [executor.submit(_compute_in_process, col.definition, chunk, frame, published,
+				_feid_columns(chunk), flag.name) for chunk in chunks]))
+
+		for col, (flag, futures) in zip(columns, tasks):
+			try:
+				parts = _process_results(col.name, futures, flag)
+			except Exception as e:
+				errors.append(e)
+				continue
+			err = next((e for _, _, e in parts if e), None)
+			if err:
+				errors.append(err)
+				continue
+			res_ids = np.concatenate([p_ids for p_ids, _, _ in parts])
+			values = np.concatenate([res.value for _, res, _ in parts])
+			_upsert_data(col, res_ids, Value(TYPE.COLUMN, parts[0][1].dtype, values), whole_column=True)
+			errors.append(None)
+	finally:
+		for shm in blocks + [flag for flag, _ in tasks]:
+			shm.close()
+			shm.unlink()
+	return errors
+
+def _compute_rows_in_processes(columns: list[ComputedColumn], row_ids: list[int]):
+	executor = _get_process_pool()
+	feid_columns = _feid_columns(row_ids)
+	flags = [SharedMemory(create=True, size=1) for _ in columns]
+	errors: list[Exception | None] = []
+	try:
+		futures = [executor.submit(_compute_in_process, col.definition, row_ids, None, {}, feid_columns, flag.name) for col, flag in zip(columns, flags)]
+		for col, future, flag in zip(columns, futures, flags):
+			try:
+				[(ids, result, err)] = _process_results(col.name, [future], flag)
+			except Exception as e:
+				errors.append(e)
+				continue
+			if not err:
+				_upsert_data(col, ids, result) # type: ignore
+			errors.append(err)
+	finally:
+		for flag in flags:
+			flag.close()
+			flag.unlink()
+	return errors
+
+PREVIEW_EVENTS = 48
+background = OperationCache()
+
+def _sample_ids(count: int):
+	ids = ComputationContext().select_columns_by_name(['id'])[0].astype(int)
+	if len(ids) <= count:
+		return ids.tolist()
+	return ids[np.linspace(0, len(ids) - 1, count).astype(int)].tolist()
+
+def _preview(user_id: int, name: str, definition: str, role: str | None, target_ids: list[int] | None = None):
+	budget = budget_for(role)
+	ctx = ComputationContext()
+	budget_check = Computation(user_id, name, budget)
+	budget_check.check_estimate(estimate_cost(columnParser.parse(definition), len(ctx.select_columns_by_name(['id'])[0]), ctx.frame_hours()))
 
-	ids, result, err = _compute(definition)
+	computation = budgets.start(user_id, name, budget)
+	try:
+		ids, result, err = _compute(definition, target_ids or _sample_ids(PREVIEW_EVENTS), computation=computation)
+	finally:
+		budgets.finish(computation)
 	if err: raise err
 	assert ids is not None and result
-	
+	return ids, result
+
+def preview_column(user_id: int, json_body, role: str | None = None):
+	t_start = time()
+	definition, target_ids = json_body.get('definition'), json_body.get('ids')
+	if not definition:
+		raise ValueError('Definition is empty')
+	if target_ids is not None and (not isinstance(target_ids, list) or len(target_ids) > 1000):
+		raise ValueError('Bad ids list')
+
+	ids, result = _preview(user_id, 'preview', definition, role, target_ids)
+	values: np.ndarray = result.value # type: ignore
+	if values.dtype.kind == 'f':
+		values = np.where(np.isfinite(values), np.round(values, 3), None) # type: ignore
+	return { 'dtype': value_to_sql_dtype(result.dtype), 'ids': ids.tolist(), 'values': values.tolist(), 'time': round(time() - t_start, 3) }
+
+background_locks: dict[int, Lock] = {}
+
+def _background_compute(progress, column: ComputedColumn, user_id: int, role: str | None):
+	with compute_lock:
+		col_lock = background_locks.setdefault(column.id, Lock())
+	with col_lock: # consecutive edits of the same column are written in order
+		err = _compute_and_upsert(column, budget=budget_for(role), user_id=user_id)
+	if err: raise err
+
+def background_status(col_id: int):
+	return background.status((col_id,))
+
+def upsert_column(user_id: int, json_body, col_id: int | None, role: str | None = None):
+	name, description, definition, is_public = \
+		[json_body.get(i) for i in ('name', 'description', 'definition', 'is_public')]
+
+	_, result = _preview(user_id, name, definition, role)
 	dtype = value_to_sql_dtype(result.dtype)
 
 	with pool.connection() as conn:
@@ -108,8 +358,9 @@ def upsert_column(user_id: int, json_body, col_id: int | None):
 			column.drop_in_table(conn)
 			column.init_in_table(conn)
 			log.info(f'Column edited by ({user_id}): #{column.id} {column.name}')
-	
-	_upsert_data(column, ids, result, whole_column=True) # type: ignore
+	feid_store.drop_column(column.sql_name)
+
+	background.start(_background_compute, (column.id,), column, user_id, role)
 
 	return column
 
@@ -124,8 +375,9 @@ def delete_column(user_id: int, col_id: int):
 		conn.execute(sql.SQL(f'ALTER TABLE events.{DATA_TABLE} DROP COLUMN {{}}').format(sql.Identifier(column.sql_name)))
 		clear_comp_col_changelog(conn, column.sql_name)
 		log.info(f'Column deleted by ({user_id}): #{column.id} {column.name} = {column.definition}')
+	feid_store.drop_column(column.sql_name)
 
-def compute_by_name(user_id: int, col_name: str):
+def compute_by_name(user_id: int, col_name: str, role: str | None = None):
 	t_start = time()
 
 	if col_name == 'duration':
@@ -137,7 +389,7 @@ def compute_by_name(user_id: int, col_name: str):
 			raise ValueError('Column not found')
 		col_def = column.definition
 		
-		err = _compute_and_upsert(column)
+		err = _compute_and_upsert(column, budget=budget_for(role), user_id=user_id)
 		
 	if err: raise err
 
@@ -150,9 +402,12 @@ def compute_rows(row_ids: list[int]):
 
 	compute_and_upsert_duration(row_ids) 
 	columns = select_computed_columns(select_all=True)
-	with ThreadPoolExecutor() as executor:
-		func = lambda col: _compute_and_upsert(col, row_ids)
-		errors = executor.map(func, columns)
+	if COMPUTE_PROCESSES:
+		errors = _compute_rows_in_processes(columns, row_ids)
+	else:
+		with ThreadPoolExecutor() as executor:
+			func = lambda col: _compute_and_upsert(col, row_ids)
+			errors = executor.map(func, columns)
 
 	str_errors = '; '.join([f'{col.name}: {err}' for col, err in zip(columns, errors) if err])
 	return ComputationResponse(time=time()-t_start, error=str_errors if str_errors else None).to_dict()
@@ -162,13 +417,17 @@ def _do_compute_all():
 	columns = select_computed_columns(select_all=True)
 
 	compute_and_upsert_duration()
-	# TODO: shared computation context
-	with ThreadPoolExecutor() as executor:
-		func = lambda col: _compute_and_upsert(col)
-		errors = executor.map(func, columns)
+	if COMPUTE_PROCESSES:
+		errors = _compute_all_in_processes(columns)
+	else:
+		# TODO: shared computation context
+		with ThreadPoolExecutor() as executor:
+			func = lambda col: _compute_and_upsert(col)
+			errors = executor.map(func, columns)
 	
 	str_errors = '; '.join([f'{col.name}: {err}' for col, err in zip(columns, errors) if err])
-	compute_all_active = (compute_all_active[0] if compute_all_active else time(), True, str_errors)
+	with compute_lock:
+		compute_all_active = (compute_all_active[0] if compute_all_active else time(), True, str_errors)
 
 def compute_all():
 	global compute_all_active
@@ -32,18 +32,19 @@ class Series:
 	def fetch(self, interval: tuple[int, int]) -> np.ndarray[Tuple[int, Literal[2]], np.dtype[np.float64]]:
 
 		if self.source == 'omni':
-			omni.ensure_prepared(interval)
-			res = omni.select(interval, [self.name])[0]
+			var = next((v for v in omni.omni_variables if v.name == self.name))
+			omni.ensure_prepared(interval, groups=[var.group])
+			if self.dtype == 'str':
+				res = omni.select(interval, [self.name])[0]
+				return np.array(res, dtype=object) if len(res) else np.empty((0, 2)) # type: ignore
+			res = omni.select_numeric(interval, [self.name])
 		elif self.source == 'sat':
-			# TODO: sat.ensure_prepared
+			sat.ensure_prepared(interval, self.name)
 			res = sat.select_hourly_averaged(interval, self.name)
 		else:
-			res = gsm.select(interval, [self.name])
+			return gsm.select(interval, [self.name])
 
-		if len(res) < 1:
-			return np.empty((0, 2)) # type: ignore
-		
-		return np.array(res, dtype=np.float64)
+		return np.column_stack(res).astype(np.float64) if len(res) and len(res[0]) else np.empty((0, 2)) # type: ignore
 
 	def as_dict(self):
 		return asdict(self)
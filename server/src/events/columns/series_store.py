@@ -0,0 +1,119 @@
+from threading import Lock
+from datetime import datetime, timezone
+from time import time
+import numpy as np
+
+from database import log, on_upsert
+from events.columns.series import Series, SERIES
+
+HOUR = 3600
+STORE_EPOCH = int(datetime(1957, 1, 1, tzinfo=timezone.utc).timestamp())
+CHUNK_HOURS = 8192 # ~341 days
+CHUNK_TTL = 24 * HOUR # reload anyway, in case the table was written by another process
+
+def _chunk_of(t: int):
+	return (t - STORE_EPOCH) // HOUR // CHUNK_HOURS
+
+def _chunk_bounds(chunk: int):
+	start = STORE_EPOCH + chunk * CHUNK_HOURS * HOUR
+	return start, start + (CHUNK_HOURS - 1) * HOUR
+
+class SeriesStore:
+	''' Process-wide dense hourly float32 arrays indexed by hours since STORE_EPOCH, loaded lazily by chunks and replaced, never modified in place '''
+	def __init__(self):
+		self.lock = Lock()
+		self.arrays: dict[str, np.ndarray] = {}
+		self.loaded: dict[tuple[str, int], float] = {} # (series, chunk) -> loaded at
+		self.generation: dict[tuple[str, int], int] = {}
+		self.loading: dict[tuple[str, int], Lock] = {}
+
+	def _array(self, name: str, length: int):
+		''' should be called with self.lock held '''
+		arr = self.arrays.get(name)
+		if arr is None or len(arr) < length:
+			grown = np.full(length, np.nan, np.float32)
+			if arr is not None:
+				grown[:len(arr)] = arr
+			arr = self.arrays[name] = grown
+		return arr
+
+	def _load(self, series: Series, chunk: int):
+		key = (series.name, chunk)
+		with self.lock:
+			gen = self.generation.get(key, 0)
+		start, end = _chunk_bounds(chunk)
+		end = min(end, int(time()) // HOUR * HOUR)
+		t_start = time()
+		res = series.fetch((start, end))
+
+		chunk_values = np.full(CHUNK_HOURS, np.nan, np.float32)
+		if len(res):
+			idx = (res[:,0].astype(np.int64) - start) // HOUR
+			mask = (idx >= 0) & (idx < CHUNK_HOURS)
+			chunk_values[idx[mask]] = res[mask,1]
+
+		offset = chunk * CHUNK_HOURS
+		with self.lock:
+			if self.generation.get(key, 0) != gen: # invalidated while loading, values may be stale
+				return False
+			# copy on write: arrays handed out by get() are never modified
+			arr = self._array(series.name, offset + CHUNK_HOURS).copy()
+			arr[offset:offset+CHUNK_HOURS] = chunk_values
+			self.arrays[series.name] = arr
+			self.loaded[key] = time()
+		log.debug('Series store: loaded %s chunk #%s [%s] in %ss', series.name, chunk, len(res), round(time() - t_start, 3))
+		return True
+
+	def _ensure(self, series: Series, interval: tuple[int, int]):
+		for chunk in range(max(0, _chunk_of(interval[0])), _chunk_of(interval[1]) + 1):
+			if _chunk_bounds(chunk)[0] > time():
+				break
+			key = (series.name, chunk)
+			with self.lock:
+				chunk_lock = self.loading.setdefault(key, Lock())
+			with chunk_lock:
+				with self.lock:
+					at = self.loaded.get(key)
+				if at is None or time() - at > CHUNK_TTL:
+					for _ in range(3): # data keeps changing, serve what is there after a few attempts
+						if self._load(series, chunk):
+							break
+
+	def get(self, series: Series, interval: tuple[int, int]) -> np.ndarray:
+		''' Read-only hourly values for interval (inclusive), NaN where data is absent '''
+		if series.dtype != 'real':
+			raise ValueError(f'Series store only supports real series, not {series.name}')
+		h_start = (interval[0] - STORE_EPOCH) // HOUR
+		h_end = (interval[1] - STORE_EPOCH) // HOUR
+		if h_end < h_start:
+			return np.empty(0, np.float32)
+		self._ensure(series, interval)
+		with self.lock:
+			arr = self._array(series.name, h_end + 1)
+
+		if h_start < 0:
+			res = np.concatenate((np.full(-h_start, np.nan, np.float32), arr[:h_end+1]))
+		else:
+			res = arr[h_start:h_end+1]
+		res.flags.writeable = False
+		return res
+
+	def invalidate(self, name: str, span: tuple[int, int] | None = None):
+		with self.lock:
+			if span is None:
+				keys = [k for k in self.loading if k[0] == name]
+			else:
+				keys = [(name, c) for c in range(max(0, _chunk_of(span[0])), _chunk_of(span[1]) + 1)]
+			for key in keys:
+				self.loaded.pop(key, None)
+				self.generation[key] = self.generation.get(key, 0) + 1
+
+series_store = SeriesStore()
+
+@on_upsert
+def _on_upsert(schema: str, table: str, span: tuple[int, int] | None):
+	if schema != 'public':
+		return
+	for series in SERIES:
+		if series.table_name() == table:
+			series_store.invalidate(series.name, span)
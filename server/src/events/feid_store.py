@@ -0,0 +1,253 @@
+import os, zlib
+from threading import Lock
+from time import time
+import numpy as np
+from psycopg.sql import SQL, Identifier
+
+from database import pool, log, on_upsert, select_columnar, sql_float
+from events.columns.column import BaseColumn
+from events.columns.computed_column import DATA_TABLE
+from events.table_structure import E_FEID, ALL_TABLES
+
+SYNC_INTERVAL = 1 # seconds between changelog polls
+RELOAD_TTL = 600 # full reload anyway, in case the table was written by another process
+KEEP_DELETED = 4096
+
+def _is_text(col: BaseColumn):
+	return col.dtype in ['text', 'enum']
+
+def _numeric_expr(col: BaseColumn):
+	name = Identifier(col.sql_name)
+	if col.dtype == 'time':
+		return sql_float(SQL('EXTRACT(EPOCH FROM {})').format(name))
+	if col.dtype == 'real':
+		return sql_float(SQL('{}::numeric').format(name)) # float4 -> float8 keeping the shortest decimal representation
+	return sql_float(name)
+
+def _same(a: np.ndarray, b: np.ndarray):
+	if a.dtype == object or b.dtype == object:
+		return a == b
+	return (a == b) | (np.isnan(a) & np.isnan(b))
+
+def _blank(like: np.ndarray, length: int):
+	return np.full(length, None if like.dtype == object else np.nan, dtype=like.dtype)
+
+def _to_list(arr: np.ndarray, col: BaseColumn):
+	if _is_text(col):
+		return arr.tolist()
+	nan = np.isnan(arr).tolist()
+	vals = (np.nan_to_num(arr).astype(np.int64) if col.dtype in ['integer', 'time'] else arr).tolist()
+	return [None if n else v for n, v in zip(nan, vals)]
+
+class FeidStore:
+	''' Process-wide columnar copy of FEID joined with computed columns, rows ordered by time '''
+	def __init__(self):
+		self.lock = Lock()
+		self.ids: np.ndarray | None = None
+		self.columns: dict[str, np.ndarray] = {}
+		self.known: dict[str, BaseColumn] = {}
+		self.static_stale = False
+		self.loaded_at = 0.
+		self.synced_at = 0.
+		self.log_id = 0
+		self.version = 0
+		# versions are only comparable within one process lifetime
+		self.token = f'{os.getpid():x}{int(time()):x}'
+		self.row_version = np.empty(0, np.int64)
+		self.col_version: dict[str, int] = {}
+		self.deleted: list[tuple[int, int]] = [] # (version, id)
+		self.deleted_since = 0 # older deletions were forgotten
+
+	def _merge(self, new_ids: np.ndarray, new_cols: dict[str, np.ndarray], replace: np.ndarray | None = None):
+		''' should be called with self.lock held, replaces rows (all if replace is None) and versions the actual changes '''
+		version = self.version + 1
+		old_ids = self.ids if self.ids is not None else np.empty(0, np.int64)
+		old_mask = np.ones(len(old_ids), bool) if replace is None else np.isin(old_ids, replace)
+
+		if len(old_ids):
+			sorter = np.argsort(old_ids)
+			pos = sorter[np.clip(np.searchsorted(old_ids, new_ids, sorter=sorter), 0, len(old_ids) - 1)]
+			existed = old_ids[pos] == new_ids
+		else:
+			pos, existed = np.zeros(len(new_ids), int), np.zeros(len(new_ids), bool)
+		changed = ~existed
+		for name, col in new_cols.items():
+			if name in self.columns:
+				changed |= existed & ~_same(self.columns[name][pos], col)
+		new_versions = np.where(changed, version, self.row_version[pos] if len(old_ids) else version)
+
+		gone = old_ids[old_mask & ~np.isin(old_ids, new_ids)]
+		self.deleted.extend((version, int(i)) for i in gone)
+		if len(self.deleted) > KEEP_DELETED:
+			self.deleted_since = self.deleted[-KEEP_DELETED - 1][0]
+			self.deleted = self.deleted[-KEEP_DELETED:]
+
+		keep = ~old_mask
+		order = np.argsort(np.concatenate((self.columns['time'][keep], new_cols['time'])), kind='stable')
+		self.ids = np.concatenate((old_ids[keep], new_ids))[order]
+		self.row_version = np.concatenate((self.row_version[keep], new_versions))[order]
+		added = [name for name in new_cols if name not in self.columns]
+		for name in set(self.columns) | set(new_cols):
+			if name in new_cols:
+				part = new_cols[name]
+			else: # not selected, keep previous values of the replaced rows
+				part = _blank(self.columns[name], len(new_ids))
+				part[existed] = self.columns[name][pos[existed]]
+			old = self.columns[name][keep] if name in self.columns else _blank(part, np.count_nonzero(keep))
+			self.columns[name] = np.concatenate((old, part))[order]
+		for name in added:
+			self.col_version[name] = version
+		if changed.any() or len(gone) or added:
+			self.version = version
+
+	def _query(self, columns: list[BaseColumn], ids: list[int] | None = None):
+		''' should be called with self.lock held, returns ids and columns ordered by time '''
+		cond, params = (SQL('WHERE id = ANY(%s)'), [ids]) if ids is not None else (SQL(''), [])
+		tmpl = SQL(f'SELECT {{}} FROM events.{E_FEID} LEFT JOIN events.{DATA_TABLE} ON id = feid_id {{}} ORDER BY time')
+		numeric = [c for c in columns if not _is_text(c)]
+		query = tmpl.format(SQL(',').join([SQL('id::int8'), *[_numeric_expr(c) for c in numeric]]), cond)
+		res_ids, *res = select_columnar(query, params, ['i8'] + ['f8'] * len(numeric))
+		result = { c.sql_name: arr for c, arr in zip(numeric, res) }
+
+		text = [c for c in columns if _is_text(c)]
+		if text:
+			with pool.connection() as conn:
+				rows = conn.execute(tmpl.format(SQL(',').join([SQL('id'), *[Identifier(c.sql_name) for c in text]]), cond), params).fetchall()
+			pos = { r_id: i for i, r_id in enumerate(res_ids.tolist()) }
+			for j, c in enumerate(text):
+				arr = np.full(len(res_ids), None, dtype=object)
+				for row in rows:
+					if row[0] in pos: # inserted in between the two queries
+						arr[pos[row[0]]] = row[1 + j]
+				result[c.sql_name] = arr
+		return res_ids, result
+
+	def _reload(self):
+		static = ALL_TABLES[E_FEID]
+		columns = [*static, *[c for c in self.known.values() if c.sql_name not in [s.sql_name for s in static]]]
+		with pool.connection() as conn:
+			row = conn.execute('SELECT max(id) FROM events.changes_log').fetchone()
+			self.log_id = (row and row[0]) or 0
+		t_start = time()
+		new_ids, new_cols = self._query(columns)
+		self.columns = { n: c for n, c in self.columns.items() if n in new_cols }
+		if self.ids is None:
+			self.ids, self.row_version = new_ids, np.zeros(len(new_ids), np.int64)
+			self.columns = new_cols
+			self.col_version = { n: 0 for n in new_cols }
+		else:
+			self._merge(new_ids, new_cols)
+		for c in columns:
+			self.known[c.sql_name] = c
+		self.static_stale = False
+		self.loaded_at = self.synced_at = time()
+		log.debug('FEID store: loaded [%s] x [%s] in %ss', len(self.ids), len(columns), round(time() - t_start, 3))
+
+	def _sync(self):
+		''' pick up edits made through the changelog since the last poll '''
+		self.synced_at = time()
+		with pool.connection() as conn:
+			changes = conn.execute('SELECT id, event_id FROM events.changes_log WHERE id > %s AND entity_name = %s',
+				[self.log_id, E_FEID]).fetchall()
+		if not changes:
+			return
+		self.log_id = max(c[0] for c in changes)
+		self._refresh_rows(list({ c[1] for c in changes if c[1] is not None }))
+
+	def _refresh_rows(self, ids: list[int]):
+		if self.ids is None or not ids:
+			return
+		new_ids, new_cols = self._query(list(self.known.values()), ids)
+		self._merge(new_ids, new_cols, np.array(ids))
+
+	def _ensure(self, columns: list[BaseColumn]):
+		''' should be called with self.lock held '''
+		if self.ids is None or self.static_stale or time() - self.loaded_at > RELOAD_TTL:
+			self._reload()
+		elif time() - self.synced_at > SYNC_INTERVAL:
+			self._sync()
+		missing = [c for c in columns if c.sql_name not in self.columns]
+		if missing:
+			for c in missing:
+				self.known[c.sql_name] = c
+			ids, res = self._query(missing)
+			if len(ids) != len(self.ids) or np.any(ids != self.ids): # rows changed meanwhile
+				self._reload()
+			else:
+				for c in missing:
+					self.columns[c.sql_name] = res[c.sql_name]
+					self.col_version[c.sql_name] = self.version = self.version + 1
+
+	def select(self, columns: list[BaseColumn], target_ids: list[int] | None = None, frame: tuple[int, int] | None = None):
+		''' copies of the columns for all, given or fitting in the time frame events '''
+		with self.lock:
+			self._ensure(columns)
+			assert self.ids is not None
+			if target_ids is not None:
+				mask = np.isin(self.ids, target_ids)
+			elif frame is not None:
+				mask = (frame[0] <= self.columns['time']) & (self.columns['time'] <= frame[1])
+			else:
+				mask = np.ones(len(self.ids), bool)
+			return [self.columns[c.sql_name][mask] for c in columns]
+
+	def rows(self, columns: list[BaseColumn]):
+		''' rows as select_events returned them: epoch seconds for time, None for nulls '''
+		with self.lock:
+			self._ensure(columns)
+			data = [_to_list(self.columns[c.sql_name], c) for c in columns]
+		return [list(row) for row in zip(*data)]
+
+	def refresh_rows(self, ids: list[int]):
+		with self.lock:
+			self._refresh_rows(ids)
+
+	def refresh_columns(self, sql_names: list[str]):
+		with self.lock:
+			cols = [self.known[n] for n in sql_names if n in self.columns]
+			if self.ids is None or not cols:
+				return
+			ids, res = self._query([self.known['time'], *cols], self.ids.tolist())
+			self._merge(ids, res, ids)
+
+	def current_version(self, columns: list[BaseColumn]):
+		''' opaque version of the data in given columns '''
+		names_hash = zlib.crc32(','.join(c.sql_name for c in columns).encode())
+		with self.lock:
+			self._ensure(columns)
+			return f'{self.token}.{self.version}.{names_hash:x}'
+
+	def delta(self, columns: list[BaseColumn], since: str | None):
+		''' rows changed after the since version and deleted ids, or None when full data should be sent '''
+		with self.lock:
+			self._ensure(columns)
+			names_hash = zlib.crc32(','.join(c.sql_name for c in columns).encode())
+			version = f'{self.token}.{self.version}.{names_hash:x}'
+			try:
+				token, ver, hsh = (since or '').split('.')
+				since_ver = int(ver)
+			except ValueError:
+				return version, None
+			if token != self.token or hsh != f'{names_hash:x}' or since_ver > self.version or since_ver < self.deleted_since \
+					or any(self.col_version.get(c.sql_name, 0) > since_ver for c in columns):
+				return version, None
+			changed = self.row_version > since_ver
+			data = [_to_list(self.columns[c.sql_name][changed], c) for c in columns]
+			deleted = [i for v, i in self.deleted if v > since_ver]
+			return version, ([list(row) for row in zip(*data)], deleted)
+
+	def drop_column(self, sql_name: str):
+		with self.lock:
+			self.columns.pop(sql_name, None)
+			self.known.pop(sql_name, None)
+
+	def invalidate(self):
+		with self.lock:
+			self.static_stale = True
+
+feid_store = FeidStore()
+
+@on_upsert
+def _on_upsert(schema: str, table: str, span: tuple[int, int] | None):
+	if schema == 'events' and table == E_FEID:
+		feid_store.invalidate()
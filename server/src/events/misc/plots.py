@@ -1,34 +1,88 @@
-from datetime import timedelta
 from dataclasses import dataclass
 import numpy as np
 from time import time as ctime
 
-from database import pool, log, SQL, Identifier
+from database import log
 from cream.gsm import normalize_variation
-from events.columns.series import find_series
+from events.columns.series import find_series, SERIES
+from events.columns.series_store import series_store
 from events.columns.parser import columnParser, ColumnComputer, TYPE
+from events.columns.context import SERIES_FRAME_MARGIN_H
 
 HOUR = 3600
 
-def epoch_collision(times: list[int], interval: list[int], ser_name: str):
-	series = find_series(ser_name)
+def _frames(epochs: np.ndarray, interval: list[int]):
+	''' merged frames covering the window of every epoch, with a margin for shifts and moving windows '''
+	frames: list[list[int]] = []
+	for epoch in np.unique(epochs).tolist():
+		start, end = epoch + (interval[0] - SERIES_FRAME_MARGIN_H) * HOUR, epoch + interval[1] * HOUR
+		if frames and start <= frames[-1][1] + HOUR:
+			frames[-1][1] = end
+		else:
+			frames.append([start, end])
+	return frames
+
+def _epoch_windows(definition: str, epochs: np.ndarray, interval: list[int]):
+	''' (epochs x offsets) hourly values of a series or expression and whether they should be normalized '''
+	offset = np.arange(interval[1] - interval[0] + 1)
+	series = next((s for s in SERIES if s.name == definition or s.display_name.lower() == definition.lower()), None)
+	if series and series.dtype == 'real':
+		t_from, t_to = int(epochs.min()) + interval[0] * HOUR, int(epochs.max()) + interval[1] * HOUR
+		values = series_store.get(series, (t_from, t_to))
+		idx = ((epochs - t_from) // HOUR)[:,None] + offset[None,:]
+		return values[idx].astype('f8'), series.name in ['a10', 'a10m'] # GLE hours are masked by gsm.select
+	if series:
+		raise ValueError(f'Not a numeric series: {definition}')
 
-	with pool.connection() as conn:
-		query = SQL(f'''SELECT array(
-			SELECT {{}} FROM generate_series(to_timestamp(epoch) + %s, to_timestamp(epoch) + %s, '1 hour'::interval) tm
-			LEFT JOIN {{}} ON time = tm {'AND NOT is_gle' if series.source == 'gsm' else ''}
-		) FROM (select unnest(%s)) vals(epoch);''').format(Identifier(series.name), Identifier(series.table_name()))
-		resp = conn.execute(query, [*[timedelta(hours=i) for i in interval], times]).fetchall()
-		windows = np.array([r[0] for r in resp], dtype='f8')
+	# NOTE: expressions are computed only around the epochs, all of them may span decades of hourly data
+	parsed = columnParser.parse(definition)
+	frames = _frames(epochs, interval)
+	parts = []
+	for start, end in frames:
+		result = ColumnComputer(force_frame=(start, end)).transform(parsed)
+		if result.type != TYPE.SERIES:
+			raise ValueError(f'Not a series expression: {definition}')
+		length = (end - start) // HOUR + 1
+		res = np.asarray(result.value, dtype='f8')[:length]
+		part = np.full(length, np.nan)
+		part[:len(res)] = res # series ending at present are shorter than the frame
+		parts.append(part)
 
-	if series.name in ['a10', 'a10m']:
-		windows = np.array([normalize_variation(w) for w in windows])
+	starts = np.array([start for start, _ in frames])
+	bases = np.cumsum([0] + [len(p) for p in parts[:-1]])
+	win_start = epochs + interval[0] * HOUR
+	frame = np.searchsorted(starts, win_start, side='right') - 1
+	idx = (bases[frame] + (win_start - starts[frame]) // HOUR)[:,None] + offset[None,:]
+	return np.concatenate(parts)[idx], False
 
-	offset = np.arange(windows.shape[1]) + interval[0]
-	median = np.nanmedian(windows, axis=0)
-	mean = np.nanmean(windows, axis=0)
-	std = np.nanstd(windows, axis=0)
+def epoch_collision_batch(samples: list[list[int]], interval: list[int], definitions: list[str]):
+	''' superposed epoch statistics for every definition (series name or expression) over every sample of epochs '''
+	epochs = [np.array(times, dtype=np.int64) // HOUR * HOUR for times in samples]
+	if not any(len(ep) for ep in epochs):
+		raise ValueError('No epochs given')
 
+	all_epochs = np.concatenate(epochs)
+	offset = np.arange(interval[0], interval[1] + 1)
+	bounds = np.cumsum([0] + [len(ep) for ep in epochs])
+
+	results = []
+	for definition in definitions:
+		windows, normalize = _epoch_windows(definition, all_epochs, interval)
+		if normalize:
+			windows = np.array([normalize_variation(w) for w in windows])
+
+		stats = []
+		for start, end in zip(bounds[:-1], bounds[1:]):
+			sample = windows[start:end]
+			stats.append((np.nanmedian(sample, axis=0), np.nanmean(sample, axis=0), np.nanstd(sample, axis=0)))
+		results.append(stats)
+
+	return offset, results
+
+def epoch_collision(times: list[int], interval: list[int], ser_name: str):
+	find_series(ser_name)
+	offset, results = epoch_collision_batch([times], interval, [ser_name])
+	median, mean, std = results[0][0]
 	return offset, median, mean, std
 
 def custom_plot(interval: tuple[int, int], definitions: list[str], feid_id: int | None):
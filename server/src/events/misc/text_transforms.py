@@ -1,4 +1,4 @@
-from database import pool, log
+from database import pool, log, IS_WORKER
 from dataclasses import dataclass, asdict
 from datetime import datetime
 import ts_type
@@ -39,7 +39,8 @@ def _init():
 			public BOOLEAN NOT NULL DEFAULT 'f',
 			transforms JSON NOT NULL,
 			UNIQUE (name, author))''')
-_init()
+if not IS_WORKER:
+	_init()
 
 def select(uid=None):
 	with pool.connection() as conn:
@@ -4,10 +4,11 @@ import ts_type
 from database import pool, log
 from psycopg.sql import SQL, Identifier, Placeholder
 
-from events.changelog import ChangelogResponse, select_changelog
+from events.changelog import ChangelogResponse, select_changelog, record_changes
 from events.columns.column import Column
 from events.table_structure import ALL_TABLES, E_FEID, EDITABLE_TABLES, E_SOURCE_CH, E_SOURCE_ERUPT
 from events.columns.computed_column import select_computed_columns, DATA_TABLE as CC_TABLE
+from events.feid_store import feid_store
 
 @ts_type.gen_type
 @dataclass
@@ -15,12 +16,63 @@ class TableDataResponse:
 	columns: list[Column]
 	data: list[list[float | str | None]]
 	changelog: ChangelogResponse | None = None
+	version: str | None = None
+	delta: bool = False # data only holds rows changed since requested version
+	deleted: list[int] | None = None
+	cursor: str | None = None # to request the next page, when limit was reached
 
 	def to_dict(self):
 		return asdict(self)
 
+def _parse_cursor(cursor: str):
+	''' cursor is the time of the last row sent and the number of rows sent with that time '''
+	try:
+		t_last, skip = cursor.split('.')
+		return int(t_last), int(skip)
+	except ValueError:
+		raise ValueError(f'Bad cursor: {cursor}')
 
-def select_events(entity: str, user_id: int|None=None, include: list[str]|None=None, changelog=False):
+def _select_page(conn, entity: str, columns: list[Column], time_col: Column,
+		t_from: int | None, t_to: int | None, limit: int | None, cursor: str | None):
+	itime = Identifier(time_col.sql_name)
+	cond, params, skip = [], [], 0
+	if t_from is not None:
+		cond.append(SQL('{} >= to_timestamp(%s)').format(itime))
+		params.append(t_from)
+	if t_to is not None:
+		cond.append(SQL('{} <= to_timestamp(%s)').format(itime))
+		params.append(t_to)
+	if cursor is not None:
+		t_last, skip = _parse_cursor(cursor)
+		cond.append(SQL('{} >= to_timestamp(%s)').format(itime))
+		params.append(t_last)
+	# NOTE: not all catalogs have id, so rows with equal time are ordered by all of the columns
+	order = SQL(',').join([SQL('{}.{}').format(Identifier(entity), Identifier(n)) for n in # qualified so time is not the output alias
+		[time_col.sql_name, *[c.sql_name for c in ALL_TABLES[entity] if c.sql_name != time_col.sql_name]]])
+	# NOTE: the cursor holds floored seconds, since sql_val() rounds and a row rounded up could be skipped
+	floored = SQL('floor(EXTRACT(EPOCH FROM {}.{}))::bigint').format(Identifier(entity), itime)
+	query = SQL('SELECT {} FROM events.{} {} ORDER BY {}').format(SQL(',').join([*[c.sql_val() for c in columns], floored]),
+		Identifier(entity), SQL('WHERE ') + SQL(' AND ').join(cond) if cond else SQL(''), order)
+	if limit is not None:
+		query += SQL(' LIMIT %s')
+		params.append(limit)
+	if skip:
+		query += SQL(' OFFSET %s')
+		params.append(skip)
+	rows = conn.execute(query, params).fetchall()
+	data = [row[:-1] for row in rows]
+	if limit is None or len(data) < limit:
+		return data, None
+
+	t_last = rows[-1][-1]
+	same = sum(1 for row in rows if row[-1] == t_last)
+	if cursor is not None and t_last == _parse_cursor(cursor)[0]:
+		same += skip
+	return data, f'{t_last}.{same}'
+
+
+def select_events(entity: str, user_id: int|None=None, include: list[str]|None=None, changelog=False, since: str|None=None,
+		t_from: int|None=None, t_to: int|None=None, limit: int|None=None, cursor: str|None=None):
 	if entity not in ALL_TABLES:
 		raise NameError(f'Unknown entity: \'{entity}\'')
 	
@@ -28,27 +80,54 @@ def select_events(entity: str, user_id: int|None=None, include: list[str]|None=N
 	cols = ALL_TABLES[entity]
 	if is_feid:
 		cols = [*cols, *select_computed_columns(user_id)]
-	columns = cols if include is None else [c for c in cols if c.name in include]
+	columns = cols if include is None else [c for c in cols if c.name in include or c.sql_name in include]
 
-	col_q = SQL(',').join([c.sql_val() for c in cols])
 	time_col = next((c for c in cols if 'time' in c.sql_name), None)
-	order = Identifier(time_col.sql_name if time_col else 'id')
+	paged = any(p is not None for p in [t_from, t_to, limit, cursor])
+	if paged and (is_feid or time_col is None):
+		raise ValueError(f'Paging is not supported for {entity}')
+	if limit is not None and limit < 1:
+		raise ValueError('Limit should be positive')
 
-	join_ccs = SQL(f'LEFT JOIN events.{CC_TABLE} ON id = feid_id ' if is_feid else '')
-	query = SQL('SELECT {} FROM events.{} {} ORDER BY {}').format(col_q, Identifier(entity), join_ccs, order)
+	version, delta = feid_store.delta(columns, since) if is_feid else (None, None)
 
 	with pool.connection() as conn:
-		data = conn.execute(query).fetchall()
-
-		resp = TableDataResponse(columns, data)
+		if delta is not None:
+			data, deleted = delta
+			resp = TableDataResponse(columns, data, version=version, delta=True, deleted=deleted)
+		elif is_feid:
+			data = feid_store.rows(columns)
+			resp = TableDataResponse(columns, data, version=version)
+		elif time_col is not None:
+			data, next_cursor = _select_page(conn, entity, columns, time_col, t_from, t_to, limit, cursor)
+			resp = TableDataResponse(columns, data, cursor=next_cursor)
+		else:
+			query = SQL('SELECT {} FROM events.{} ORDER BY id').format(
+				SQL(',').join([c.sql_val() for c in columns]), Identifier(entity))
+			data = conn.execute(query).fetchall()
+			resp = TableDataResponse(columns, data)
 
 		if changelog:
-			resp.changelog = select_changelog(conn, entity, columns)
+			changed_ids = [row[0] for row in data] if delta is not None else None
+			resp.changelog = select_changelog(conn, entity, columns, changed_ids)
+
+	if delta is not None:
+		log.debug('FEID delta for %s: [%s] rows, [%s] deleted', user_id, len(data), len(resp.deleted or []))
+		return resp.to_dict()
 
 	if is_feid:
 		log.info('FEID rendered for %s', (('user #'+str(user_id)) if user_id is not None else 'anon'))
 	return resp.to_dict()
 
+def changelog_page(entity: str, user_id: int|None=None, event_id: int|None=None, before: int|None=None, limit=256):
+	if entity not in ALL_TABLES:
+		raise NameError(f'Unknown entity: \'{entity}\'')
+	cols = ALL_TABLES[entity]
+	if entity == E_FEID:
+		cols = [*cols, *select_computed_columns(user_id)]
+	with pool.connection() as conn:
+		return asdict(select_changelog(conn, entity, cols, None if event_id is None else [event_id], before, limit))
+
 def link_source(feid_id: int, entity: str, existing_id = None):
 	with pool.connection() as conn:
 		assert entity in [E_SOURCE_CH, E_SOURCE_ERUPT]
@@ -71,6 +150,8 @@ def delete(user_id: int, event_id: int, entity: str):
 		query = SQL('DELETE FROM events.{} WHERE id = %s').format(Identifier(entity))
 		conn.execute(query, [event_id])
 	log.info('user #%s deleted %s #%s', user_id, entity, event_id)
+	if entity == E_FEID:
+		feid_store.refresh_rows([event_id])
 
 def create(user_id, entity, time, duration):
 	assert entity in ALL_TABLES
@@ -79,12 +160,46 @@ def create(user_id, entity, time, duration):
 		res = conn.execute(query, [time, duration]).fetchone()
 		event_id = res and res[0]
 	log.info('user #%s inserted %s #%s', user_id, entity, event_id)
+	if entity == E_FEID and event_id is not None:
+		feid_store.refresh_rows([event_id])
 	return event_id
 
+def _parse_value(column, value):
+	if value is None:
+		return None
+	dtype = column.dtype
+	if dtype == 'time':
+		return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.000Z')
+	if dtype == 'real':
+		return float(value) if value != 'auto' else None
+	if dtype == 'integer':
+		return int(value) if value != 'auto' else None
+	if dtype == 'enum' and isinstance(column, Column) and column.enum and value not in column.enum:
+		raise ValueError(f'Bad enum value for {column.name}: {value}')
+	return value
+
+def _log_str(value, dtype):
+	if value is None or isinstance(value, str):
+		return value
+	if dtype == 'time':
+		return str((value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp())
+	return str(value)
+
+def _apply_changes(conn, table: str, id_col: str, column, changes: list[tuple[int, object]]):
+	''' set column for (id, value) pairs at once, ids should be unique, returns old values by id '''
+	ids, values = [list(c) for c in zip(*changes)]
+	query = SQL('UPDATE events.{tbl} tgt SET {col} = chg.val FROM unnest(%s::integer[], %s::{type}[]) AS chg(id, val), ' +
+		'events.{tbl} old WHERE tgt.{id} = chg.id AND old.{id} = chg.id RETURNING chg.id, old.{col}').format(
+		tbl=Identifier(table), col=Identifier(column.sql_name), type=column.sql_type(), id=Identifier(id_col))
+	return dict(conn.execute(query, [ids, values]).fetchall())
+
 def submit_changes(user_id, entities):
+	touched_feid: set[int] = set()
+	comp_cols = select_computed_columns(user_id)
 	with pool.connection() as conn:
 		try:
 			inserted_ids = {}
+			to_log = []
 			for entity in EDITABLE_TABLES:
 				if entity not in entities:
 					continue
@@ -109,17 +224,23 @@ def submit_changes(user_id, entities):
 					inserted_id = res and res[0]
 
 					inserted_ids[create_id] = inserted_id
+					if entity == E_FEID:
+						touched_feid.add(inserted_id)
 
 					conn.execute('INSERT INTO events.changes_log (author, event_id, entity_name, special) '+\
 						'VALUES (%s,%s,%s,%s)', [user_id, inserted_id, entity, 'create'])
 					log.info(f'Event created by user #{user_id}: {entity}#{inserted_id} {created.get('time', '')}')
 
-				for deleted in entities[entity]['deleted']:
-					query = SQL('DELETE FROM events.{} WHERE id = %s').format(Identifier(entity))
+				deleted = entities[entity]['deleted']
+				if deleted:
+					query = SQL('DELETE FROM events.{} WHERE id = ANY(%s)').format(Identifier(entity))
 					conn.execute(query, [deleted])
-					log.info(f'Event delted by user #{user_id}: {entity}#{deleted}')
+					if entity == E_FEID:
+						touched_feid.update(deleted)
+					log.info(f'Events deleted by user #{user_id}: {entity}#{deleted}')
 
-				comp_cols = select_computed_columns(user_id)
+				# changes of one column are applied with one statement, repeated changes of a cell go to following rounds
+				groups: dict[str, list[tuple[set[int], list[tuple]]]] = {}
 				for change in entities[entity]['changes']:
 					change_id, column, value, silent = [change.get(w) for w in ['id', 'column', 'value', 'silent']]
 					target_id = inserted_ids.get(change_id, change_id)
@@ -127,44 +248,39 @@ def submit_changes(user_id, entities):
 					found_column = found_column or next((c for c in comp_cols if c.sql_name == column), None)
 					if not found_column :
 						raise ValueError(f'Column not found: {column}')
-					dtype = found_column.dtype
-					new_value = value
-					if value is not None:
-						if dtype == 'time':
-							new_value = datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.000Z')
-						if dtype == 'real':
-							new_value = float(value) if value != 'auto' else None
-						if dtype == 'integer':
-							new_value = int(value) if value != 'auto' else None
-						if dtype == 'enum' and value is not None and isinstance(found_column, Column) and found_column.enum and value not in found_column.enum:
-							raise ValueError(f'Bad enum value for {found_column.name}: {value}')
+					if target_id in deleted:
+						raise ValueError(f'Record not found: {entity} #{target_id}')
+					rounds = groups.setdefault(column, [])
+					entry = (target_id, _parse_value(found_column, value), value, silent, change_id in inserted_ids, found_column)
+					rnd = next((r for r in rounds if target_id not in r[0]), None)
+					if rnd is None:
+						rounds.append(rnd := (set(), []))
+					rnd[0].add(target_id)
+					rnd[1].append(entry)
+
+				for column, rounds in groups.items():
+					found_column = rounds[0][1][0][5]
 					table = entity if isinstance(found_column, Column) else CC_TABLE
 					id_col = 'id' if isinstance(found_column, Column) else 'feid_id'
+					for _, rnd in rounds:
+						old_values = _apply_changes(conn, table, id_col, found_column, [(e[0], e[1]) for e in rnd])
+						for target_id, new_value, value, silent, created, _ in rnd:
+							# NOTE: events created in this batch have no computed data row yet, these changes are no-op
+							if target_id not in old_values and not (created and table == CC_TABLE):
+								raise ValueError(f'Record not found: {table} #{target_id}')
+							if entity == E_FEID:
+								touched_feid.add(target_id)
+							if silent:
+								continue
+							old_value = None if created else old_values[target_id]
+							new_value_str = 'auto' if new_value is None and value == 'auto' else new_value
+							to_log.append((entity, target_id, column,
+								_log_str(old_value, found_column.dtype), _log_str(new_value_str, found_column.dtype)))
+					log.info(f'Changes by user #{user_id}: {entity} {column} x{sum(len(r) for _, r in rounds)}')
 
-					if change_id not in inserted_ids:
-						query = SQL('SELECT {} FROM events.{} WHERE {} = %s').format(Identifier(column), Identifier(table), Identifier(id_col))
-						res = conn.execute(query, [target_id]).fetchone()
-						if not res or target_id in entities[entity]['deleted']:
-							raise ValueError(f'Record not found: {table} #{target_id}')
-						old_value = res[0]
-					else:
-						old_value = None
-
-					query = SQL('UPDATE events.{} SET {} = %s WHERE {} = %s').format(Identifier(table), Identifier(column), Identifier(id_col))
-					conn.execute(query, [new_value, target_id])
-
-					if silent:
-						continue
-
-					new_value_str = 'auto' if new_value is None and value == 'auto' else new_value
-					old_str, new_str = [v if v is None else
-						v.replace(tzinfo=timezone.utc).timestamp() if dtype == 'time'
-						else str(v) for v in [old_value, new_value_str]]
-
-					conn.execute('INSERT INTO events.changes_log (author, event_id, entity_name, column_name, old_value, new_value) '+\
-						'VALUES (%s,%s,%s,%s,%s,%s)', [user_id, target_id, entity, column, old_str, new_str])
-					log.info(f'Change by user #{user_id}: {entity}#{target_id} {column} {old_value} -> {new_value_str}')
+			record_changes(conn, user_id, to_log)
 		except Exception as e:
 			conn.rollback()
 			log.info(f'Bad changes by user #%s, rolling back', user_id)
 			raise e
+	feid_store.refresh_rows(list(touched_feid))
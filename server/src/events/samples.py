@@ -1,9 +1,17 @@
-from datetime import datetime
-from database import pool, log
+import re, zlib
+from datetime import datetime, timezone
+from database import pool, log, IS_WORKER
 from dataclasses import dataclass, asdict
 from typing import Literal
+import numpy as np
 import ts_type
 
+from events.columns.column import BaseColumn
+from events.columns.computed_column import select_computed_columns
+from events.feid_store import feid_store
+from events.table_structure import ALL_TABLES, E_FEID
+from utility import ComputeCache
+
 FILTER_OP = Literal['>=', '<=', '==', '<>', 'is null', 'not null', 'regexp']
 FILTER_OPS: list[FILTER_OP] = ['>=', '<=', '==', '<>', 'is null', 'not null', 'regexp']
 
@@ -45,7 +53,8 @@ def _init():
 			whitelist int[] NOT NULL DEFAULT '{}',
 			blacklist int[] NOT NULL DEFAULT '{}',
 			UNIQUE (name, authors))''')
-_init()
+if not IS_WORKER:
+	_init()
 
 def select(uid=None):
 	with pool.connection() as conn:
@@ -89,3 +98,121 @@ def update_sample(uid, sid, name, authors, public, filters_json, whitelist, blac
 			'last_modified = CURRENT_TIMESTAMP WHERE id=%s',
 			[name, list(author_ids), public, filters_json, whitelist, blacklist, includes, sid])
 		log.info('Sample updated by user #%s: %s', uid, name)
+
+# Samples are evaluated the way the client applySample() does, to a bitmap where bit i (little bit order) is event id i,
+# bitmaps are cached per sample revision, resolved filter columns and FEID data version
+
+bitmaps = ComputeCache(max_size=256)
+
+def _parse_filter_value(value: str, column: BaseColumn):
+	try:
+		if column.dtype == 'time':
+			dt = datetime.fromisoformat(value.replace(' ', 'T') + 'Z' if ' ' in value else value)
+			return (dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp()
+		if column.dtype == 'real':
+			return float(value)
+		if column.dtype == 'integer':
+			return float(int(float(value)))
+	except ValueError:
+		return np.nan
+	return value
+
+def _as_text(arr: np.ndarray, column: BaseColumn):
+	if arr.dtype == object:
+		return ['null' if v is None else str(v) for v in arr]
+	if column.dtype == 'time':
+		return ['null' if np.isnan(v) else datetime.fromtimestamp(v, timezone.utc).isoformat() for v in arr]
+	return ['null' if np.isnan(v) else str(int(v)) if v == int(v) else str(v) for v in arr]
+
+def _filter_mask(flt: dict, column: BaseColumn, arr: np.ndarray):
+	''' None for filters which the client would ignore '''
+	is_null = np.equal(arr, None) if arr.dtype == object else np.isnan(arr)
+	op, value = flt['operation'], flt['value']
+	if op == 'is null':
+		return is_null
+	if op == 'not null':
+		return ~is_null
+	if op == 'regexp':
+		try:
+			regexp = re.compile(value)
+		except re.error as e:
+			raise ValueError(f'Bad regexp in filter on {column.name}: {value}') from e
+		return np.array([regexp.search(v) is not None for v in _as_text(arr, column)], bool)
+	if op not in FILTER_OPS:
+		raise ValueError(f'Unknown filter operation: {op}')
+	if not value:
+		return None
+	val = _parse_filter_value(value, column)
+	if arr.dtype == object:
+		values = np.where(is_null, '', arr)
+		if op in ['>=', '<=']:
+			cmp = np.array([v >= val if op == '>=' else v <= val for v in values], bool)
+		else:
+			cmp = (values == val) if op == '==' else (values != val)
+	else:
+		with np.errstate(invalid='ignore'):
+			cmp = { '>=': arr >= val, '<=': arr <= val, '==': arr == val, '<>': arr != val }[op]
+	return cmp & ~is_null
+
+def _to_bitmap(ids: np.ndarray):
+	bits = np.zeros(int(ids.max()) + 1 if len(ids) else 0, bool)
+	bits[ids] = True
+	return np.packbits(bits, bitorder='little')
+
+def _from_bitmap(bitmap: np.ndarray, ids: np.ndarray):
+	bits = np.unpackbits(bitmap, bitorder='little').astype(bool)
+	inside = ids < len(bits)
+	res = np.zeros(len(ids), bool)
+	res[inside] = bits[ids[inside]]
+	return res
+
+def _evaluate(sample: Sample, visible: dict[int, Sample], columns: dict[str, BaseColumn], stack: tuple[int, ...]):
+	''' cache key and bitmap of the sample, includes are evaluated (and cached) first '''
+	if sample.id in stack:
+		raise ValueError(f'Sample includes itself: {sample.name}')
+	included = [_evaluate(visible[i], visible, columns, stack + (sample.id,)) for i in sample.includes or [] if i in visible]
+	filters = [f for f in sample.filters or [] if f['column'] in columns]
+	used = [columns['id'], *[columns[f['column']] for f in filters]]
+	version = feid_store.current_version(used) # before select, so that the key is never newer than the data
+	key = (sample.id, sample.modified_at.timestamp(), version, tuple(c.sql_name for c in used), tuple(k for k, _ in included))
+
+	def compute():
+		ids, *values = feid_store.select(used)
+		ids = ids.astype(np.int64)
+		if sample.includes:
+			base = np.zeros(len(ids), bool)
+			for _, bitmap in included:
+				base |= _from_bitmap(bitmap, ids)
+		else:
+			base = np.ones(len(ids), bool)
+		if sample.filters:
+			passed = np.ones(len(ids), bool)
+			for flt, arr in zip(filters, values):
+				mask = _filter_mask(flt, columns[flt['column']], arr)
+				if mask is not None:
+					passed &= mask
+		else:
+			passed = np.full(len(ids), not sample.whitelist)
+		passed |= np.isin(ids, sample.whitelist)
+		passed &= ~np.isin(ids, sample.blacklist)
+		return _to_bitmap(ids[base & passed])
+
+	return key, bitmaps.get(key, compute)
+
+def evaluate(uid, sid: int):
+	''' (version, bitmap of event ids) of a sample as seen by the user '''
+	visible = { s.id: s for s in select(uid) }
+	if sid not in visible:
+		raise ValueError('Not found or not authorized')
+	columns = { c.sql_name: c for c in [*ALL_TABLES[E_FEID], *select_computed_columns(uid)] }
+	key, bitmap = _evaluate(visible[sid], visible, columns, ())
+	return f'{zlib.crc32(repr(key).encode()):x}', bitmap
+
+def event_ids(uid, sid: int):
+	_, bitmap = evaluate(uid, sid)
+	return np.flatnonzero(np.unpackbits(bitmap, bitorder='little'))
+
+def event_times(uid, sid: int):
+	time_col = next(c for c in ALL_TABLES[E_FEID] if c.sql_name == 'time')
+	times, = feid_store.select([time_col], event_ids(uid, sid).tolist())
+	return times[~np.isnan(times)].astype(np.int64).tolist()
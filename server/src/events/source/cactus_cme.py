@@ -1,9 +1,9 @@
 from datetime import datetime, timezone
 
-import requests
 
-from database import pool, log, create_table, upsert_coverage, upsert_many
+from database import pool, log, create_table, upsert_coverage, upsert_many, IS_WORKER
 from events.columns.column import Column as Col
+import http_client
 
 TABLE = 'cactus_cmes'
 LZ_URL = 'https://www.sidc.be/cactus/catalog/LASCO/2_5_0/cme_lz.txt'
@@ -23,11 +23,12 @@ COLS = [ # ORDERED !!!
 
 def _init():
 	create_table(TABLE, COLS, constraint='UNIQUE NULLS NOT DISTINCT(time, cactus_id)')
-_init()
+if not IS_WORKER:
+	_init()
 
 def scrape_cactus(which: str, cutoff: datetime|None=None):
 	log.debug(f'Loading CACTUS {which} CMEs')
-	res = requests.get(LZ_URL if which == 'lz' else QKL_URL, timeout=10)
+	res = http_client.get(LZ_URL if which == 'lz' else QKL_URL, ttl=http_client.HOUR, timeout=10)
 
 	if res.status_code != 200:
 		log.error('CACTUS CME failed: HTTP %s', res.status_code)
@@ -1,14 +1,19 @@
 
 from datetime import datetime, timezone
-import re, requests
+import re
 from database import log
 from concurrent.futures import ThreadPoolExecutor
 
 from events.columns.column import Column as Col
 from events.source.donki import parse_coords
+from utility import ComputeCache
+import http_client
 
-cache = {}
 DAY = 86400
+RECENT_TTL = 600
+SCRAPE_WORKERS = 4
+cache = ComputeCache(max_size=4096, store=http_client.CACHE_PATH + '/chimera.sqlite',
+	ttl=lambda d_start, _: http_client.day_ttl(datetime.fromtimestamp(d_start, timezone.utc), RECENT_TTL))
 URL = 'https://solarmonitor.org/'
 img_re = re.compile(r'href="saia_chimr_ch_(\d{8}_\d{6})\.png"')
 
@@ -37,7 +42,7 @@ COLS = [
 
 def scrape_chimera_images(dt):
 	url = f'{URL}data/{dt.year}/{dt.month:02}/{dt.day:02}/pngs/saia/'
-	res = requests.get(url, timeout=10)
+	res = http_client.get(url, ttl=http_client.day_ttl(dt, RECENT_TTL), timeout=10)
 	if res.status_code == 404:
 		return []
 	if res.status_code != 200:
@@ -58,7 +63,7 @@ def soft_float(s):
 
 def scrape_chimera_holes(dt):
 	url = f'{URL}data/{dt.year}/{dt.month:02}/{dt.day:02}/meta/arm_ch_summary_{dt.year}{dt.month:02}{dt.day:02}.txt'
-	res = requests.get(url, timeout=10)
+	res = http_client.get(url, ttl=http_client.day_ttl(dt, RECENT_TTL), timeout=10)
 	if res.status_code == 404:
 		return []
 	if res.status_code != 200:
@@ -76,22 +81,21 @@ def scrape_chimera_holes(dt):
 		result.append(row)
 	return result
 
-def _get_day(d_start):
-	if d_start not in cache:
-		dt = datetime.utcfromtimestamp(d_start)
-		log.debug('Scraping CHIMERA holes for %s', dt)
-		imgs = scrape_chimera_images(dt)
-		holes = scrape_chimera_holes(dt)
-		cache[d_start] = (imgs, holes)
-	else:
-		imgs, holes = cache[d_start]
+def _scrape_day(d_start):
+	dt = datetime.utcfromtimestamp(d_start)
+	log.debug('Scraping CHIMERA holes for %s', dt)
+	imgs = scrape_chimera_images(dt)
+	holes = scrape_chimera_holes(dt)
 	return imgs, holes
 
+def _get_day(d_start):
+	return cache.get(d_start, lambda: _scrape_day(d_start))
+
 def fetch_list(t_from, t_to):
 	t_from = t_from // DAY * DAY
 	holes_lists = {}
 	images = []
-	with ThreadPoolExecutor() as executor:
+	with ThreadPoolExecutor(max_workers=SCRAPE_WORKERS) as executor:
 		res = executor.map(_get_day, range(t_from, t_to, DAY))
 	for imgs, holes in res:
 		if len(imgs) > 0:
@@ -1,10 +1,11 @@
 from datetime import datetime, timezone, timedelta
 
-import re, os, requests
+import re, os
 from typing import Literal
 
-from database import create_table, pool, log, upsert_coverage, upsert_many
+from database import create_table, pool, log, upsert_coverage, upsert_many, IS_WORKER
 from events.columns.column import Column as Col
+import http_client
 
 proxy = os.environ.get('NASA_PROXY')
 proxies = {
@@ -51,7 +52,8 @@ FLR_COLS = [
 def _init():
 	create_table(CME_TABLE, CME_COLS)
 	create_table(FLR_TABLE, FLR_COLS)
-_init()
+if not IS_WORKER:
+	_init()
 
 coords_re = re.compile(r'(N|S)(\d{1,2})(W|E)(\d{1,3})')
 coords_re_reversed = re.compile(r'(W|E)(\d{1,3})(N|S)(\d{1,2})')
@@ -84,7 +86,7 @@ def _obtain_month(what: Literal['CME', 'FLR'], month_start: datetime):
 
 	url = f'{URL}WS/get/{what}?startDate={s_str}&endDate={e_str}'
 	log.debug('Loading DONKI %ss for %s', what, s_str)
-	res = requests.get(url, timeout=10, proxies=proxies)
+	res = http_client.get(url, ttl=http_client.month_ttl(month_start), timeout=10, proxies=proxies)
 
 	if res.status_code != 200:
 		log.error('Failed loading %s: HTTP %s', url, res.status_code)
@@ -131,6 +133,9 @@ def _obtain_month(what: Literal['CME', 'FLR'], month_start: datetime):
 	upsert_many(table, [c.sql_name for c in cols], data, conflict_constraint='id')
 	upsert_coverage(table, month_start)
 
+def fetch_month(entity, month):
+	_obtain_month('CME' if entity == 'cmes' else 'FLR', month)
+
 def fetch(progr, entity, month):
 	prev_month = (month - timedelta(days=1)).replace(day=1)
 
@@ -147,7 +152,7 @@ def resolve_enlil(eid: int):
 		return res[0]
 	log.debug('Resolving WSA-ENLIL #%s', eid)
 	url = URL + f'view/WSA-ENLIL/{eid}/-1'
-	res = requests.get(url, timeout=10, proxies=proxies)
+	res = http_client.get(url, ttl=http_client.DAY, timeout=10, proxies=proxies)
 
 	if res.status_code != 200:
 		log.error('Failed loading %s: HTTP %s', url, res.status_code)
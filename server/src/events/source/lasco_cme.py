@@ -1,15 +1,18 @@
 from datetime import datetime, timezone, timedelta
 from concurrent.futures import ThreadPoolExecutor
 
-import requests
 from bs4 import BeautifulSoup
 
-from database import create_table, pool, log, upsert_many, get_coverage, upsert_coverage
+from database import create_table, pool, log, upsert_many, get_coverage, upsert_coverage, IS_WORKER
 from events.columns.column import Column as Col
 from events.source.donki import parse_coords
+import http_client
 
 TABLE = 'lasco_cmes'
 TABLE_HT = 'lasco_cmes_ht'
+TABLE_HT_MISSING = 'lasco_cmes_ht_missing'
+MISSING_SETTLED = '90 days'
+MISSING_RETRY = '7 days'
 HALO_ENT = 'lasco_cmes_halo'
 URL = 'https://cdaw.gsfc.nasa.gov/CME_list/UNIVERSAL_ver2/'
 HALO_URL = 'https://cdaw.gsfc.nasa.gov/CME_list/halo/halo.html'
@@ -46,11 +49,15 @@ def _init():
 
 	with pool.connection() as conn:
 		conn.execute(query)
-_init()
+		conn.execute(f'CREATE TABLE IF NOT EXISTS events.{TABLE_HT_MISSING} (\n' +\
+			'cme_time timestamptz, cme_mpa real, checked_at timestamptz, PRIMARY KEY (cme_time, cme_mpa))')
+		conn.execute(f'CREATE INDEX IF NOT EXISTS {TABLE_HT}_cme_idx ON events.{TABLE_HT} (cme_time, cme_mpa)')
+if not IS_WORKER:
+	_init()
 
 def scrape_halo():
 	log.debug('Loading LASCO HALO CMEs')
-	res = requests.get(HALO_URL, timeout=10)
+	res = http_client.get(HALO_URL, ttl=http_client.HOUR, timeout=10)
 
 	if res.status_code != 200:
 		log.error('LASCO CME failed: HTTP %s', res.status_code)
@@ -82,7 +89,7 @@ def scrape_halo():
 def scrape_month(month: datetime):
 	mon = f'{month.year}_{month.month:02}'
 	log.debug('Loading LASCO CMEs for %s', mon)
-	res = requests.get(f'{URL}{mon}/univ{mon}.html', timeout=10)
+	res = http_client.get(f'{URL}{mon}/univ{mon}.html', ttl=http_client.month_ttl(month), timeout=10)
 
 	if res.status_code == 404:
 		log.debug('LASCO CME page not found: %s', mon)
@@ -120,24 +127,18 @@ def fetch(progr, month):
 	progr[0] = 1
 	scrape_month(prev_month)
 
-def fetch_height_time(time: datetime, width: int, spd: int, mpa: int, retry_with_s=False):
-	with pool.connection() as conn:
-		ht = conn.execute(f'SELECT EXTRACT(EPOCH FROM time)::integer, height FROM events.{TABLE_HT} '+\
-			'WHERE cme_time = %s AND cme_mpa = %s ORDER BY time', [time, mpa]).fetchall()
-	if len(ht) > 0:
-		return ht
+def _fetch_height_time(time: datetime, width: int, spd: int, mpa: int):
+	''' height-time rows of the CME or None if there is no such file '''
 	y, m, d = time.year, time.month, time.day
 	hh, mm, ss = time.hour, time.minute, time.second
 	letter = 'h' if width >= 360 else 'p' if width > 120 else 'n'
-	other_letter = 's' if retry_with_s else 'g'
-	url = f'{URL}{y}_{m:02}/yht/{y}{m:02}{d:02}.{hh:02}{mm:02}{ss:02}.w{width:03}{letter}.v{spd:04}.p{mpa:03}{other_letter}.yht'
 	log.debug('Obtaining LASCO CME height-time for %s %s/%s', time, spd, mpa)
-	try:
-		res = requests.get(url, timeout=5)
+	for other_letter in ['g', 's']:
+		url = f'{URL}{y}_{m:02}/yht/{y}{m:02}{d:02}.{hh:02}{mm:02}{ss:02}.w{width:03}{letter}.v{spd:04}.p{mpa:03}{other_letter}.yht'
+		res = http_client.get(url, ttl=http_client.IMMUTABLE, timeout=5)
+		if res.status_code == 404:
+			continue
 		if res.status_code != 200:
-			if not retry_with_s and res.status_code == 404:
-				log.debug('Retrying with s')
-				return fetch_height_time(time, width, spd, mpa, retry_with_s=True)
 			raise Exception('HTTP: '+str(res.status_code))
 		result = []
 		for line in res.text.splitlines():
@@ -146,25 +147,55 @@ def fetch_height_time(time: datetime, width: int, spd: int, mpa: int, retry_with
 			h, dt, tm = line.strip().split()[:3]
 			tstmp = datetime.strptime(dt+tm, '%Y/%m/%d%H:%M:%S').replace(tzinfo=timezone.utc)
 			result.append((tstmp, float(h)))
-		
-		upsert_many(TABLE_HT, ['time', 'height'], result, constants={ 'cme_time': time, 'cme_mpa': mpa }, do_nothing=True)
-		return [(t.timestamp(), h) for t, h in result]
+		return result
+	return None
+
+def _fetch_missing(cme):
+	try:
+		return cme, _fetch_height_time(*cme)
 	except Exception as e:
 		log.error('Failed to obtain LASCO CME HT: %s', str(e))
-		return []
+		return cme, []
 
 def plot_height_time(t_from, t_to):
 	with pool.connection() as conn:
 		curs = conn.execute('SELECT time, angular_width, speed, measurement_angle '+\
 			f' FROM events.{TABLE} WHERE speed IS NOT NULL AND angular_width IS NOT NULL AND '+\
-			'to_timestamp(%s) <= time AND time <= to_timestamp(%s)', [t_from, t_to])
+			'to_timestamp(%s) <= time AND time <= to_timestamp(%s) ORDER BY time', [t_from, t_to])
 		cmes = [(time, int(width), int(spd), int(mpa)) for time, width, spd, mpa in curs.fetchall()]
-	with ThreadPoolExecutor(max_workers=8) as executor:
-		hts = executor.map(fetch_height_time, *zip(*cmes))
+		cached = conn.execute('SELECT cme_time, cme_mpa::integer, EXTRACT(EPOCH FROM time)::integer, height '+\
+			f'FROM events.{TABLE_HT} WHERE to_timestamp(%s) <= cme_time AND cme_time <= to_timestamp(%s) '+\
+			'ORDER BY cme_time, cme_mpa, time', [t_from, t_to]).fetchall()
+		# files of recent CMEs may still appear, so misses checked soon after the CME are retried
+		missing = conn.execute(f'SELECT cme_time, cme_mpa::integer FROM events.{TABLE_HT_MISSING} '+\
+			'WHERE to_timestamp(%s) <= cme_time AND cme_time <= to_timestamp(%s) AND '+\
+			f'(checked_at > cme_time + interval \'{MISSING_SETTLED}\' OR checked_at > now() - interval \'{MISSING_RETRY}\')',
+			[t_from, t_to]).fetchall()
+
+	hts: dict[tuple[datetime, int], list] = {}
+	for cme_time, cme_mpa, time, height in cached:
+		hts.setdefault((cme_time, cme_mpa), []).append((time, height))
+	known_missing = set(missing)
+	to_fetch = [c for c in cmes if (c[0], c[3]) not in hts and (c[0], c[3]) not in known_missing]
+
+	if to_fetch:
+		log.debug('LASCO CME height-time: [%s] cached, fetching [%s]', len(cmes) - len(to_fetch), len(to_fetch))
+		with ThreadPoolExecutor(max_workers=8) as executor:
+			fetched = list(executor.map(_fetch_missing, to_fetch))
+		rows = [(time, mpa, t, h) for (time, _, _, mpa), res in fetched for t, h in res or []]
+		if rows:
+			upsert_many(TABLE_HT, ['cme_time', 'cme_mpa', 'time', 'height'], rows, do_nothing=True)
+		not_found = [(time, mpa) for (time, _, _, mpa), res in fetched if res is None]
+		if not_found:
+			upsert_many(TABLE_HT_MISSING, ['cme_time', 'cme_mpa'], not_found,
+				conflict_constraint='cme_time, cme_mpa', constants={ 'checked_at': datetime.now(timezone.utc) })
+		for (time, _, _, mpa), res in fetched:
+			hts[(time, mpa)] = [(t.timestamp(), h) for t, h in res or []]
+
 	return [{
 		'time': time.timestamp(),
 		'width': width,
 		'speed': spd,
 		'mpa': mpa,
-		'ht': ht
-	} for (time, width, spd, mpa), ht in zip(cmes, hts)]
\ No newline at end of file
+		'ht': hts.get((time, mpa), [])
+	} for time, width, spd, mpa in cmes]
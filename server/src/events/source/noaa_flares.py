@@ -1,4 +1,4 @@
-from database import create_table
+from database import create_table, IS_WORKER
 from events.columns.column import Column as Col
 
 TABLE = 'legacy_noaa_flares'
@@ -22,4 +22,5 @@ COLS =[
 
 def _init():
 	create_table(TABLE, COLS)
-_init()
+if not IS_WORKER:
+	_init()
@@ -1,10 +1,11 @@
 from datetime import datetime, timezone
 
-import re, requests
+import re
 from bs4 import BeautifulSoup
 
-from database import log, create_table, upsert_many, upsert_coverage
+from database import log, create_table, upsert_many, upsert_coverage, IS_WORKER
 from events.columns.column import Column as Col
+import http_client
 
 TABLE = 'r_c_icmes'
 URL = 'https://izw1.caltech.edu/ACE/ASC/DATA/level3/icmetable2.htm'
@@ -36,13 +37,14 @@ COLS = [
 
 def _init():
 	create_table(TABLE, COLS)
-_init()
+if not IS_WORKER:
+	_init()
 
 def parse_date(s):
 	return datetime.strptime(s[:15], '%Y/%m/%d %H%M').replace(tzinfo=timezone.utc)
 
 def fetch():
-	res = requests.get(URL, timeout=10)
+	res = http_client.get(URL, ttl=http_client.HOUR, timeout=10)
 
 	if res.status_code != 200:
 		log.error('Failed loading R&C catalogue: HTTP %s', res.status_code)
@@ -1,12 +1,13 @@
 from datetime import datetime, timezone, timedelta
 
-import requests
 from bs4 import BeautifulSoup
 
-from database import create_table, pool, log, upsert_coverage, get_coverage, upsert_many
+from database import create_table, pool, log, upsert_coverage, get_coverage, upsert_many, IS_WORKER
 from events.columns.column import Column as Col
+import http_client
 
 URL = 'https://www.sidc.be/solardemon/science/'
+MAX_DAYS = 999 # the catalog is only served for a number of days before now
 
 FLR_TABLE = T1 = 'solardemon_flares'
 DIM_TABLE = T2 = 'solardemon_dimmings'
@@ -44,13 +45,14 @@ DIM_COLS = [
 def _init():
 	create_table(FLR_TABLE, FLR_COLS)
 	create_table(DIM_TABLE, DIM_COLS)
-_init()
+if not IS_WORKER:
+	_init()
 
 def scrape_solardemon(what, days):
 	log.debug('Scraping solardemon %s for %s days', what, days)
 
 	url = f'{URL}{what}.php?days={days}&science=1&dimming_threshold=-100000&min_flux_est=0.000001'
-	res = requests.get(url, timeout=10)
+	res = http_client.get(url, ttl=http_client.HOUR, timeout=10)
 
 	if res.status_code != 200:
 		log.error('Failed loading %s: HTTP %s', url, res.status_code)
@@ -114,5 +116,5 @@ def scrape_solardemon(what, days):
 
 def fetch(entity, month):
 	now = datetime.now(timezone.utc)
-	days = max(min(int((now - month).total_seconds() / 86400) + 33, 999), 10)
+	days = max(min(int((now - month).total_seconds() / 86400) + 33, MAX_DAYS), 10)
 	scrape_solardemon(entity, days)
@@ -1,13 +1,16 @@
 
 from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
-import os, re, requests
+import re
 
-from database import log, create_table, upsert_coverage, upsert_many
+from database import log, create_table, upsert_coverage, upsert_many, IS_WORKER
 from events.columns.column import Column as Col
 from events.source.donki import parse_coords
+import http_client
 
 URL = 'https://www.lmsal.com/solarsoft/'
+PAGE_WORKERS = 4
 
 TABLE = 'solarsoft_flares'
 COLS = [
@@ -22,33 +25,30 @@ COLS = [
 
 def _init():
 	create_table(TABLE, COLS)
-_init()
-
-last_fetched = None
+if not IS_WORKER:
+	_init()
 
 def parse_time(txt):
 	return datetime.strptime(txt, '%Y/%m/%d %H:%M').replace(tzinfo=timezone.utc)
 
 def fetch_archive_page():
-	global last_fetched
-	fname = 'tmp/solarsoft_archive.html'
-	now = datetime.now(timezone.utc)
-	if os.path.exists(fname) and last_fetched \
-			and last_fetched - now < timedelta(hours=3):
-		with open(fname, encoding='utf-8') as f:
-			return f.read()
-	
 	url = URL + 'latest_events_archive.html'
-	res = requests.get(url, timeout=20)
+	res = http_client.get(url, ttl=3 * http_client.HOUR, timeout=20)
 
 	if res.status_code != 200:
 		log.error('Failed loading %s: HTTP %s', url, res.status_code)
 		raise Exception('Request failed')
+	return res.text
 
-	with open(fname, 'w', encoding='utf-8') as f:
-		f.write(res.text)
-	log.debug('Downloaded solarsoft archive page')
-	last_fetched = now
+def _load_page(link_first):
+	link, first = link_first
+	log.debug('Loading solarsoft last_events > %s', first)
+	url = URL + link
+	res = http_client.get(url, ttl=http_client.IMMUTABLE, timeout=10) # archived snapshots
+
+	if res.status_code != 200:
+		log.error('Failed loading %s: HTTP %s', url, res.status_code)
+		raise Exception('Request failed')
 	return res.text
 
 def _scrape_flares(progr, dt_start, dt_end):
@@ -71,16 +71,11 @@ def _scrape_flares(progr, dt_start, dt_end):
 			break
 		links.append((link, first))
 
-	for link, first in links:
-		log.debug('Loading solarsoft last_events > %s', first)
-		url = URL + link
-		res = requests.get(url, timeout=10)
+	with ThreadPoolExecutor(max_workers=PAGE_WORKERS) as executor:
+		pages = list(executor.map(_load_page, links))
 
-		if res.status_code != 200:
-			log.error('Failed loading %s: HTTP %s', url, res.status_code)
-			raise Exception('Request failed')
-
-		chunk = res.text.split('<table')[-1]
+	for text in pages: # in archive order, first seen flare wins
+		chunk = text.split('<table')[-1]
 		for tr in chunk.split('<tr')[2:]:
 			strt, stop, peak, cl, pos = [td.split('</td>')[0] for td in tr.split('<td>')[3:]]
 
@@ -107,6 +102,9 @@ def _scrape_flares(progr, dt_start, dt_end):
 	upsert_many(TABLE, [c.sql_name for c in COLS], list(data.values()), conflict_constraint='start_time')
 	upsert_coverage(TABLE, dt_start)
 
+def fetch_month(month):
+	_scrape_flares([0, 100], month, (month + timedelta(days=31)).replace(day=1))
+
 def fetch(progr, entity, month):
 	next_month = (month + timedelta(days=31)).replace(day=1)
 	prev_month = (month - timedelta(days=1)).replace(day=1)
@@ -1,10 +1,11 @@
 from datetime import datetime, timezone, timedelta
 
-import re, requests
+import re
 from bs4 import BeautifulSoup
 
-from database import create_table, pool, log, upsert_many, upsert_coverage
+from database import create_table, pool, log, upsert_many, upsert_coverage, IS_WORKER
 from events.columns.column import Column as Col
+import http_client
 
 CH_URL = 'https://solen.info/solar/coronal_holes.html'
 
@@ -32,7 +33,8 @@ date_re = re.compile(r'([12]\d{3})\.(\d\d)\.(\d\d)')
 
 def _init():
 	create_table(TABLE, COLS)
-_init()
+if not IS_WORKER:
+	_init()
 
 def parse_date_interv(s):
 	dates = date_re.findall(s)
@@ -44,7 +46,7 @@ def parse_date_interv(s):
 	return (dates[1] - dates[0]) / 2 + dates[0] + timedelta(hours=12)
 
 def fetch():
-	res = requests.get(CH_URL, timeout=10)
+	res = http_client.get(CH_URL, ttl=http_client.HOUR, timeout=10)
 
 	log.debug('Fetching solen CHs')
 	if res.status_code != 200:
@@ -1,6 +1,6 @@
 from datetime import datetime
 import numpy as np
-from database import create_table, pool, log
+from database import create_table, pool, log, IS_WORKER
 from events.table_structure import ALL_TABLES, E_FEID, E_FEID_SOURCE, E_SOURCE_CH, E_SOURCE_ERUPT
 from psycopg.sql import SQL, Identifier
 
@@ -28,7 +28,14 @@ def _init():
 
 					not_null = SQL('SET' if column.not_null else 'DROP')
 					conn.execute(SQL('ALTER TABLE events.{} ALTER COLUMN {} {} NOT NULL').format(itable, iname, not_null))
-_init()
+
+		for tbl, columns in ALL_TABLES.items(): # time windowed listing
+			time_col = next((c for c in columns if 'time' in c.sql_name), None)
+			if time_col is not None:
+				conn.execute(SQL('CREATE INDEX IF NOT EXISTS {} ON events.{} ({})').format(
+					Identifier(f'{tbl}_{time_col.sql_name}_idx'), Identifier(tbl), Identifier(time_col.sql_name)))
+if not IS_WORKER:
+	_init()
 
 def import_fds(uid, import_columns, rows_to_add, ids_to_remove, precomputed_changes):
 	raise NotImplementedError('FIXME: import fds be broke')
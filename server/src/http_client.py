@@ -0,0 +1,159 @@
+import os, json, hashlib, tempfile
+from datetime import datetime, timezone, timedelta
+from threading import Lock, Semaphore
+from time import time, sleep
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from database import log
+
+# Scrapers go through here: one pooled session per host, per host rate limit,
+# disk cache addressed by sha256 of url (metadata) and of content (bodies), revalidated with ETag / Last-Modified
+
+CACHE_PATH = os.path.join(os.path.dirname(__file__), '../tmp/http_cache')
+HOUR = 3600
+DAY = 24 * HOUR
+IMMUTABLE = float('inf')
+SETTLED_AFTER = timedelta(days=62) # catalogs still amend recent months
+DEFAULT_INTERVAL = .2 # seconds between requests to one host
+HOST_CONCURRENCY = 4
+HOST_INTERVALS = {
+	'kauai.ccmc.gsfc.nasa.gov': 1.,
+	'cdaw.gsfc.nasa.gov': .5,
+	'iki.rssi.ru': 1.,
+}
+
+lock = Lock()
+sessions: dict[str, requests.Session] = {}
+host_locks: dict[str, Lock] = {}
+host_slots: dict[str, Semaphore] = {}
+next_request: dict[str, float] = {}
+
+def settled_ttl(period_end: datetime, ttl: float = HOUR, settled_after: timedelta = SETTLED_AFTER):
+	''' pages about periods which ended long ago never change '''
+	period_end = period_end if period_end.tzinfo else period_end.replace(tzinfo=timezone.utc)
+	return IMMUTABLE if datetime.now(timezone.utc) - period_end > settled_after else ttl
+
+def month_ttl(month: datetime, ttl: float = HOUR):
+	return settled_ttl((month.replace(day=1) + timedelta(days=32)).replace(day=1), ttl)
+
+def day_ttl(day: datetime, ttl: float = HOUR):
+	return settled_ttl(day + timedelta(days=1), ttl, timedelta(days=3))
+
+def _session(host: str):
+	with lock:
+		if host not in sessions:
+			sess = requests.Session()
+			adapter = HTTPAdapter(pool_connections=1, pool_maxsize=8)
+			sess.mount('http://', adapter)
+			sess.mount('https://', adapter)
+			sessions[host] = sess
+		return sessions[host]
+
+def _throttle(host: str):
+	with lock:
+		host_lock = host_locks.setdefault(host, Lock())
+	with host_lock:
+		wait = next_request.get(host, 0) - time()
+		if wait > 0:
+			sleep(wait)
+		next_request[host] = time() + HOST_INTERVALS.get(host, DEFAULT_INTERVAL)
+
+def _path(kind: str, digest: str):
+	return os.path.join(CACHE_PATH, kind, digest[:2], digest)
+
+def _write(path: str, data: bytes):
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+	with os.fdopen(fd, 'wb') as file:
+		file.write(data)
+	os.replace(tmp, path)
+
+def _read_meta(key: str):
+	try:
+		with open(_path('meta', key), encoding='utf-8') as file:
+			return json.load(file)
+	except (OSError, ValueError):
+		return None
+
+def _read_body(meta: dict):
+	try:
+		with open(_path('body', meta['body']), 'rb') as file:
+			return file.read()
+	except OSError:
+		return None
+
+def _store(key: str, res: requests.Response, previous: dict | None):
+	body = res.content
+	digest = hashlib.sha256(body).hexdigest()
+	if not os.path.exists(_path('body', digest)):
+		_write(_path('body', digest), body)
+	meta = {
+		'url': res.url,
+		'fetched': time(),
+		'body': digest,
+		'encoding': res.encoding,
+		'etag': res.headers.get('ETag'),
+		'modified': res.headers.get('Last-Modified'),
+		'type': res.headers.get('Content-Type'),
+	}
+	_write(_path('meta', key), json.dumps(meta).encode())
+	# NOTE: the old body may be shared with another url, which then just gets fetched again
+	if previous and previous['body'] != digest:
+		try:
+			os.remove(_path('body', previous['body']))
+		except OSError:
+			pass
+
+def _response(url: str, meta: dict, body: bytes):
+	res = requests.Response()
+	res.status_code = 200
+	res.reason = 'OK'
+	res.url = url
+	res.encoding = meta['encoding']
+	res.headers = CaseInsensitiveDict({ 'Content-Type': meta['type'] } if meta['type'] else {})
+	res._content = body # pylint: disable=protected-access
+	res._content_consumed = True # pylint: disable=protected-access
+	return res
+
+def get(url: str, params: dict | None = None, ttl: float = 0, cache=True, timeout: float = 10, **kwargs):
+	''' GET which serves cached 200 responses younger than ttl seconds and revalidates older ones '''
+	host = urlsplit(url).netloc
+	full_url = requests.Request('GET', url, params=params).prepare().url or url
+	key = hashlib.sha256(full_url.encode()).hexdigest()
+	meta = _read_meta(key) if cache else None
+
+	if meta and time() - meta['fetched'] < ttl:
+		body = _read_body(meta)
+		if body is not None:
+			return _response(full_url, meta, body)
+
+	extra_headers = kwargs.pop('headers', None) or {}
+	headers = dict(extra_headers)
+	if meta and meta['etag']:
+		headers['If-None-Match'] = meta['etag']
+	if meta and meta['modified']:
+		headers['If-Modified-Since'] = meta['modified']
+
+	with lock:
+		slots = host_slots.setdefault(host, Semaphore(HOST_CONCURRENCY))
+	with slots:
+		_throttle(host)
+		res = _session(host).get(url, params=params, timeout=timeout, headers=headers, **kwargs)
+
+	if res.status_code == 304 and meta:
+		body = _read_body(meta)
+		if body is not None:
+			log.debug('HTTP not modified: %s', full_url)
+			meta['fetched'] = time()
+			_write(_path('meta', key), json.dumps(meta).encode())
+			return _response(full_url, meta, body)
+		os.remove(_path('meta', key))
+		return get(url, params, ttl, cache, timeout, headers=extra_headers, **kwargs)
+
+	if cache and res.status_code == 200:
+		_store(key, res, meta or _read_meta(key))
+	return res
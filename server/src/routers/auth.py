@@ -1,7 +1,7 @@
 import os
 from flask import Blueprint, request, session
 from routers.utils import route_shielded, require_role, get_role, msg, ROLES
-from database import pool, log
+from database import pool, log, IS_WORKER
 from server import bcrypt
 
 bp = Blueprint('auth', __name__, url_prefix='/api/auth')
@@ -24,7 +24,8 @@ def init():
 				os._exit(1)
 			pwd = bcrypt.generate_password_hash(password, rounds=10).decode()
 			conn.execute('INSERT INTO users(login, password, role) VALUES (%s, %s, %s)', ['admin', pwd, 'admin'])
-init()
+if not IS_WORKER:
+	init()
 
 @bp.route('/upsert', methods=['POST'])
 @require_role('admin')
@@ -1,17 +1,20 @@
-import json
+import json, base64
 from time import time
 from datetime import datetime, timezone
 
 import numpy as np
 from flask import Blueprint, request, session
-from events.misc.plots import epoch_collision, custom_plot
+from events.misc.plots import epoch_collision, epoch_collision_batch, custom_plot
 from events.table_init import import_fds
 import events.columns.query as comp_columns
+from events.columns.budget import cancel as cancel_computations
 from events.source import donki, lasco_cme, cactus_cme, r_c_icme, solardemon, solarsoft, solen_info, chimera
 import events.misc.text_transforms as tts
 from events import samples
 from events import query
-from routers.utils import route_shielded, require_role, msg
+from events.autolink import autolink
+from events.backfill import backfill
+from routers.utils import route_shielded, require_role, msg, get_role
 from data import sun_images
 from data.swpc import swpc
 
@@ -51,6 +54,27 @@ def _epoch_collision():
 	offset, median, mean, std = [np.where(np.isnan(v), None, np.round(v, 3)).tolist() for v in res] # type: ignore
 	return { 'offset': offset, 'median': median, 'mean': mean, 'std': std }
 
+@bp.route('/epoch_collision/batch', methods=['POST'])
+@route_shielded
+def _epoch_collision_batch():
+	interval = request.json.get('interval')
+	epochs = request.json.get('samples') # lists of epoch times or sample ids
+	series = request.json.get('series')
+	if not epochs or not interval or not series:
+		raise ValueError('malformed request')
+	if interval[1] - interval[0] <= 0 or int(interval[1]) - int(interval[0]) > 1200:
+		raise ValueError('interval too large')
+	if len(epochs) * len(series) > 256:
+		raise ValueError('too many combinations')
+
+	uid = session.get('uid')
+	epochs = [samples.event_times(uid, int(s)) if isinstance(s, (int, str)) else s for s in epochs]
+	offset, results = epoch_collision_batch(epochs, interval, series)
+	to_list = lambda v: np.where(np.isnan(v), None, np.round(v, 3)).tolist() # type: ignore
+	return { 'offset': offset.tolist(), 'series': series, 'results': [
+		[{ 'median': to_list(median), 'mean': to_list(mean), 'std': to_list(std) } for median, mean, std in stats]
+			for stats in results] }
+
 @bp.route('/coverage', methods=['GET'])
 @route_shielded
 def _coverage():
@@ -87,6 +111,27 @@ def _get_fetch_source():
 	timestamp = request.json.get('timestamp')
 	return op_cache.fetch(_fetch_source, (entity, timestamp))
 
+@bp.route('/backfill', methods=['POST'])
+@route_shielded
+@require_role('operator')
+def _backfill():
+	entity = request.json.get('entity')
+	return op_cache.fetch(backfill, (entity,))
+
+@bp.route('/autolink', methods=['POST'])
+@route_shielded
+@require_role('operator')
+@compress.compressed()
+def _autolink():
+	ids = request.json.get('ids')
+	limit = int(request.json.get('limit', 3))
+	if ids is not None and not isinstance(ids, list):
+		raise ValueError('ids should be a list')
+	if not 0 < limit <= 16:
+		raise ValueError('limit should be within 1..16')
+	candidates = autolink(ids and [int(i) for i in ids], limit)
+	return { 'candidates': { str(k): v for k, v in candidates.items() } }
+
 @bp.route('/', methods=['GET'])
 @route_shielded
 @compress.compressed()
@@ -96,11 +141,37 @@ def _list_events():
 	include = request.args.get('include')
 	changelog = request.args.get('changelog', 'false').lower() == 'true'
 	include = include.split(',') if include else None
+	t_from, t_to, limit = [int(request.args[a]) if request.args.get(a) else None for a in ['from', 'to', 'limit']]
+	cursor = request.args.get('cursor')
 
 	if not entity:
 		raise ValueError('Specify entity')
-	
-	return query.select_events(entity, uid, include, changelog)
+
+	if entity != 'feid':
+		return query.select_events(entity, uid, include, changelog, None, t_from, t_to, limit, cursor)
+
+	# NOTE: If-None-Match only yields 304 and never a delta, since browser would take it for the full table
+	etag = request.headers.get('If-None-Match', '').removeprefix('W/').strip('"') or None
+	since = request.args.get('since')
+	res = query.select_events(entity, uid, include, changelog, since or etag)
+	version = res.get('version')
+	if not version:
+		return res
+	if not since and version == etag:
+		return '', 304, { 'ETag': f'"{version}"' }
+	if res['delta'] and not since:
+		res = query.select_events(entity, uid, include, changelog)
+	return res, 200, { 'ETag': f'"{version}"' }
+
+@bp.route('/changelog', methods=['GET'])
+@route_shielded
+def _changelog():
+	entity = request.args.get('entity', 'feid')
+	event_id, before = [int(request.args[a]) if request.args.get(a) else None for a in ['event_id', 'before']]
+	limit = int(request.args.get('limit', 256))
+	if not 0 < limit <= 4096:
+		raise ValueError('limit should be within 1..4096')
+	return query.changelog_page(entity, session.get('uid'), event_id, before, limit)
 
 @bp.route('/table_structure/', methods=['GET'])
 @route_shielded
@@ -189,6 +260,17 @@ def get_samples():
 	uid = session.get('uid')
 	return { 'samples': samples.select(uid) }
 
+@bp.route('/samples/evaluate', methods=['GET'])
+@route_shielded
+def evaluate_sample():
+	uid = session.get('uid')
+	sid = int(request.args.get('id', ''))
+	version, bitmap = samples.evaluate(uid, sid)
+	if request.headers.get('If-None-Match', '').removeprefix('W/').strip('"') == version:
+		return '', 304, { 'ETag': f'"{version}"' }
+	return { 'id': sid, 'version': version, 'count': int(np.unpackbits(bitmap).sum()),
+		'bitmap': base64.b64encode(bitmap.tobytes()).decode() }, 200, { 'ETag': f'"{version}"' }
+
 @bp.route('/samples/create', methods=['POST'])
 @route_shielded
 @require_role('user')
@@ -259,7 +341,7 @@ def remove_tts():
 def _create_column():
 	uid = session.get('uid') or -1
 	start = time()
-	col = comp_columns.upsert_column(uid, request.json, None)
+	col = comp_columns.upsert_column(uid, request.json, None, get_role())
 	return { 'column': col.as_dict(), 'time': round(time() - start, 3) }
 
 @bp.route('/columns/<int:col_id>', methods=['POST'])
@@ -268,9 +350,22 @@ def _create_column():
 def _mod_column(col_id):
 	uid = session.get('uid') or -1
 	start = time()
-	col = comp_columns.upsert_column(uid, request.json, col_id)
+	col = comp_columns.upsert_column(uid, request.json, col_id, get_role())
 	return { 'column': col.as_dict(), 'time': round(time() - start, 3) }
 
+@bp.route('/columns/preview', methods=['POST'])
+@route_shielded
+@require_role('user')
+def _preview_column():
+	uid = session.get('uid') or -1
+	return comp_columns.preview_column(uid, request.json, get_role())
+
+@bp.route('/columns/<int:col_id>/compute', methods=['GET'])
+@route_shielded
+@require_role('user')
+def _column_compute_status(col_id):
+	return comp_columns.background_status(col_id) or { 'status': 'idle' }
+
 @bp.route('/columns/<int:col_id>', methods=['DELETE'])
 @route_shielded
 @require_role('user')
@@ -284,7 +379,15 @@ def _remove_column(col_id):
 @require_role('user')
 def _compute_column(col_name):
 	uid = session.get('uid') or -1
-	return comp_columns.compute_by_name(uid, col_name)
+	return comp_columns.compute_by_name(uid, col_name, get_role())
+
+@bp.route('/compute/cancel', methods=['POST'])
+@route_shielded
+@require_role('user')
+def _cancel_computation():
+	uid = session.get('uid') or -1
+	column = request.json.get('column') if request.json else None
+	return { 'cancelled': cancel_computations(uid, get_role(), column) }
 
 @bp.route('/compute/rows', methods=['POST'])
 @route_shielded
@@ -78,8 +78,13 @@ def obtain():
 def bulk_obtain():
 	group = omni.GROUP(request.json.get('group', '').lower())
 
-	omni.bulk_obtain(group)
-	return msg('OK')
+	return omni.bulk_obtain(group)
+
+@bp.route('/ingest', methods=['GET'])
+@require_role('operator')
+@route_shielded
+def ingest_status():
+	return omni.ingest_status()
 
 @bp.route('/remove', methods=['POST'])
 @require_role('operator')
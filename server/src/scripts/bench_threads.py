@@ -0,0 +1,55 @@
+
+import sys, os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../'))
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from psycopg.sql import SQL, Identifier
+
+from database import _encode_column, _encode_rows, select_columnar, sql_epoch, sql_float
+from events.columns.computed_column import select_computed_columns
+from events.columns.query import _compute
+from data.omni.variables import omni_variables
+
+# Runs computed columns and ingestion encoding on thread pools of growing size.
+# Meant to be run with a free-threaded interpreter (python3.14t, PYTHON_GIL=0) and compared to the default one.
+
+WORKERS = [1, 2, 4, os.cpu_count() or 8]
+REPEAT = int(os.environ.get('BENCH_REPEAT', 4))
+
+def run(label, tasks, workers):
+	t_start = time()
+	with ThreadPoolExecutor(max_workers=workers) as executor:
+		results = list(executor.map(lambda task: task(), tasks))
+	took = time() - t_start
+	print(f'{label:>10} x{workers:<3} {round(took, 3):>8}s')
+	return took, results
+
+def bench_columns():
+	definitions = [col.definition for col in select_computed_columns(select_all=True)]
+	tasks = [lambda d=d: _compute(d) for d in definitions]
+	print(f'computed columns: [{len(tasks)}]')
+	for workers in WORKERS:
+		_, results = run('columns', tasks, workers)
+		errors = [err for _, _, err in results if err]
+		if errors:
+			print(f'  errors: [{len(errors)}] {errors[0]}')
+
+def bench_ingest():
+	names = [v.name for v in omni_variables if v.name != 'SWTY' and not v.name.startswith('sc_id')]
+	query = SQL('SELECT {} FROM omni ORDER BY time').format(SQL(',').join([sql_epoch()] + [sql_float(Identifier(n)) for n in names]))
+	time_col, *columns = select_columnar(query, [], ['i8'] + ['f8'] * len(names))
+	print(f'omni columns: [{len(columns)}] x [{len(time_col)}]')
+	encode = lambda: len(_encode_rows([_encode_column(time_col, 1184), *[_encode_column(c, 700) for c in columns]]))
+	tasks = [encode] * REPEAT
+	for workers in WORKERS:
+		run('ingest', tasks, workers)
+
+if __name__ == '__main__':
+	gil = sys._is_gil_enabled() if hasattr(sys, '_is_gil_enabled') else True
+	print(f'python {sys.version.split()[0]}, GIL {"enabled" if gil else "disabled"}, numpy {np.__version__}')
+	if 'ingest' not in sys.argv[1:]:
+		bench_columns()
+	if 'columns' not in sys.argv[1:]:
+		bench_ingest()
+	os._exit(0) # do not wait for pool connections
@@ -12,8 +12,8 @@ path = 'tmp/out.txt'
 def fetch():
 	data = particles_and_xrays.select_hourly_averaged((int(dt_from), int(dt_to)), 'e2')
 	with open(path, 'w') as f:
-		for tst, val in data:
-			f.write(f'{datetime.fromtimestamp(tst, timezone.utc)} {round(val, 3) if val else -1}\n') 
+		for tst, val in zip(*data):
+			f.write(f'{datetime.fromtimestamp(tst, timezone.utc)} {round(val, 3) if val == val else -1}\n') 
 
 if __name__ == '__main__':
 	fetch()
\ No newline at end of file
@@ -1,8 +1,10 @@
 
-from threading import Thread
+from threading import Thread, Lock
+from collections import OrderedDict
+from contextlib import closing
 from time import time
 
-import traceback
+import os, json, sqlite3, traceback
 from database import log
 
 class Operation:
@@ -43,15 +45,118 @@ class Operation:
 class OperationCache:
 	def __init__(self):
 		self.cache = {}
+		self.lock = Lock()
 
 	def fetch(self, func, args):
-		found = self.cache.get(args)
+		with self.lock:
+			found = self.cache.get(args)
 
-		if not found:
+			if not found:
+				op = Operation(func, args)
+				self.cache[args] = op
+				return op.as_dict()
+
+			if found.status != 'working':
+				del self.cache[args]
+		return found.as_dict()
+
+	def start(self, func, key, *args):
+		''' (re)start operation under given key, status is available through status() until next start '''
+		with self.lock:
 			op = Operation(func, args)
-			self.cache[args] = op
+			self.cache[key] = op
 			return op.as_dict()
 
-		if found.status != 'working':
-			del self.cache[args]
-		return found.as_dict()
+	def status(self, key):
+		with self.lock:
+			found = self.cache.get(key)
+		return found and found.as_dict()
+
+class SharedStatus:
+	''' status dict written by a worker thread and read by request handlers, never exposed by reference '''
+	def __init__(self, **initial):
+		self.lock = Lock()
+		self.state = dict(initial)
+
+	def set(self, **state):
+		with self.lock:
+			self.state = state
+
+	def update(self, **changes):
+		with self.lock:
+			self.state = { **self.state, **changes }
+
+	def get(self, key: str):
+		with self.lock:
+			return self.state.get(key)
+
+	def snapshot(self):
+		with self.lock:
+			return dict(self.state)
+
+class ComputeCache:
+	''' dict cache where every key is computed at most once, even with concurrent callers.
+		Optionally bounded (least recently used keys are dropped), with ttl(key, value) seconds per entry
+		and persisted to a sqlite file, values should be json serializable then '''
+	def __init__(self, max_size: int | None = None, ttl=None, store: str | None = None):
+		self.lock = Lock()
+		self.data: OrderedDict = OrderedDict() # key -> (value, expires)
+		self.pending: dict[object, Lock] = {}
+		self.max_size = max_size
+		self.ttl = ttl
+		self.store = store
+		if store:
+			os.makedirs(os.path.dirname(store), exist_ok=True)
+			with closing(sqlite3.connect(store)) as conn, conn:
+				conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, expires REAL)')
+				conn.execute('DELETE FROM cache WHERE expires < ?', [time()])
+
+	def _lookup(self, key):
+		''' should be called with self.lock held '''
+		found = self.data.get(key)
+		if found is not None and found[1] > time():
+			self.data.move_to_end(key)
+			return found
+		self.data.pop(key, None)
+		return None
+
+	def _load(self, key):
+		if not self.store:
+			return None
+		with closing(sqlite3.connect(self.store)) as conn:
+			row = conn.execute('SELECT value, expires FROM cache WHERE key = ?', [json.dumps(key)]).fetchone()
+		if row is None or row[1] < time():
+			return None
+		return json.loads(row[0]), row[1]
+
+	def _put(self, key, value, expires: float):
+		self.data[key] = (value, expires)
+		self.data.move_to_end(key)
+		while self.max_size is not None and len(self.data) > self.max_size:
+			self.data.popitem(last=False)
+		return value, expires
+
+	def get(self, key, compute):
+		with self.lock:
+			if found := self._lookup(key):
+				return found[0]
+			key_lock = self.pending.setdefault(key, Lock())
+		with key_lock: # disk and compute happen outside of the cache-wide lock
+			with self.lock:
+				if found := self._lookup(key):
+					return found[0]
+			try:
+				if not (found := self._load(key)):
+					value = compute()
+					ttl = self.ttl(key, value) if callable(self.ttl) else self.ttl
+					found = value, time() + ttl if ttl is not None else float('inf')
+					if self.store:
+						with closing(sqlite3.connect(self.store)) as conn, conn:
+							conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+								[json.dumps(key), json.dumps(value), min(found[1], 1e300)])
+				with self.lock:
+					self._put(key, *found)
+			finally:
+				with self.lock: # only after the value is stored, so that nobody computes it again
+					self.pending.pop(key, None)
+			return found[0]